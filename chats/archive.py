@@ -0,0 +1,76 @@
+"""
+Hot/cold tiering of messages.
+
+archive_messages() moves messages older than CHATS_ARCHIVE_AFTER_DAYS
+from the message table into message_archive (ArchivedMessage) in
+batches, one transaction per batch, so the hot table and its indexes
+only hold recent history. The latest message of a conversation stays
+hot since Conversation.last_message points at it.
+
+Archived messages are always older than the cutoff, and so older than
+every hot message of their conversation, as long as the age is not
+raised. Readers rely on that: a page
+going back in time only reaches the archive once the hot messages run
+out, and one going forward only reads it when it starts before the
+cutoff. The archive is read-only through the API and not covered by
+message search.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedMessage, Conversation, Message
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVED_FIELDS = ('message_id', 'sender_id', 'conversation_id', 'message_body', 'sent_at')
+
+
+def archive_cutoff():
+    """Messages sent before this are archived"""
+    days = getattr(settings, 'CHATS_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def may_be_archived(sent_at):
+    """Return True if messages sent after `sent_at` may be in the archive"""
+    return sent_at < archive_cutoff()
+
+
+def archivable_messages(cutoff):
+    latest = Conversation.objects.filter(last_message__isnull=False).values('last_message')
+    return Message.objects.filter(sent_at__lt=cutoff).exclude(pk__in=latest)
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move the oldest `batch_size` archivable messages and return how many moved"""
+    with transaction.atomic():
+        rows = list(
+            archivable_messages(cutoff)
+            .order_by('sent_at', 'message_id')
+            .values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+        Message.objects.filter(pk__in=[row['message_id'] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_messages(cutoff=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive every message sent before `cutoff` and return how many moved"""
+    cutoff = cutoff or archive_cutoff()
+    total = 0
+    while moved := archive_batch(cutoff, batch_size):
+        total += moved
+    return total
+
+
+def conversation_history(conversation):
+    """The archived and hot messages of a conversation, oldest first"""
+    return [
+        ArchivedMessage.objects.filter(conversation=conversation),
+        Message.objects.filter(conversation=conversation),
+    ]
@@ -0,0 +1,289 @@
+"""
+Async versions of the hot read endpoints, mounted under api/async/.
+
+They run on the event loop through messaging_app/asgi.py and use the
+async ORM, so a request waiting on the database or cache does not pin a
+worker thread. DRF views are synchronous, so these are plain Django
+views: authentication (JWT header only), filtering, conditional
+requests and serialization reuse the classes of the viewsets, with
+every query awaited or done up front.
+
+For the parameters they support, they return the same bodies as their
+viewset counterparts: search, ordering and filters through the
+viewsets' filter backends, page-number pagination and If-None-Match /
+If-Modified-Since on the message list and conversation detail. Sparse
+fieldsets (?fields=, ?expand=), cursor pagination and ?shape= are only
+served by the viewsets; requests using them are refused with 400 rather
+than answered with a different body.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, ValidationError as FilterError
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import views
+from .auth import CustomJWTAuthentication
+from .conditional import conversation_validators, user_validators
+from .membership import ais_participant
+from .metrics import phase
+from .models import Conversation, Message
+from .pagination import MessageCursorPagination
+from .permissions import is_admin
+from .renderers import FastJSONRenderer
+from .routers import is_pinned_to_primary, replica_reads
+from .search import search_messages
+from .selection import EXPAND_PARAM, FIELDS_PARAM
+from .serializers import (
+    ConversationSerializer,
+    MessageSearchResultSerializer,
+    message_values,
+    serialize_message_values,
+)
+
+PAGE_QUERY_PARAM = 'page'
+
+# Parameters only the viewsets serve
+SELECTION_PARAMS = (FIELDS_PARAM, EXPAND_PARAM)
+CURSOR_PARAMS = (
+    MessageCursorPagination.mode_query_param,
+    MessageCursorPagination.before_query_param,
+    MessageCursorPagination.after_query_param,
+)
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    with phase('render'):
+        content = FastJSONRenderer().render(data)
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+def authenticate(request):
+    """Return the user of a request from its JWT Authorization header, or None"""
+    result = CustomJWTAuthentication().authenticate(request)
+    return result[0] if result else None
+
+
+def unsupported_response(request, params):
+    """A 400 response naming the `params` the request uses, or None if it uses none"""
+    used = [param for param in params if param in request.GET]
+    if not used:
+        return None
+    return json_response(
+        {'detail': f'Not supported by the async endpoints: {", ".join(used)}. '
+                   'Use the endpoint under /api/ instead.'},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def async_api_view(view=None, *, unsupported=SELECTION_PARAMS):
+    """
+    Authenticate the request and pass the user to an async view, which
+    reads from a replica unless the user is pinned to the primary.
+    Requests using any of the `unsupported` parameters get a 400.
+    """
+    if view is None:
+        return lambda view: async_api_view(view, unsupported=unsupported)
+
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return json_response(
+                {'detail': f'Method "{request.method}" not allowed.'},
+                status=status.HTTP_405_METHOD_NOT_ALLOWED
+            )
+        refused = unsupported_response(request, unsupported)
+        if refused is not None:
+            return refused
+        try:
+            user = await sync_to_async(authenticate)(request)
+        except AuthenticationFailed as exc:
+            return json_response({'detail': str(exc.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if user is None:
+            return json_response(
+                {'detail': 'Authentication credentials were not provided.'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        with replica_reads(not is_pinned_to_primary(user.pk)):
+            return await view(request, user, *args, **kwargs)
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    return wrapper
+
+
+async def paginate(request, queryset, serialize):
+    """
+    Page-number pagination with the same envelope and links as the
+    PageNumberPagination the viewsets use. Returns a response.
+    """
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    count = await queryset.acount()
+    last_page = max(1, -(-count // page_size))
+    try:
+        page = int(request.GET.get(PAGE_QUERY_PARAM, 1))
+    except ValueError:
+        page = 0
+    if not 1 <= page <= last_page:
+        return json_response({'detail': 'Invalid page.'}, status=status.HTTP_404_NOT_FOUND)
+
+    offset = (page - 1) * page_size
+    rows = [row async for row in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, PAGE_QUERY_PARAM, page + 1) if page < last_page else None
+    previous_link = None
+    if page > 2:
+        previous_link = replace_query_param(url, PAGE_QUERY_PARAM, page - 1)
+    elif page == 2:
+        previous_link = remove_query_param(url, PAGE_QUERY_PARAM)
+    return json_response({
+        'count': count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': serialize(rows),
+    })
+
+
+def filter_queryset(viewset, request, queryset):
+    """Filter `queryset` with the filter backends of `viewset`, as its list action does"""
+    view = viewset(request=Request(request), action='list', format_kwarg=None, args=(), kwargs={})
+    return view.filter_queryset(queryset)
+
+
+async def afilter_queryset(viewset, request, queryset):
+    """
+    filter_queryset for async views, which may validate filter values
+    against the database. Returns (queryset, error response).
+    """
+    try:
+        return await sync_to_async(filter_queryset)(viewset, request, queryset), None
+    except FilterError as exc:
+        return None, json_response(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def render_messages(messages, search):
+    """Serialize messages, ranked search results through the model serializer"""
+    if search:
+        rows = [message async for message in messages.select_related('sender')]
+        return MessageSearchResultSerializer(rows, many=True).data
+    return serialize_message_values([row async for row in message_values(messages)])
+
+
+def visible_messages(user):
+    if is_admin(user):
+        return Message.objects.all()
+    return Message.objects.filter(conversation__participants=user)
+
+
+def visible_conversations(user):
+    if is_admin(user):
+        return Conversation.objects.all()
+    return Conversation.objects.filter(participants=user)
+
+
+@async_api_view(unsupported=SELECTION_PARAMS + CURSOR_PARAMS + (views.SHAPE_PARAM,))
+async def message_list(request, user):
+    """
+    Paginated messages of the user's conversations, like GET /api/messages/,
+    with its ?search=, ?ordering=, ?conversation= and ?sender=
+    """
+    validators = None
+    if not is_admin(user):
+        validators = await sync_to_async(user_validators)(user)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+    messages, error = await afilter_queryset(views.MessageViewSet, request, visible_messages(user))
+    if error is not None:
+        return error
+    if request.GET.get('search', '').strip():
+        response = await paginate(
+            request, messages.select_related('sender'),
+            lambda rows: MessageSearchResultSerializer(rows, many=True).data
+        )
+    else:
+        response = await paginate(request, message_values(messages), serialize_message_values)
+    if validators is not None and response.status_code == status.HTTP_200_OK:
+        validators.apply(request, response)
+    return response
+
+
+@async_api_view
+async def conversation_list(request, user):
+    """
+    Paginated conversations with participants and messages, like
+    GET /api/conversations/, with its ?search=, ?ordering= and ?participants=
+    """
+    conversations, error = await afilter_queryset(
+        views.ConversationViewSet, request,
+        visible_conversations(user).order_by('created_at', 'conversation_id')
+    )
+    if error is not None:
+        return error
+    conversations = conversations.prefetch_related(*ConversationSerializer.get_prefetch_lookups())
+    return await paginate(
+        request, conversations, lambda rows: ConversationSerializer(rows, many=True).data
+    )
+
+
+@async_api_view
+async def conversation_detail(request, user, pk):
+    """One conversation with participants and messages"""
+    not_found = json_response(
+        {'detail': 'No Conversation matches the given query.'}, status=status.HTTP_404_NOT_FOUND
+    )
+    if not (is_admin(user) or await ais_participant(pk, user.user_id)):
+        return not_found
+    validators = await sync_to_async(conversation_validators)(pk)
+    if validators is not None:
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+    conversations = Conversation.objects.filter(pk=pk).prefetch_related(
+        *ConversationSerializer.get_prefetch_lookups()
+    )
+    conversation = [row async for row in conversations]
+    if not conversation:
+        return not_found
+    response = json_response(ConversationSerializer(conversation[0]).data)
+    return validators.apply(request, response) if validators is not None else response
+
+
+@async_api_view
+async def my_messages(request, user):
+    """All messages sent by the user, optionally searched with ?message_body="""
+    messages = Message.objects.filter(sender=user)
+    search = request.GET.get('message_body')
+    if search:
+        messages = await sync_to_async(search_messages)(messages, search)
+    return json_response(await render_messages(messages, search))
+
+
+@async_api_view
+async def conversation_messages(request, user):
+    """Messages of ?conversation_id=, optionally searched with ?filter="""
+    conversation_id = request.GET.get('conversation_id')
+    if not conversation_id:
+        return json_response(
+            {'error': 'conversation_id parameter is required'}, status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        conversation = await Conversation.objects.filter(conversation_id=conversation_id).afirst()
+    except ValidationError:
+        conversation = None
+    if conversation is None:
+        return json_response({'error': 'Conversation not found'}, status=status.HTTP_404_NOT_FOUND)
+    if not await ais_participant(conversation.pk, user.user_id):
+        return json_response(
+            {'error': 'You are not a participant in this conversation'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    messages = Message.objects.filter(conversation=conversation)
+    search = request.GET.get('filter')
+    if search:
+        messages = await sync_to_async(search_messages)(messages, search)
+    return json_response(await render_messages(messages, search))
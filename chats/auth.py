@@ -1,18 +1,54 @@
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
+# User fields copied into tokens so a user can be rebuilt without a query
+USER_CLAIM_FIELDS = ['email', 'first_name', 'last_name', 'role', 'is_staff', 'is_superuser', 'is_active']
+
+
+def get_user_cache():
+    return caches[getattr(settings, 'CHATS_USER_CACHE', 'default')]
+
+
+def user_cache_key(user_id):
+    return f'chats:auth:user:{user_id}'
+
+
+def invalidate_user(user_id):
+    """Drop the cached user so the next request reloads it"""
+    get_user_cache().delete(user_cache_key(user_id))
+
+
+def add_user_claims(token, user):
+    """Copy USER_CLAIM_FIELDS onto a token"""
+    for field in USER_CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    return token
+
 
 class CustomJWTAuthentication(JWTAuthentication):
     """
-    Custom JWT authentication class with additional validation if needed.
+    JWT authentication that avoids a user query on every request.
+
+    Resolved users are kept in a bounded, expiring cache keyed by the
+    user_id claim and dropped whenever the user is saved or deleted. With
+    CHATS_JWT_USER_FROM_CLAIMS enabled, safe (read-only) requests build the
+    user straight from the signed token claims and skip the database; such
+    a user only notices deactivation or profile changes once the token
+    expires, so writes always use the cached or database user.
     """
-    
+
     def authenticate(self, request):
         header = self.get_header(request)
-        
+
         if header is None:
             return None
 
@@ -21,9 +57,55 @@ class CustomJWTAuthentication(JWTAuthentication):
             return None
 
         validated_token = self.get_validated_token(raw_token)
-        
+
+        if request.method in SAFE_METHODS and getattr(settings, 'CHATS_JWT_USER_FROM_CLAIMS', False):
+            user = self.get_user_from_claims(validated_token)
+            if user is not None:
+                return user, validated_token
+
         return self.get_user(validated_token), validated_token
 
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        cache = get_user_cache()
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(user_cache_key(user_id), user)
+            return user
+
+        # Repeat the checks the database lookup would have made
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        return user
+
+    def get_user_from_claims(self, validated_token):
+        """
+        Build a User from token claims without touching the database, or
+        return None if the token predates the user claims. Fields that are
+        not in the token are deferred and load lazily if accessed.
+        """
+        claims = {field: validated_token.get(field) for field in USER_CLAIM_FIELDS}
+        if api_settings.USER_ID_CLAIM not in validated_token or None in claims.values():
+            return None
+        if not claims['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        claims[api_settings.USER_ID_FIELD] = validated_token[api_settings.USER_ID_CLAIM]
+        fields = [f for f in User._meta.concrete_fields if f.attname in claims]
+        return User.from_db(
+            'default',
+            [f.attname for f in fields],
+            [f.to_python(claims[f.attname]) for f in fields]
+        )
+
 
 def get_user_from_token(request):
     """
@@ -34,4 +116,4 @@ def get_user_from_token(request):
         user, token = auth.authenticate(request)
         return user
     except AuthenticationFailed:
-        return None
\ No newline at end of file
+        return None
@@ -1,8 +1,17 @@
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
+from .auth import User, add_user_claims
+
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # Carry the profile fields the API reads so reads can skip the user query
+        return add_user_claims(super().get_token(user), user)
+
     def validate(self, attrs):
         # Allow both username and email fields
         if 'email' in attrs and 'username' not in attrs:
@@ -11,5 +20,19 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         return super().validate(attrs)
 
 
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refresh that copies the user's current fields into the new access
+    token, instead of the ones the refresh token was issued with
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = User.objects.get(**{api_settings.USER_ID_FIELD: access[api_settings.USER_ID_CLAIM]})
+        data['access'] = str(add_user_claims(access, user))
+        return data
+
+
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Shared helpers for the bench_* management commands.
+
+Benchmarks run against a throwaway test database so they never touch the
+data in db.sqlite3.
+"""
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from .models import User, Conversation, Message, SyncCounter
+
+WORDS = (
+    'hello', 'meeting', 'tomorrow', 'lunch', 'deploy', 'review', 'coffee',
+    'booking', 'thanks', 'weekend', 'invoice', 'flight', 'dinner', 'update',
+    'schedule', 'question', 'project', 'call', 'later', 'great',
+)
+
+
+@contextmanager
+def isolated_database(verbosity=0):
+    """Create a fresh test database for the duration of the block"""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def use_database(config, name):
+    """Point the default alias of this process at `name` with `config`"""
+    connections.close_all()
+    connections.settings['default'] = connections.configure_settings({
+        'default': {**config, 'NAME': name, 'OPTIONS': dict(config['OPTIONS'])},
+    })['default']
+    del connections['default']
+
+
+def random_body(rng, min_words=3, max_words=20):
+    """
+    Return a random message body built from WORDS plus one rare topicNNNN
+    word, so benchmarks can search for both common and selective terms
+    """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    words.insert(rng.randrange(len(words) + 1), f'topic{rng.randrange(10000)}')
+    return ' '.join(words)
+
+
+def seed_users(count, batch_size=1000, password=None):
+    """
+    Bulk insert `count` users and return them. They can log in with
+    `password` if one is given, which is hashed once for all of them.
+    """
+    hashed = make_password(password) if password is not None else '!'
+    users = [
+        User(
+            user_id=uuid.uuid4(),
+            email=f'bench{i}-{uuid.uuid4().hex[:8]}@example.com',
+            first_name=f'First{i}',
+            last_name=f'Last{i}',
+            password=hashed,
+        )
+        for i in range(count)
+    ]
+    return User.objects.bulk_create(users, batch_size=batch_size)
+
+
+def seed_conversations(users, count, participants_per_conversation=2, rng=None):
+    """Bulk insert `count` conversations with random participants"""
+    rng = rng or random.Random(0)
+    conversations = Conversation.objects.bulk_create(
+        [Conversation(conversation_id=uuid.uuid4()) for _ in range(count)]
+    )
+    through = Conversation.participants.through
+    links = []
+    for conversation in conversations:
+        for user in rng.sample(users, min(participants_per_conversation, len(users))):
+            links.append(through(conversation_id=conversation.pk, user_id=user.pk))
+    through.objects.bulk_create(links, batch_size=1000)
+    return conversations
+
+
+def seed_messages(conversation, senders, count, rng=None, batch_size=5000, start=None):
+    """Bulk insert `count` messages into a conversation, one second apart"""
+    rng = rng or random.Random(0)
+    start = start or timezone.now() - timedelta(seconds=count)
+    with transaction.atomic():
+        first = SyncCounter.reserve(count) if count else 0
+        for offset in range(0, count, batch_size):
+            Message.objects.bulk_create(
+                [
+                    Message(
+                        message_id=uuid.uuid4(),
+                        conversation=conversation,
+                        sender=rng.choice(senders),
+                        message_body=random_body(rng),
+                        sent_at=start + timedelta(seconds=i),
+                        sync_seq=first + i,
+                    )
+                    for i in range(offset, min(offset + batch_size, count))
+                ],
+                batch_size=batch_size,
+            )
+
+
+def measure(func, repeat=5):
+    """Run `func` `repeat` times and return the median duration in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def asgi_get(application, path, query_string='', headers=()):
+    """
+    Send one GET request straight to an ASGI application, without a
+    server, and return its status code and body
+    """
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query_string.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), *headers],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 0),
+    }
+    request_sent = False
+    disconnected = asyncio.Event()
+    response = {'status': None, 'body': []}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client stays connected until the response is complete
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+            if not message.get('more_body'):
+                disconnected.set()
+
+    await application(scope, receive, send)
+    return response['status'], b''.join(response['body'])
+
+
+def percentile(values, fraction):
+    """Return the value below which `fraction` of the sorted values fall"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
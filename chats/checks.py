@@ -0,0 +1,29 @@
+"""
+System checks for settings that only matter once deployed.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends that are private to one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_membership_cache(app_configs, **kwargs):
+    """Warn when participant changes cannot reach the other workers"""
+    alias = getattr(settings, 'CHATS_MEMBERSHIP_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f"CHATS_MEMBERSHIP_CACHE uses {backend}, which is private to each process.",
+        hint=(
+            'With several workers, a participant removed from a conversation keeps access '
+            'in the other workers for up to CHATS_MEMBERSHIP_CACHE_TIMEOUT seconds. Use a '
+            'shared cache backend such as Redis or Memcached.'
+        ),
+        id='chats.W001',
+    )]
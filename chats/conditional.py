@@ -0,0 +1,88 @@
+"""
+Validators for HTTP conditional requests.
+
+A resource's ETag and Last-Modified are derived from the updated_at
+columns of the rows it is rendered from, read with one aggregate query,
+so an unchanged resource can be answered with 304 Not Modified before
+any serializer runs. Conversation.updated_at moves whenever a message is
+created, edited or deleted or the participants change; User.updated_at
+moves on every save of the user.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Conversation, User
+
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+
+class Validators:
+    """An ETag and Last-Modified pair for one representation of a resource"""
+
+    def __init__(self, parts, last_modified):
+        self.parts = [str(part) for part in parts]
+        self.last_modified = last_modified
+
+    def etag(self, request):
+        # The same data renders differently per format, so the format is part of the tag
+        renderer = getattr(request, 'accepted_renderer', None)
+        parts = self.parts + [getattr(renderer, 'format', '')]
+        return '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def not_modified(self, request):
+        """Return a 304 response if the client's copy is current, else None"""
+        if request.method not in CONDITIONAL_METHODS:
+            return None
+        # HTTP dates have whole-second precision; the ETag catches finer changes
+        last_modified = int(self.last_modified.timestamp()) if self.last_modified else None
+        return get_conditional_response(
+            request, etag=self.etag(request), last_modified=last_modified
+        )
+
+    def apply(self, request, response):
+        """Set the ETag and Last-Modified headers on a full response"""
+        response['ETag'] = self.etag(request)
+        if self.last_modified:
+            response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        return response
+
+
+def latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def conversation_validators(conversation_id):
+    """Validators for a conversation and its messages, or None if it does not exist"""
+    row = Conversation.objects.filter(pk=conversation_id).aggregate(
+        updated_at=Max('updated_at'),
+        participants_updated_at=Max('participants__updated_at'),
+        participant_count=Count('participants'),
+    )
+    if row['updated_at'] is None:
+        return None
+    return Validators(
+        [conversation_id, row['updated_at'], row['participants_updated_at'], row['participant_count']],
+        latest(row['updated_at'], row['participants_updated_at']),
+    )
+
+
+def user_validators(user):
+    """
+    Validators for a user and everything rendered from the user's
+    conversations: their messages and the other participants
+    """
+    row = User.objects.filter(pk=user.pk).aggregate(
+        updated_at=Max('updated_at'),
+        conversations_updated_at=Max('conversations__updated_at'),
+        conversation_count=Count('conversations', distinct=True),
+        participants_updated_at=Max('conversations__participants__updated_at'),
+    )
+    return Validators(
+        [user.pk, row['updated_at'], row['conversations_updated_at'],
+         row['conversation_count'], row['participants_updated_at']],
+        latest(row['updated_at'], row['conversations_updated_at'], row['participants_updated_at']),
+    )
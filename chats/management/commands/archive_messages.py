@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chats.archive import ARCHIVE_BATCH_SIZE, archive_cutoff, archive_messages
+
+
+class Command(BaseCommand):
+    help = 'Move messages older than CHATS_ARCHIVE_AFTER_DAYS into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int,
+            help='Archive messages older than this many days (default: CHATS_ARCHIVE_AFTER_DAYS)'
+        )
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        else:
+            cutoff = archive_cutoff()
+
+        archived = archive_messages(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} messages sent before {cutoff:%Y-%m-%d %H:%M}'))
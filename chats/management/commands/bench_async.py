@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chats.benchmarks import (
+    asgi_get,
+    isolated_database,
+    percentile,
+    seed_conversations,
+    seed_messages,
+    seed_users,
+)
+from messaging_app.asgi import application
+
+ENDPOINTS = (
+    ('sync', '/api/messages/'),
+    ('async', '/api/async/messages/'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the sync and async message list through the ASGI application '
+        'at increasing concurrency and report throughput and latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=400, help='Requests per concurrency level')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100])
+        parser.add_argument(
+            '--db-latency', type=float, default=0,
+            help='Milliseconds added to every query, standing in for a remote database',
+        )
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            users = seed_users(2)
+            conversation = seed_conversations(users, 1)[0]
+            seed_messages(conversation, users, options['messages'])
+            headers = [(b'authorization', f'Bearer {AccessToken.for_user(users[0])}'.encode())]
+            query = f'conversation={conversation.pk}'
+
+            if options['db_latency']:
+                delay = options['db_latency'] / 1000
+
+                def slow_query(execute, sql, params, many, context):
+                    time.sleep(delay)
+                    return execute(sql, params, many, context)
+
+                def add_latency(connection, **kwargs):
+                    connection.execute_wrappers.append(slow_query)
+
+                connection_created.connect(add_latency, weak=False)
+                connection.ensure_connection()
+                add_latency(connection)
+
+            self.stdout.write(
+                f'{"endpoint":>8} {"clients":>8} {"req/s":>10} {"p50 ms":>10} {"p99 ms":>10}'
+            )
+            for concurrency in options['concurrency']:
+                for name, path in ENDPOINTS:
+                    result = asyncio.run(self.load(path, query, headers, concurrency, options['requests']))
+                    self.stdout.write(
+                        f'{name:>8} {concurrency:>8} {result["throughput"]:>10.0f} '
+                        f'{result["p50"]:>10.1f} {result["p99"]:>10.1f}'
+                    )
+
+    async def load(self, path, query, headers, concurrency, total):
+        latencies = []
+        remaining = iter(range(total))
+
+        async def client():
+            for _ in remaining:
+                start = time.perf_counter()
+                status, _ = await asgi_get(application, path, query, headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert status == 200, status
+
+        # One warm-up request so connection setup is not counted
+        await asgi_get(application, path, query, headers)
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        return {
+            'throughput': total / elapsed,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+        }
@@ -0,0 +1,128 @@
+import random
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chats.benchmarks import isolated_database, seed_conversations, seed_messages, seed_users
+from chats.models import Conversation, ConversationParticipant, Message
+
+# Migration states to compare: the index set before and after the redesign
+INDEX_SETS = (
+    ('before', '0008_message_archive'),
+    ('after', '0009_index_redesign'),
+)
+KEYS = ('message_id', 'sent_at')
+
+
+def query_time(queryset, repeat):
+    """
+    Fastest of `repeat` runs of the SQL of `queryset`, rows fetched, in
+    milliseconds. The ORM's per-call overhead would hide differences of
+    a fraction of a millisecond, and the fastest run is the one least
+    disturbed by whatever else the host is doing.
+    """
+    sql, params = queryset.query.sql_with_params()
+    timings = []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare message insert throughput and read latency with the indexes '
+        'before and after migration 0009'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--conversations', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=50, help='Messages per conversation')
+        parser.add_argument('--inserts', type=int, default=2000, help='Messages sent per insert run')
+        parser.add_argument('--repeat', type=int, default=200, help='Runs of each read per round')
+        parser.add_argument('--rounds', type=int, default=5, help='Times each index set is measured')
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            rng = random.Random(0)
+            users = seed_users(options['users'])
+            conversations = seed_conversations(users, options['conversations'], 3, rng)
+            # A busy user, in a hundred conversations, whose reads are timed
+            user = users[0]
+            for conversation in conversations[:100]:
+                conversation.participants.add(user)
+            for conversation in conversations:
+                seed_messages(conversation, list(conversation.participants.all()), options['messages'], rng)
+            busy = conversations[0]
+            links = list(ConversationParticipant.objects.values_list('conversation_id', 'user_id'))
+
+            # The queries behind the read endpoints
+            reads = {
+                'conversation feed': Message.objects.filter(conversation=busy)
+                .order_by('-sent_at', '-message_id').values_list(*KEYS)[:50],
+                'my messages': Message.objects.filter(sender=user).order_by('sent_at').values_list(*KEYS),
+                'visible messages': Message.objects.filter(conversation__participants=user)
+                .order_by('-sent_at').values_list(*KEYS)[:50],
+                'my conversations': Conversation.objects.filter(participants=user).values_list('pk'),
+                'membership check': ConversationParticipant.objects.filter(
+                    conversation=busy, user=user
+                ).values_list('pk')[:1],
+            }
+
+            # Alternate the index sets so drift in the process or the
+            # database does not favour either
+            results = {label: {} for label, _ in INDEX_SETS}
+            for _ in range(options['rounds']):
+                for label, target in INDEX_SETS:
+                    call_command('migrate', 'chats', target, verbosity=0)
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                    for name, queryset in reads.items():
+                        results[label].setdefault(f'{name} ms', []).append(
+                            query_time(queryset, options['repeat'])
+                        )
+                    results[label].setdefault('inserts/s', []).append(
+                        self.insert_rate(links, options['inserts'], rng)
+                    )
+
+            # Change is the median of the per-round after/before ratios,
+            # which holds up better than the medians when the host's speed drifts
+            self.stdout.write(f'{"":>20} {"before":>10} {"after":>10} {"change":>8}')
+            for name in results['before']:
+                before, after = (results[label][name] for label, _ in INDEX_SETS)
+                change = statistics.median(a / b - 1 for a, b in zip(after, before))
+                digits = 0 if name == 'inserts/s' else 3
+                self.stdout.write(
+                    f'{name:>20} {statistics.median(before):>10.{digits}f} '
+                    f'{statistics.median(after):>10.{digits}f} {change:>+8.0%}'
+                )
+
+    def insert_rate(self, links, count, rng):
+        """
+        Send `count` messages the way the API does, one transaction each,
+        and return messages per second. They are deleted afterwards so
+        every run inserts into the same data.
+        """
+        sent = []
+        start = time.perf_counter()
+        for _ in range(count):
+            conversation_id, user_id = rng.choice(links)
+            with transaction.atomic():
+                ConversationParticipant.objects.filter(
+                    conversation_id=conversation_id, user_id=user_id
+                ).exists()
+                message = Message.objects.create(
+                    conversation_id=conversation_id, sender_id=user_id, message_body='benchmark'
+                )
+                Conversation.record_messages([message])
+            sent.append(message.pk)
+        elapsed = time.perf_counter() - start
+        Message.objects.filter(pk__in=sent).delete()
+        return count / elapsed
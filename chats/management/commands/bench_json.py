@@ -0,0 +1,69 @@
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from chats.benchmarks import isolated_database, measure, seed_conversations, seed_messages, seed_users
+from chats.models import Message
+from chats.parsers import FastJSONParser
+from chats.renderers import FastJSONRenderer
+from chats.serializers import MessageSerializer, message_values, serialize_message_values
+
+
+def peak_allocated(func):
+    """Return the peak traced memory of one call in KiB"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+class Command(BaseCommand):
+    help = 'Compare the stdlib and orjson renderers and parsers on message list payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        repeat = options['repeat']
+        with isolated_database():
+            users = seed_users(20)
+            conversation = seed_conversations(users, 1, participants_per_conversation=20)[0]
+            seed_messages(conversation, users, max(sizes))
+            messages = Message.objects.filter(conversation=conversation).order_by('sent_at')
+
+            self.stdout.write(
+                f'{"rows":>6} {"payload":>10} {"render ms":>17} {"render peak KiB":>21}'
+                f' {"parse ms":>17}'
+            )
+            self.stdout.write(f'{"":>17} {"stdlib / orjson":>17} {"stdlib / orjson":>21} {"stdlib / orjson":>17}')
+            for size in sizes:
+                # Model serializer output (ReturnList of dicts) and the values() fast path
+                data = {'results': MessageSerializer(messages.select_related('sender')[:size], many=True).data}
+                assert data['results'] == serialize_message_values(message_values(messages)[:size])
+                body = JSONRenderer().render(data)
+
+                render = [
+                    measure(lambda: renderer.render(data), repeat)
+                    for renderer in (JSONRenderer(), FastJSONRenderer())
+                ]
+                peak = [
+                    peak_allocated(lambda: renderer.render(data))
+                    for renderer in (JSONRenderer(), FastJSONRenderer())
+                ]
+                parse = [
+                    measure(lambda: parser.parse(BytesIO(body)), repeat)
+                    for parser in (JSONParser(), FastJSONParser())
+                ]
+                self.stdout.write(
+                    f'{size:>6} {len(body) / 1024:>7.0f}KiB'
+                    f' {render[0]:>8.2f} /{render[1]:>7.2f}'
+                    f' {peak[0]:>10.0f} /{peak[1]:>9.0f}'
+                    f' {parse[0]:>8.2f} /{parse[1]:>7.2f}'
+                )
@@ -0,0 +1,341 @@
+import http.client
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from chats.benchmarks import (
+    WORDS,
+    percentile,
+    random_body,
+    seed_conversations,
+    seed_messages,
+    seed_users,
+    use_database,
+)
+from chats.models import Conversation, ConversationParticipant
+
+PASSWORD = 'load-test-password'
+DEFAULT_MIX = 'send=1,inbox=3,history=4,search=1'
+SERVER_START_TIMEOUT = 30
+
+
+def parse_mix(value):
+    """Parse 'name=weight,...' into a {name: weight} dict of known operations"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise CommandError(f'Unknown operation {name!r}, expected one of {", ".join(OPERATIONS)}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid weight for {name!r}: {weight!r}')
+    if not any(weight > 0 for weight in mix.values()):
+        raise CommandError('The mix needs at least one positive weight')
+    return mix
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Client:
+    """
+    One simulated user with its own keep-alive connection, replaying
+    operations picked from the mix
+    """
+
+    def __init__(self, port, token, conversations, rng):
+        self.port = port
+        self.headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/json'}
+        self.conversations = conversations
+        self.rng = rng
+        # Where the user stopped scrolling back through each conversation
+        self.older = {}
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """Send a request and return (status, decoded JSON body or None)"""
+        headers = dict(self.headers)
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        try:
+            return response.status, json.loads(content) if content else None
+        except ValueError:
+            return response.status, None
+
+    def send(self):
+        conversation = self.rng.choice(self.conversations)
+        return self.request('POST', '/api/messages/', {
+            'conversation': conversation, 'message_body': random_body(self.rng),
+        })
+
+    def inbox(self):
+        return self.request('GET', '/api/conversations/inbox/')
+
+    def history(self):
+        """The latest page of a conversation, then older pages on later calls"""
+        conversation = self.rng.choice(self.conversations)
+        path = self.older.pop(conversation, None) or (
+            f'/api/conversations/{conversation}/messages/?'
+            + urlencode({'pagination': 'cursor', 'page_size': 20})
+        )
+        status, data = self.request('GET', path)
+        if data and data.get('previous'):
+            older = urlsplit(data['previous'])
+            self.older[conversation] = f'{older.path}?{older.query}'
+        return status, data
+
+    def search(self, term=None):
+        if term is None:
+            # Mostly common words, sometimes a selective one
+            term = self.rng.choice(WORDS) if self.rng.random() < 0.7 else f'topic{self.rng.randrange(10000)}'
+        return self.request('GET', '/api/messages/?' + urlencode({'search': term}))
+
+
+OPERATIONS = {
+    'send': Client.send,
+    'inbox': Client.inbox,
+    'history': Client.history,
+    'search': Client.search,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a database, start a server on it and replay a mix of API traffic '
+        'from concurrent clients, reporting throughput and latency per '
+        'operation as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--conversations', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=100000, help='Messages in total')
+        parser.add_argument('--participants', type=int, default=2, help='Participants per conversation')
+        parser.add_argument('--clients', type=int, default=20, help='Concurrent clients, one user each')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds of measured traffic')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of traffic before measuring')
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help=f'Relative weights of the operations {", ".join(OPERATIONS)} (default {DEFAULT_MIX})',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the data and the traffic')
+        parser.add_argument(
+            '--server-command',
+            help='Command starting the server, with {port} in it; defaults to manage.py runserver',
+        )
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'loadtest.sqlite3')
+            self.stderr.write('Seeding the database...')
+            memberships = self.seed(path, options)
+
+            port = free_port()
+            server = self.start_server(path, port, options['server_command'])
+            try:
+                self.stderr.write('Minting tokens...')
+                clients = self.make_clients(port, memberships, options)
+                self.stderr.write(f'Running {options["clients"]} clients for {options["duration"]:g}s...')
+                samples, elapsed = self.run(clients, mix, options['warmup'], options['duration'])
+            finally:
+                server.terminate()
+                server.wait()
+
+        report = self.report(samples, elapsed, mix, options)
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+
+    def seed(self, path, options):
+        """Create and fill the database; return {email: [conversation ids]} in seeding order"""
+        rng = random.Random(options['seed'])
+        use_database(settings.DATABASES['default'], path)
+        call_command('migrate', verbosity=0)
+        users = seed_users(options['users'], password=PASSWORD)
+        conversations = seed_conversations(users, options['conversations'], options['participants'], rng)
+        per_conversation, extra = divmod(options['messages'], len(conversations))
+        for index, conversation in enumerate(conversations):
+            count = per_conversation + (index < extra)
+            if count:
+                senders = list(conversation.participants.all())
+                seed_messages(conversation, senders, count, rng)
+        Conversation.objects.recompute_activity()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            # What `manage.py enable_wal` does for a deployed database
+            cursor.execute('PRAGMA journal_mode = WAL')
+
+        # Keyed and ordered by seeding order, so the same seed picks the
+        # same users and conversations although their ids are random
+        user_order = {user.pk: index for index, user in enumerate(users)}
+        conversation_order = {conversation.pk: index for index, conversation in enumerate(conversations)}
+        memberships = {}
+        rows = ConversationParticipant.objects.values_list('user_id', 'user__email', 'conversation_id')
+        for user_id, email, conversation_id in sorted(
+            rows, key=lambda row: (user_order[row[0]], conversation_order[row[2]])
+        ):
+            memberships.setdefault(email, []).append(str(conversation_id))
+        connections.close_all()
+        return memberships
+
+    def start_server(self, path, port, command):
+        if command:
+            args = shlex.split(command.format(port=port))
+        else:
+            args = [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']
+        server = subprocess.Popen(
+            args, cwd=settings.BASE_DIR, env={**os.environ, 'CHATS_DB_PATH': path},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'The server exited with status {server.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'The server did not accept connections within {SERVER_START_TIMEOUT}s')
+
+    def make_clients(self, port, memberships, options):
+        """One client per user, picked at random among users with conversations"""
+        rng = random.Random(options['seed'])
+        emails = rng.sample(list(memberships), min(options['clients'], len(memberships)))
+        clients = []
+        for index, email in enumerate(emails):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.request(
+                'POST', '/api/auth/token/', json.dumps({'email': email, 'password': PASSWORD}),
+                {'Content-Type': 'application/json'},
+            )
+            response = connection.getresponse()
+            body = response.read()
+            connection.close()
+            if response.status != 200:
+                raise CommandError(f'Could not get a token for {email}: {response.status} {body[:200]!r}')
+            token = json.loads(body)['access']
+            clients.append(Client(port, token, memberships[email], random.Random(f'{options["seed"]}-{index}')))
+        return clients
+
+    def run(self, clients, mix, warmup, duration):
+        """
+        Replay the mix from every client at once; return the samples taken
+        after the warm-up as (operation, milliseconds, status) and the
+        measured seconds
+        """
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        measure_from = time.perf_counter() + warmup
+        stop_at = measure_from + duration
+        samples = []
+
+        def replay(client):
+            taken = []
+            while True:
+                name = client.rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                if start >= stop_at:
+                    break
+                try:
+                    status = OPERATIONS[name](client)[0]
+                except (OSError, http.client.HTTPException):
+                    status = None
+                if start >= measure_from:
+                    taken.append((name, (time.perf_counter() - start) * 1000, status))
+            samples.extend(taken)
+
+        threads = [threading.Thread(target=replay, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Requests still running at stop_at finish a little after it
+        elapsed = max(duration, time.perf_counter() - measure_from)
+        return samples, elapsed
+
+    def report(self, samples, elapsed, mix, options):
+        def summarize(taken):
+            latencies = [ms for _, ms, _ in taken]
+            statuses = {}
+            for _, _, status in taken:
+                key = str(status) if status is not None else 'error'
+                statuses[key] = statuses.get(key, 0) + 1
+            errors = sum(1 for _, _, status in taken if status is None or status >= 400)
+            return {
+                'requests': len(taken),
+                'errors': errors,
+                'throughput': round(len(taken) / elapsed, 2),
+                'p50': round(percentile(latencies, 0.5), 2) if latencies else None,
+                'p95': round(percentile(latencies, 0.95), 2) if latencies else None,
+                'p99': round(percentile(latencies, 0.99), 2) if latencies else None,
+                'statuses': statuses,
+            }
+
+        return {
+            'commit': git_commit(),
+            'config': {
+                'users': options['users'],
+                'conversations': options['conversations'],
+                'messages': options['messages'],
+                'participants': options['participants'],
+                'clients': options['clients'],
+                'duration': options['duration'],
+                'warmup': options['warmup'],
+                'mix': mix,
+                'seed': options['seed'],
+                'server': options['server_command'] or 'runserver',
+            },
+            'unit': 'ms',
+            'total': summarize(samples),
+            'operations': {
+                name: summarize([sample for sample in samples if sample[0] == name]) for name in mix
+            },
+        }
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from chats.benchmarks import isolated_database, measure, seed_conversations, seed_messages, seed_users
+from chats.models import Message
+from chats.pagination import encode_cursor
+
+
+class Command(BaseCommand):
+    help = 'Compare page-number and cursor pagination latency as message history grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        total = options['messages']
+        page_size = options['page_size']
+        with isolated_database():
+            users = seed_users(2)
+            conversation = seed_conversations(users, 1)[0]
+            seed_messages(conversation, users, total)
+
+            client = APIClient()
+            client.force_authenticate(users[0])
+            url = '/api/messages/'
+
+            self.stdout.write(f'{"depth":>10} {"page-number ms":>16} {"cursor ms":>12}')
+            depth = page_size
+            while depth <= total:
+                page = depth // page_size
+                # The cursor for a page is the oldest message of the page above it
+                anchor = (
+                    Message.objects.filter(conversation=conversation)
+                    .order_by('-sent_at', '-message_id')
+                    .values('sent_at', 'message_id')[depth - page_size]
+                )
+                cursor = encode_cursor(anchor['sent_at'], anchor['message_id'])
+
+                page_ms = measure(
+                    lambda: client.get(url, {'conversation': conversation.pk, 'page': page, 'ordering': '-sent_at'}),
+                    options['repeat'],
+                )
+                cursor_ms = measure(
+                    lambda: client.get(url, {'conversation': conversation.pk, 'before': cursor, 'page_size': page_size}),
+                    options['repeat'],
+                )
+                self.stdout.write(f'{depth:>10} {page_ms:>16.2f} {cursor_ms:>12.2f}')
+                depth *= 10
@@ -0,0 +1,43 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from chats.benchmarks import isolated_database, measure, seed_conversations, seed_messages, seed_users
+from chats.models import Message
+from chats.search import search_messages
+
+
+class Command(BaseCommand):
+    help = 'Compare icontains scans with the full-text index over seeded messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--conversations', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--terms', nargs='+', default=['topic4242', 'invoice', 'flight dinner', 'sched'])
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        total = options['messages']
+        with isolated_database():
+            users = seed_users(20)
+            conversations = seed_conversations(users, options['conversations'], rng=rng)
+            per_conversation = total // len(conversations)
+            for conversation in conversations:
+                seed_messages(conversation, users, per_conversation, rng=rng)
+            self.stdout.write(f'Seeded {Message.objects.count()} messages')
+
+            messages = Message.objects.all()
+            self.stdout.write(f'{"term":>16} {"icontains ms":>14} {"full-text ms":>14}')
+            for term in options['terms']:
+                like = messages
+                for word in term.split():
+                    like = like.filter(message_body__icontains=word)
+                ranked = search_messages(messages, term)
+                # A paginated search response runs a COUNT and fetches the first page
+                like_ms = measure(
+                    lambda: (like.count(), list(like.order_by('-sent_at')[:20])),
+                    options['repeat']
+                )
+                fts_ms = measure(lambda: (ranked.count(), list(ranked[:20])), options['repeat'])
+                self.stdout.write(f'{term:>16} {like_ms:>14.2f} {fts_ms:>14.2f}')
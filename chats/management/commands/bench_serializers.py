@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from chats.benchmarks import isolated_database, measure, seed_conversations, seed_messages, seed_users
+from chats.models import Message
+from chats.serializers import MessageSerializer, message_values, serialize_message_values
+
+
+class Command(BaseCommand):
+    help = 'Compare MessageSerializer with the values() fast path in rows per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        sizes = options['sizes']
+        repeat = options['repeat']
+        with isolated_database():
+            users = seed_users(20)
+            conversation = seed_conversations(users, 1, participants_per_conversation=20)[0]
+            seed_messages(conversation, users, max(sizes))
+            messages = Message.objects.filter(conversation=conversation).order_by('sent_at')
+
+            self.stdout.write('rows/s, query and serialization / serialization alone')
+            self.stdout.write(f'{"rows":>8} {"serializer":>22} {"fast path":>22}')
+            for size in sizes:
+                instances = list(messages.select_related('sender')[:size])
+                rows = list(message_values(messages)[:size])
+                assert MessageSerializer(instances, many=True).data == serialize_message_values(rows)
+
+                timings = [
+                    measure(lambda: MessageSerializer(messages.select_related('sender')[:size], many=True).data, repeat),
+                    measure(lambda: MessageSerializer(instances, many=True).data, repeat),
+                    measure(lambda: serialize_message_values(message_values(messages)[:size]), repeat),
+                    measure(lambda: serialize_message_values(rows), repeat),
+                ]
+                rates = [f'{size / ms * 1000:,.0f}' for ms in timings]
+                self.stdout.write(
+                    f'{size:>8} {rates[0]:>10} / {rates[1]:>9} {rates[2]:>10} / {rates[3]:>9}'
+                )
@@ -0,0 +1,106 @@
+import multiprocessing
+import random
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connections, transaction
+
+from chats.benchmarks import seed_conversations, seed_users, use_database
+from chats.models import Conversation, Message
+
+CONFIGS = {
+    # Django's SQLite backend as configured before: rollback journal,
+    # deferred transactions and a new connection per request
+    'stock': {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {'timeout': 5}, 'CONN_MAX_AGE': 0},
+    'tuned': {
+        'ENGINE': 'chats.sqlite',
+        'OPTIONS': {'timeout': 5, 'pragmas': {'journal_mode': 'WAL'}},
+        'CONN_MAX_AGE': 60,
+    },
+}
+
+
+def prepare(config, name, conversation_count):
+    use_database(config, name)
+    call_command('migrate', verbosity=0)
+    users = seed_users(conversation_count * 2)
+    seed_conversations(users, conversation_count)
+    connections.close_all()
+
+
+def write_messages(config, name, duration, seed, results):
+    """
+    Send messages for `duration` seconds the way the API does: a membership
+    check, the insert and the activity update in one transaction, with the
+    connection handled at the end of each request per CONN_MAX_AGE
+    """
+    use_database(config, name)
+    rng = random.Random(seed)
+    links = list(Conversation.participants.through.objects.values_list('conversation_id', 'user_id'))
+    close_old_connections()
+    written = locked = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        conversation_id, user_id = rng.choice(links)
+        try:
+            with transaction.atomic():
+                Conversation.participants.through.objects.filter(
+                    conversation_id=conversation_id, user_id=user_id
+                ).exists()
+                message = Message.objects.create(
+                    conversation_id=conversation_id, sender_id=user_id, message_body='benchmark'
+                )
+                Conversation.record_messages([message])
+            written += 1
+        except OperationalError as exc:
+            if 'database is locked' not in str(exc):
+                raise
+            locked += 1
+        close_old_connections()
+    connections.close_all()
+    results.put((written, locked))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent message writes from several processes on the stock '
+        'SQLite backend and on chats.sqlite'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+        parser.add_argument('--duration', type=float, default=5, help='Seconds of writing per run')
+        parser.add_argument('--conversations', type=int, default=100)
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(f'{"backend":>8} {"workers":>8} {"writes/s":>10} {"locked":>8}')
+        for workers in options['workers']:
+            for label, config in CONFIGS.items():
+                with tempfile.TemporaryDirectory() as directory:
+                    name = f'{directory}/bench.sqlite3'
+                    setup = context.Process(target=prepare, args=(config, name, options['conversations']))
+                    setup.start()
+                    setup.join()
+
+                    results = context.Queue()
+                    processes = [
+                        context.Process(
+                            target=write_messages,
+                            args=(config, name, options['duration'], seed, results),
+                        )
+                        for seed in range(workers)
+                    ]
+                    for process in processes:
+                        process.start()
+                    totals = [results.get() for _ in processes]
+                    for process in processes:
+                        process.join()
+
+                written = sum(written for written, _ in totals)
+                locked = sum(locked for _, locked in totals)
+                self.stdout.write(
+                    f'{label:>8} {workers:>8} {written / options["duration"]:>10.0f} {locked:>8}'
+                )
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIClient
+
+from chats.benchmarks import isolated_database, measure, seed_conversations, seed_messages, seed_users
+from chats.models import Message, SyncCounter
+from chats.sync import encode_mark
+
+
+class Command(BaseCommand):
+    help = 'Compare a full reconnect re-fetch with delta sync from a high-water mark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=2000, help='Messages per conversation')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--writes', type=int, default=500,
+            help='Messages sent one at a time to time the sync counter; 0 to skip'
+        )
+
+    def handle(self, *args, **options):
+        with isolated_database():
+            users = seed_users(2)
+            conversations = seed_conversations(users, options['conversations'])
+            for conversation in conversations:
+                seed_messages(conversation, users, options['messages'])
+
+            client = APIClient()
+            client.force_authenticate(users[0])
+
+            def refetch():
+                # Every page of conversations, then every conversation's messages
+                url = '/api/conversations/'
+                while url:
+                    page = client.get(url).data
+                    for conversation in page['results']:
+                        client.get(f"/api/conversations/{conversation['conversation_id']}/messages/")
+                    url = page['next']
+
+            total = Message.objects.count()
+            self.stdout.write(f'{total} messages in {len(conversations)} conversations')
+            self.stdout.write(f'{"full re-fetch":>16} {measure(refetch, 1):>12.2f} ms')
+
+            newest = Message.objects.order_by('-sync_seq').values_list('sync_seq', flat=True)
+            for missed in (0, 10, 100, 1000):
+                since = encode_mark(newest[missed])
+                sync_ms = measure(
+                    lambda: client.get('/api/messages/sync/', {'since': since, 'limit': 1000}),
+                    options['repeat'],
+                )
+                self.stdout.write(f'{f"sync {missed} new":>16} {sync_ms:>12.2f} ms')
+
+            writes = options['writes']
+            if writes:
+                # Each message write reserves a number from the single counter row
+                def send():
+                    for _ in range(writes):
+                        Message.objects.create(
+                            conversation=conversations[0], sender=users[0], message_body='hello'
+                        )
+
+                def reserve():
+                    # In one transaction: the statement a send adds, not a commit
+                    with transaction.atomic():
+                        for _ in range(writes):
+                            SyncCounter.reserve()
+
+                send_ms = measure(send, options['repeat']) / writes
+                reserve_ms = measure(reserve, options['repeat']) / writes
+                self.stdout.write(f'{"send":>16} {send_ms:>12.3f} ms per message')
+                self.stdout.write(
+                    f'{"of which counter":>16} {reserve_ms:>12.3f} ms per message'
+                    f' ({reserve_ms / send_ms:.0%})'
+                )
@@ -0,0 +1,52 @@
+import gzip
+from io import BytesIO
+
+import msgpack
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+
+from chats.benchmarks import isolated_database, measure, seed_conversations, seed_messages, seed_users
+from chats.models import Message
+from chats.renderers import FastJSONRenderer, MessagePackRenderer
+from chats.serializers import message_values, normalize_senders, serialize_message_values
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and encode/decode time of JSON and MessagePack, nested and normalized'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--participants', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        with isolated_database():
+            users = seed_users(options['participants'])
+            conversation = seed_conversations(users, 1, participants_per_conversation=len(users))[0]
+            seed_messages(conversation, users, options['messages'])
+            results = serialize_message_values(
+                message_values(Message.objects.filter(conversation=conversation))
+            )
+            messages, senders = normalize_senders(results)
+            shapes = {
+                'nested': {'results': results},
+                'normalized': {'results': messages, 'users': senders},
+            }
+            formats = {
+                'json': (FastJSONRenderer().render, lambda body: JSONParser().parse(BytesIO(body))),
+                'msgpack': (MessagePackRenderer().render, msgpack.unpackb),
+            }
+
+            self.stdout.write(
+                f'{options["messages"]} messages from {len(users)} senders\n'
+                f'{"format":>19} {"bytes":>9} {"gzip bytes":>11} {"encode ms":>10} {"decode ms":>10}'
+            )
+            for shape, data in shapes.items():
+                for name, (encode, decode) in formats.items():
+                    body = encode(data)
+                    self.stdout.write(
+                        f'{name + " " + shape:>19} {len(body):>9,} {len(gzip.compress(body)):>11,}'
+                        f' {measure(lambda: encode(data), repeat):>10.2f}'
+                        f' {measure(lambda: decode(body), repeat):>10.2f}'
+                    )
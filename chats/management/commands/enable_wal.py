@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Switch an SQLite database to WAL journaling. The mode is stored in '
+        'the database file, so this is needed once per database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'{options["database"]} is not an SQLite database')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = WAL')
+            mode = cursor.fetchone()[0]
+        if mode != 'wal':
+            raise CommandError(f'SQLite kept journal_mode {mode}')
+        self.stdout.write(self.style.SUCCESS(f'{connection.settings_dict["NAME"]} uses WAL journaling'))
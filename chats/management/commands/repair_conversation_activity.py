@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Recompute last_message, last_message_at and message_count for conversations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'conversation_ids', nargs='*',
+            help='Only repair these conversations (default: all)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.order_by('pk')
+        if options['conversation_ids']:
+            conversations = conversations.filter(pk__in=options['conversation_ids'])
+
+        batch_size = options['batch_size']
+        ids = list(conversations.values_list('pk', flat=True))
+        repaired = 0
+        for start in range(0, len(ids), batch_size):
+            repaired += Conversation.objects.filter(
+                pk__in=ids[start:start + batch_size]
+            ).recompute_activity()
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} conversations'))
@@ -0,0 +1,90 @@
+"""
+Cached answers to "is this user a participant of this conversation".
+
+Only positive answers are cached, so a user added to a conversation is
+let in on the next request. Entries are keyed by (conversation, user) and
+dropped by the signal handlers in chats.signals whenever participants
+change or a conversation is deleted. Those invalidations only reach the
+other workers through a shared cache backend (Redis, Memcached): with a
+per-process cache such as LocMemCache, a removed participant keeps access
+in other processes for up to CHATS_MEMBERSHIP_CACHE_TIMEOUT seconds.
+`manage.py check --deploy` warns about that (chats.checks).
+
+Lookups always read from the primary database, also in requests whose
+reads go to a replica (chats.routers): an answer from a lagging replica
+would deny a newly added participant and stay cached after the replica
+catches up.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import Conversation
+
+DEFAULT_TIMEOUT = 60
+
+
+def get_cache():
+    return caches[getattr(settings, 'CHATS_MEMBERSHIP_CACHE', 'default')]
+
+
+def _normalize(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(str(value))
+
+
+def cache_key(conversation_id, user_id):
+    return f'chats:membership:{_normalize(conversation_id).hex}:{_normalize(user_id).hex}'
+
+
+def is_participant(conversation_id, user_id):
+    """Return True if the user participates in the conversation"""
+    try:
+        key = cache_key(conversation_id, user_id)
+    except ValueError:
+        return False
+
+    cache = get_cache()
+    if cache.get(key):
+        return True
+    member = Conversation.participants.through.objects.using(DEFAULT_DB_ALIAS).filter(
+        conversation_id=_normalize(conversation_id), user_id=_normalize(user_id)
+    ).exists()
+    if member:
+        cache.set(key, True, getattr(settings, 'CHATS_MEMBERSHIP_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return member
+
+
+async def ais_participant(conversation_id, user_id):
+    """Async variant of is_participant, for views running on the event loop"""
+    try:
+        key = cache_key(conversation_id, user_id)
+    except ValueError:
+        return False
+
+    cache = get_cache()
+    if await cache.aget(key):
+        return True
+    member = await Conversation.participants.through.objects.using(DEFAULT_DB_ALIAS).filter(
+        conversation_id=_normalize(conversation_id), user_id=_normalize(user_id)
+    ).aexists()
+    if member:
+        await cache.aset(
+            key, True, getattr(settings, 'CHATS_MEMBERSHIP_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+        )
+    return member
+
+
+def invalidate(pairs):
+    """
+    Drop cached entries for (conversation_id, user_id) pairs, now and again
+    once the surrounding transaction commits, so a reader racing with the
+    change cannot leave a stale answer behind
+    """
+    keys = [cache_key(conversation_id, user_id) for conversation_id, user_id in pairs]
+    if keys:
+        get_cache().delete_many(keys)
+        transaction.on_commit(lambda: get_cache().delete_many(keys))
@@ -0,0 +1,318 @@
+"""
+Per-request performance metrics, kept in process and exposed in the
+Prometheus text format at api/_metrics.
+
+RequestMetricsMiddleware records, for every request, labelled with the
+route (URL name) and the viewset action (or the HTTP method for plain
+views):
+
+- chats_request_duration_seconds: total time spent in the application
+- chats_db_queries: number of queries run
+- chats_db_duration_seconds: time spent running them
+- chats_serialize_duration_seconds: time spent in serializers'
+  to_representation, not counting the queries it triggers
+- chats_render_duration_seconds: time spent rendering the response body
+- chats_responses_total: responses by status code
+
+Every worker process keeps its own histograms, so a scraper has to
+reach each one (or aggregate over them) to see all traffic. Recording
+costs a few lock-protected additions per request and two clock reads per
+query and per serialized object; without the middleware nothing is
+recorded.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds, in seconds, of the duration buckets
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+LABELS = ('route', 'action')
+
+_current = ContextVar('chats_request_metrics', default=None)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, **extra):
+    pairs = [*zip(names, values), *extra.items()]
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """A Prometheus histogram with one series per combination of label values"""
+
+    def __init__(self, name, documentation, buckets, labels=LABELS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # Count per bucket plus +Inf, then the sum
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self.lock:
+            snapshot = {labels: list(series) for labels, series in self.series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, le=format_value(bound))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labels, label_values)
+            yield f'{self.name}_sum{labels} {format_value(series[-1])}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Counter:
+    """A Prometheus counter with one series per combination of label values"""
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self.lock:
+            snapshot = dict(self.series)
+        for label_values, value in sorted(snapshot.items()):
+            yield f'{self.name}{format_labels(self.labels, label_values)} {value}'
+
+
+REQUEST_DURATION = Histogram(
+    'chats_request_duration_seconds', 'Time spent handling a request.', DURATION_BUCKETS
+)
+DB_QUERIES = Histogram(
+    'chats_db_queries', 'Database queries run per request.', QUERY_COUNT_BUCKETS
+)
+DB_DURATION = Histogram(
+    'chats_db_duration_seconds', 'Time spent in database queries per request.', DURATION_BUCKETS
+)
+SERIALIZE_DURATION = Histogram(
+    'chats_serialize_duration_seconds',
+    'Time spent in serializers per request, excluding the queries they run.',
+    DURATION_BUCKETS,
+)
+RENDER_DURATION = Histogram(
+    'chats_render_duration_seconds', 'Time spent rendering the response body per request.',
+    DURATION_BUCKETS,
+)
+RESPONSES = Counter('chats_responses_total', 'Responses sent.', LABELS + ('status',))
+
+REGISTRY = (REQUEST_DURATION, DB_QUERIES, DB_DURATION, SERIALIZE_DURATION, RENDER_DURATION, RESPONSES)
+
+
+def render_metrics(registry=REGISTRY):
+    """Return every metric in the Prometheus text exposition format"""
+    return '\n'.join(line for metric in registry for line in metric.collect()) + '\n'
+
+
+class RequestMetrics:
+    """
+    What the current request spent its time on. With `trace` set, every
+    query is also appended to it as (sql, many, seconds).
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.phases = {'serialize': 0.0, 'render': 0.0}
+        self.active = set()
+        self.trace = None
+
+
+def current_metrics():
+    """The RequestMetrics of the request being handled, or None"""
+    return _current.get()
+
+
+@contextmanager
+def collecting():
+    """
+    Collect the metrics of the block into the RequestMetrics of the
+    current request, or into a new one when there is none
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        yield metrics
+        return
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+class phase:
+    """
+    Context manager adding the time spent in the block, minus the time
+    spent in queries meanwhile, to a phase of the current request. Nested
+    blocks of the same phase, such as a nested serializer, are counted once.
+    """
+    __slots__ = ('name', 'metrics', 'start', 'db_time')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        metrics = _current.get()
+        if metrics is None or self.name in metrics.active:
+            self.metrics = None
+            return self
+        metrics.active.add(self.name)
+        self.metrics = metrics
+        self.db_time = metrics.db_time
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics = self.metrics
+        if metrics is not None:
+            elapsed = time.perf_counter() - self.start - (metrics.db_time - self.db_time)
+            metrics.phases[self.name] += elapsed
+            metrics.active.discard(self.name)
+
+
+class MeasuredSerializerMixin:
+    """Serializer mixin that counts to_representation as serializer time"""
+
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper counting and timing queries run for a request"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.queries += 1
+        metrics.db_time += elapsed
+        if metrics.trace is not None:
+            metrics.trace.append((sql, many, elapsed))
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install():
+    """Record the queries of every connection, current and future"""
+    connection_created.connect(install_query_recorder)
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(connection)
+
+
+def request_labels(request):
+    """(route, action) of a request: the URL name and the viewset action or HTTP method"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', request.method.lower()
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return match.view_name or match.route, actions.get(method, method)
+
+
+def render_response(response):
+    """
+    Render a template response (DRF responses are) as render time, for
+    process_template_response. Django renders right after that hook and
+    rendering twice is a no-op.
+    """
+    with phase('render'):
+        response.render()
+    return response
+
+
+def record_request(request, response, metrics, duration):
+    labels = request_labels(request)
+    REQUEST_DURATION.observe(labels, duration)
+    DB_QUERIES.observe(labels, metrics.queries)
+    DB_DURATION.observe(labels, metrics.db_time)
+    SERIALIZE_DURATION.observe(labels, metrics.phases['serialize'])
+    RENDER_DURATION.observe(labels, metrics.phases['render'])
+    RESPONSES.inc(labels + (str(response.status_code),))
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the metrics of every request. Works under WSGI and ASGI
+    without moving async views to a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record_request(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record_request(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    def process_template_response(self, request, response):
+        return render_response(response)
@@ -0,0 +1,50 @@
+# Generated by Django 5.0 on 2026-10-18 03:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_activity(apps, schema_editor):
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-sent_at', '-message_id')
+    counts = (
+        Message.objects.filter(conversation=OuterRef('pk'))
+        .order_by()
+        .values('conversation')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    Conversation.objects.update(
+        last_message=Subquery(latest.values('message_id')[:1]),
+        last_message_at=Subquery(latest.values('sent_at')[:1]),
+        message_count=Coalesce(Subquery(counts), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_message_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
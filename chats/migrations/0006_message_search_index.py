@@ -0,0 +1,86 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE message_fts USING fts5(
+        message_body,
+        content='message',
+        content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO message_fts(rowid, message_body) VALUES (new.rowid, new.message_body);
+    END
+    """,
+    """
+    CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, message_body)
+        VALUES ('delete', old.rowid, old.message_body);
+    END
+    """,
+    """
+    CREATE TRIGGER message_fts_update AFTER UPDATE OF message_body ON message BEGIN
+        INSERT INTO message_fts(message_fts, rowid, message_body)
+        VALUES ('delete', old.rowid, old.message_body);
+        INSERT INTO message_fts(rowid, message_body) VALUES (new.rowid, new.message_body);
+    END
+    """,
+    "INSERT INTO message_fts(message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS message_fts_insert",
+    "DROP TRIGGER IF EXISTS message_fts_delete",
+    "DROP TRIGGER IF EXISTS message_fts_update",
+    "DROP TABLE IF EXISTS message_fts",
+]
+
+POSTGRESQL_FORWARD = [
+    "CREATE INDEX message_body_search_idx ON message "
+    "USING GIN (to_tsvector('english', message_body))",
+]
+
+POSTGRESQL_BACKWARD = [
+    "DROP INDEX IF EXISTS message_body_search_idx",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index on message bodies.
+
+    SQLite uses an external-content FTS5 table kept in sync by triggers, so
+    every write path (including bulk_create and raw SQL) updates it.
+
+    The FTS5 table is keyed on message.rowid, not message_id. Anything that
+    rebuilds the message table renumbers its rows and drops the triggers:
+    on SQLite that includes AlterField, AddField with a default and other
+    schema changes Django implements by copying the table. VACUUM can also
+    renumber rows, since message has no INTEGER PRIMARY KEY. Later schema
+    changes to message must use plain ALTER TABLE (see 0010), and after a
+    rebuild or VACUUM the triggers must be recreated and the index rebuilt
+    with this migration's statements.
+
+    PostgreSQL uses a GIN expression index that needs no extra upkeep.
+    """
+
+    dependencies = [
+        ('chats', '0005_conversation_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
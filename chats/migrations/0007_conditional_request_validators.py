@@ -0,0 +1,34 @@
+# Generated by Django 5.0 on 2026-10-18 04:09
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+
+def backfill_updated_at(apps, schema_editor):
+    Conversation = apps.get_model('chats', 'Conversation')
+    User = apps.get_model('chats', 'User')
+    Conversation.objects.update(updated_at=Coalesce('last_message_at', 'created_at'))
+    User.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
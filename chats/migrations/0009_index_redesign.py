@@ -0,0 +1,118 @@
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+# Single-column indexes Django created for foreign keys, now covered by
+# composite indexes that start with the same column
+FOREIGN_KEY_INDEXES = [
+    ('message_conversation_id_87e8709d', 'message', 'conversation_id'),
+    ('message_sender_id_a2a2e825', 'message', 'sender_id'),
+    ('conversation_participants_conversation_id_58e662d4', 'conversation_participants', 'conversation_id'),
+    ('conversation_participants_user_id_c65bf2e6', 'conversation_participants', 'user_id'),
+]
+
+
+class Migration(migrations.Migration):
+    """
+    Indexes matched to the queries the API runs.
+
+    message: (conversation, sent_at, message_id) and the new (sender,
+    sent_at) replace the single-column conversation and sender indexes,
+    each of which existed twice (the foreign key index plus one in
+    Meta.indexes). The message_id index duplicated the primary key.
+
+    conversation_participants becomes the explicit ConversationParticipant
+    model so its indexes can be declared: the unique (conversation, user)
+    index stays, a (user, conversation) index replaces the single-column
+    ones.
+
+    The foreign key indexes are dropped with plain DROP INDEX rather than
+    AlterField(db_index=False), which SQLite implements by rebuilding the
+    table. Rebuilding message would renumber its rowids and drop the
+    triggers the message_fts index relies on (0006).
+    """
+
+    dependencies = [
+        ('chats', '0008_message_archive'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_message_a8c1bc_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_sender__0e912c_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_convers_eb8893_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='conversatio_convers_0a9604_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_email_7bbb4c_idx',
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                # db_index on a primary key never created an index
+                migrations.AlterField(
+                    model_name='message',
+                    name='message_id',
+                    field=models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='conversation_id',
+                    field=models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='conversation',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chats.conversation'),
+                ),
+                migrations.AlterField(
+                    model_name='message',
+                    name='sender',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+                ),
+                # The table Django created for the automatic through model
+                migrations.CreateModel(
+                    name='ConversationParticipant',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='chats.conversation')),
+                        ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'conversation_participants',
+                        'unique_together': {('conversation', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversation',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='conversations', through='chats.ConversationParticipant', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    [f'DROP INDEX "{name}"' for name, _, _ in FOREIGN_KEY_INDEXES],
+                    [f'CREATE INDEX "{name}" ON "{table}" ("{column}")' for name, table, column in FOREIGN_KEY_INDEXES],
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'sent_at'], name='message_sender_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', 'conversation'], name='conv_participant_user_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Change tracking for delta sync.
+
+    message.sync_seq is added with ALTER TABLE ADD COLUMN rather than
+    AddField, which SQLite implements by rebuilding the table for a
+    column with a default. Rebuilding message would renumber its rowids
+    and drop the triggers the message_fts index relies on (0006).
+
+    Existing messages are numbered in (sent_at, message_id) order and the
+    counter starts after them.
+    """
+
+    dependencies = [
+        ('chats', '0009_index_redesign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'sync_counter',
+            },
+        ),
+        migrations.CreateModel(
+            name='DeletedMessage',
+            fields=[
+                ('message_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('sync_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chats.conversation')),
+            ],
+            options={
+                'db_table': 'deleted_message',
+                'indexes': [models.Index(fields=['conversation', 'sync_seq'], name='deleted_msg_conv_sync_idx')],
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='message',
+                    name='sync_seq',
+                    field=models.BigIntegerField(default=0),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'ALTER TABLE "message" ADD COLUMN "sync_seq" bigint NOT NULL DEFAULT 0',
+                    'ALTER TABLE "message" DROP COLUMN "sync_seq"',
+                ),
+            ],
+        ),
+        migrations.RunSQL(
+            [
+                'UPDATE "message" SET "sync_seq" = "numbered"."seq" FROM ('
+                ' SELECT "message_id", ROW_NUMBER() OVER (ORDER BY "sent_at", "message_id") AS "seq"'
+                ' FROM "message"'
+                ') AS "numbered" WHERE "message"."message_id" = "numbered"."message_id"',
+                'INSERT INTO "sync_counter" ("id", "value") SELECT 1, COUNT(*) FROM "message"',
+            ],
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sync_seq'], name='message_conv_sync_idx'),
+        ),
+    ]
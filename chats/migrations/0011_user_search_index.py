@@ -0,0 +1,72 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE user_fts USING fts5(
+        first_name,
+        last_name,
+        content='user',
+        content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER user_fts_insert AFTER INSERT ON user BEGIN
+        INSERT INTO user_fts(rowid, first_name, last_name)
+        VALUES (new.rowid, new.first_name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER user_fts_delete AFTER DELETE ON user BEGIN
+        INSERT INTO user_fts(user_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.rowid, old.first_name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER user_fts_update AFTER UPDATE OF first_name, last_name ON user BEGIN
+        INSERT INTO user_fts(user_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.rowid, old.first_name, old.last_name);
+        INSERT INTO user_fts(rowid, first_name, last_name)
+        VALUES (new.rowid, new.first_name, new.last_name);
+    END
+    """,
+    "INSERT INTO user_fts(user_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS user_fts_insert",
+    "DROP TRIGGER IF EXISTS user_fts_delete",
+    "DROP TRIGGER IF EXISTS user_fts_update",
+    "DROP TABLE IF EXISTS user_fts",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    """
+    Full-text index on user names, so message search can match senders
+    by name prefix without scanning the users table.
+
+    Like message_fts (0006), user_fts is an external-content FTS5 table
+    keyed on user.rowid and kept in sync by triggers: a rebuild of the
+    user table or a VACUUM loses them. Other backends match names with
+    icontains.
+    """
+
+    dependencies = [
+        ('chats', '0010_message_sync_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -1,5 +1,7 @@
 import uuid
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils import timezone
 
@@ -68,6 +70,8 @@ class User(AbstractUser):
         blank=False
     )
     created_at = models.DateTimeField(default=timezone.now)
+    # Validator for conditional requests, see chats.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     # Override the default username field to use email
     username = None
@@ -83,7 +87,6 @@ class User(AbstractUser):
             models.UniqueConstraint(fields=['email'], name='unique_email')
         ]
         indexes = [
-            models.Index(fields=['email']),
             models.Index(fields=['created_at']),
         ]
 
@@ -91,6 +94,34 @@ class User(AbstractUser):
         return f"{self.first_name} {self.last_name} ({self.email})"
 
 
+class ConversationQuerySet(models.QuerySet):
+    """QuerySet with helpers for the denormalized activity columns"""
+
+    def recompute_activity(self):
+        """
+        Recompute last_message, last_message_at and message_count from the
+        message and archive tables with a single UPDATE
+        """
+        latest = Message.objects.filter(
+            conversation=OuterRef('pk')
+        ).order_by('-sent_at', '-message_id')
+        def count(model):
+            return Coalesce(Subquery(
+                model.objects.filter(conversation=OuterRef('pk'))
+                .order_by()
+                .values('conversation')
+                .annotate(total=Count('*'))
+                .values('total')
+            ), 0)
+
+        # Archived messages still count; the latest message is never archived
+        return self.update(
+            last_message=Subquery(latest.values('message_id')[:1]),
+            last_message_at=Subquery(latest.values('sent_at')[:1]),
+            message_count=count(Message) + count(ArchivedMessage),
+        )
+
+
 class Conversation(models.Model):
     """
     Conversation model to track which users are involved in a conversation
@@ -98,19 +129,33 @@ class Conversation(models.Model):
     conversation_id = models.UUIDField(
         primary_key=True,
         default=uuid.uuid4,
-        editable=False,
-        db_index=True
+        editable=False
     )
     participants = models.ManyToManyField(
         User,
+        through='ConversationParticipant',
         related_name='conversations'
     )
     created_at = models.DateTimeField(default=timezone.now)
 
+    # Denormalized activity, kept in sync by record_message/forget_message
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # Moved by touch() whenever messages or participants change
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = ConversationQuerySet.as_manager()
+
     class Meta:
         db_table = 'conversation'
         indexes = [
-            models.Index(fields=['conversation_id']),
             models.Index(fields=['created_at']),
         ]
 
@@ -118,39 +163,258 @@ class Conversation(models.Model):
         participant_names = [str(user) for user in self.participants.all()]
         return f"Conversation {self.conversation_id} - Participants: {', '.join(participant_names)}"
 
+    @staticmethod
+    def touch(conversation_ids):
+        """Mark conversations as changed for conditional requests"""
+        Conversation.objects.filter(pk__in=conversation_ids).update(updated_at=timezone.now())
+
+    @staticmethod
+    def record_message(message):
+        """Update the activity columns after a message has been created"""
+        Conversation.record_messages([message])
+
+    @staticmethod
+    def record_messages(messages):
+        """
+        Update the activity columns after messages have been created, with
+        two queries per conversation regardless of how many messages it got
+        """
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+
+        with transaction.atomic(savepoint=False):
+            for conversation_id, created in by_conversation.items():
+                latest = max(created, key=lambda m: (m.sent_at, m.message_id))
+                conversations = Conversation.objects.filter(pk=conversation_id)
+                conversations.update(
+                    message_count=F('message_count') + len(created), updated_at=timezone.now()
+                )
+                conversations.filter(
+                    Q(last_message_at__isnull=True) | Q(last_message_at__lte=latest.sent_at)
+                ).update(last_message=latest, last_message_at=latest.sent_at)
+
+    @staticmethod
+    def forget_message(message):
+        """Update the activity columns after a message has been deleted"""
+        conversations = Conversation.objects.filter(pk=message.conversation_id)
+        with transaction.atomic(savepoint=False):
+            conversations.update(
+                message_count=Greatest(F('message_count') - 1, 0), updated_at=timezone.now()
+            )
+            # Deleting the last message nulls last_message, so pick the next latest
+            if conversations.filter(last_message__isnull=True).exists():
+                latest = Message.objects.filter(
+                    conversation_id=message.conversation_id
+                ).order_by('-sent_at', '-message_id').first()
+                conversations.update(
+                    last_message=latest,
+                    last_message_at=latest.sent_at if latest else None
+                )
+
+
+class ConversationParticipant(models.Model):
+    """
+    Membership of a user in a conversation, the through table of
+    Conversation.participants. The unique (conversation, user) index
+    serves lookups by conversation and membership checks,
+    conv_participant_user_idx serves lookups by user without
+    touching the table.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_index=False
+    )
+
+    class Meta:
+        db_table = 'conversation_participants'
+        unique_together = [('conversation', 'user')]
+        indexes = [
+            models.Index(fields=['user', 'conversation'], name='conv_participant_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
+
+
+class SyncCounter(models.Model):
+    """
+    The last sequence number handed out to a message change, in a single
+    row. Reserving numbers updates the row, which holds the write lock
+    until the transaction commits, so numbers follow commit order and a
+    delta sync never skips past a change that commits late (chats.sync).
+
+    The cost is one UPDATE ... RETURNING per message write, and one per
+    bulk_create batch. On SQLite, where BEGIN IMMEDIATE already lets one
+    writer in at a time, it adds no waiting. On PostgreSQL message writers
+    queue on the row from their reservation until they commit. A sequence
+    would not make them wait, but nextval() numbers follow the order
+    transactions start rather than commit, which is what lets a sync skip
+    a late commit. bench_sync --writes measures the cost per write.
+    """
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'sync_counter'
+
+    @classmethod
+    def reserve(cls, count=1):
+        """Reserve `count` consecutive sequence numbers and return the first"""
+        connection = connections[router.db_for_write(cls)]
+        with transaction.atomic(using=connection.alias, savepoint=False):
+            # Backends that can return columns from INSERT support UPDATE ... RETURNING
+            if connection.features.can_return_columns_from_insert:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'UPDATE {connection.ops.quote_name(cls._meta.db_table)} '
+                        'SET "value" = "value" + %s WHERE "id" = 1 RETURNING "value"',
+                        [count]
+                    )
+                    row = cursor.fetchone()
+                if row is not None:
+                    return row[0] - count + 1
+            elif cls.objects.filter(pk=1).update(value=F('value') + count):
+                return cls.objects.get(pk=1).value - count + 1
+            # The migration creates the row; a flush of the database removes it
+            cls.objects.create(pk=1, value=count)
+            return 1
+
 
 class Message(models.Model):
     """
-    Message model containing sender and conversation information
+    Message model containing sender and conversation information.
+
+    Every save takes a new sync_seq, so delta sync sees new and edited
+    messages. Deleting a message through the model (the API does) leaves
+    a DeletedMessage tombstone; queryset deletes, used by archiving and
+    cascades, do not.
     """
     message_id = models.UUIDField(
         primary_key=True,
         default=uuid.uuid4,
-        editable=False,
-        db_index=True
+        editable=False
     )
     sender = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='sent_messages'
+        related_name='sent_messages',
+        # Covered by message_sender_sent_idx
+        db_index=False
     )
     conversation = models.ForeignKey(
         Conversation,
         on_delete=models.CASCADE,
-        related_name='messages'
+        related_name='messages',
+        # Covered by message_conv_keyset_idx
+        db_index=False
     )
     message_body = models.TextField(null=False, blank=False)
     sent_at = models.DateTimeField(default=timezone.now)
+    # Position of the latest change in the delta sync order, see SyncCounter
+    sync_seq = models.BigIntegerField(default=0)
 
     class Meta:
         db_table = 'message'
         indexes = [
-            models.Index(fields=['message_id']),
-            models.Index(fields=['sender']),
-            models.Index(fields=['conversation']),
+            # Conversation feeds ordered by sent_at and keyset pagination of
+            # a conversation's history
+            models.Index(
+                fields=['conversation', 'sent_at', 'message_id'],
+                name='message_conv_keyset_idx'
+            ),
+            # Delta sync
+            models.Index(fields=['conversation', 'sync_seq'], name='message_conv_sync_idx'),
+            # A user's sent messages (my_messages) in sent_at order
+            models.Index(fields=['sender', 'sent_at'], name='message_sender_sent_idx'),
+            # Archiving by age and the admin's unfiltered listing
             models.Index(fields=['sent_at']),
         ]
         ordering = ['sent_at']
 
     def __str__(self):
-        return f"Message {self.message_id} from {self.sender} at {self.sent_at}"
\ No newline at end of file
+        return f"Message {self.message_id} from {self.sender} at {self.sent_at}"
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            self.sync_seq = SyncCounter.reserve()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'sync_seq'}
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            DeletedMessage.objects.create(
+                message_id=self.message_id,
+                conversation_id=self.conversation_id,
+                sync_seq=SyncCounter.reserve(),
+            )
+            return super().delete(*args, **kwargs)
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of the message table by chats.archive. It keeps
+    the columns of Message and is only indexed for paging through a
+    conversation, so the hot table and its indexes stay small.
+    """
+    message_id = models.UUIDField(primary_key=True, editable=False)
+    sender = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        # Covered by message_archive_conv_idx
+        db_index=False
+    )
+    message_body = models.TextField()
+    sent_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'message_archive'
+        indexes = [
+            models.Index(
+                fields=['conversation', 'sent_at', 'message_id'],
+                name='message_archive_conv_idx'
+            ),
+        ]
+        ordering = ['sent_at']
+
+    def __str__(self):
+        return f"Archived message {self.message_id} from {self.sender} at {self.sent_at}"
+
+
+class DeletedMessage(models.Model):
+    """
+    Tombstone of a message deleted through the API, so clients syncing
+    changes (chats.sync) learn about the deletion
+    """
+    message_id = models.UUIDField(primary_key=True, editable=False)
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='+',
+        # Covered by deleted_msg_conv_sync_idx
+        db_index=False
+    )
+    sync_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'deleted_message'
+        indexes = [
+            models.Index(fields=['conversation', 'sync_seq'], name='deleted_msg_conv_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted message {self.message_id}"
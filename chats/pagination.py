@@ -0,0 +1,175 @@
+import base64
+import binascii
+import uuid
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import may_be_archived
+
+
+def encode_cursor(sent_at, message_id):
+    """Build an opaque cursor from a (sent_at, message_id) position"""
+    raw = f"{sent_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the (sent_at, message_id) position stored in a cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+        sent_at, message_id = raw.split('|', 1)
+        position = (parse_datetime(sent_at), uuid.UUID(message_id))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise NotFound('Invalid cursor')
+    if position[0] is None:
+        raise NotFound('Invalid cursor')
+    return position
+
+
+def item_position(item):
+    """Return the (sent_at, message_id) of a message instance or values() row"""
+    if isinstance(item, dict):
+        return item['sent_at'], item['message_id']
+    return item.sent_at, item.message_id
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination for message feeds ordered on (sent_at, message_id).
+
+    Pages are always returned oldest first. Without a cursor the latest
+    page is returned; `before` scrolls back through history and `after`
+    fetches newer messages. No COUNT or OFFSET is issued, so every page
+    costs the same no matter how deep it is. The redundant range filter on
+    sent_at lets the database seek on the (conversation, sent_at,
+    message_id) index instead of evaluating the OR for every row.
+
+    Given an `archive` queryset of older messages, pages continue into it
+    once the hot messages run out (see chats.archive).
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    mode_query_param = 'pagination'
+    mode = 'cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        """Return True if the request asks for cursor pagination"""
+        params = request.query_params
+        return (
+            params.get(cls.mode_query_param) == cls.mode
+            or cls.before_query_param in params
+            or cls.after_query_param in params
+        )
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def fetch(self, queryset, before, after, limit):
+        """
+        Return up to `limit` rows after the `after` position oldest first,
+        else before the `before` position (or the latest) newest first
+        """
+        if after:
+            sent_at, message_id = after
+            queryset = queryset.filter(
+                Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id),
+                sent_at__gte=sent_at,
+            ).order_by('sent_at', 'message_id')
+        else:
+            if before:
+                sent_at, message_id = before
+                queryset = queryset.filter(
+                    Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, message_id__lt=message_id),
+                    sent_at__lte=sent_at,
+                )
+            queryset = queryset.order_by('-sent_at', '-message_id')
+        return list(queryset[:limit])
+
+    def paginate_queryset(self, queryset, request, view=None, archive=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        before = decode_cursor(before) if before and not after else None
+        after = decode_cursor(after) if after else None
+
+        # Archived messages are older than the hot ones: going back they
+        # follow the hot rows, going forward they come first
+        sources = [queryset]
+        if archive is not None:
+            if not after:
+                sources.append(archive)
+            elif may_be_archived(after[0]):
+                sources.insert(0, archive)
+
+        # Fetch one extra row to know whether another page exists
+        results = []
+        for source in sources:
+            results += self.fetch(source, before, after, self.page_size + 1 - len(results))
+            if len(results) > self.page_size:
+                break
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if after:
+            self.has_newer = has_more
+            self.has_older = True
+        else:
+            results.reverse()
+            self.has_older = has_more
+            self.has_newer = bool(before)
+
+        self.page = results
+        return results
+
+    def get_older_link(self):
+        if not (self.has_older and self.page):
+            return None
+        url = remove_query_param(self.base_url, self.after_query_param)
+        return replace_query_param(
+            url, self.before_query_param, encode_cursor(*item_position(self.page[0]))
+        )
+
+    def get_newer_link(self):
+        if not (self.has_newer and self.page):
+            return None
+        url = remove_query_param(self.base_url, self.before_query_param)
+        return replace_query_param(
+            url, self.after_query_param, encode_cursor(*item_position(self.page[-1]))
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_newer_link()),
+            ('previous', self.get_older_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
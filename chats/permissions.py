@@ -0,0 +1,54 @@
+from rest_framework import permissions
+
+from .membership import is_participant
+
+
+def is_admin(user):
+    """Return True if the user can see and manage every object"""
+    return bool(user and (user.is_staff or getattr(user, 'role', None) == 'admin'))
+
+
+class IsAdmin(permissions.BasePermission):
+    """
+    Allow only admins (staff or the admin role)
+    """
+
+    def has_permission(self, request, view):
+        return is_admin(request.user)
+
+
+class IsOwnerOrReadOnly(permissions.BasePermission):
+    """
+    Object-level permission to only allow users to edit their own profile
+    """
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return obj == request.user or is_admin(request.user)
+
+
+class IsConversationParticipant(permissions.BasePermission):
+    """
+    Object-level permission to only allow participants of a conversation to access it
+    """
+
+    def has_object_permission(self, request, view, obj):
+        if is_admin(request.user):
+            return True
+        return is_participant(obj.pk, request.user.user_id)
+
+
+class IsMessageOwner(permissions.BasePermission):
+    """
+    Object-level permission:
+    - Participants of the conversation can read a message
+    - Only the sender can update or delete it
+    """
+
+    def has_object_permission(self, request, view, obj):
+        if is_admin(request.user):
+            return True
+        if request.method in permissions.SAFE_METHODS:
+            return is_participant(obj.conversation_id, request.user.user_id)
+        return obj.sender_id == request.user.user_id
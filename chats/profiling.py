@@ -0,0 +1,288 @@
+"""
+On-demand profiles of single requests.
+
+RequestProfilerMiddleware profiles a request when
+
+- it carries the CHATS_PROFILE_HEADER header (X-Profile by default) and
+  comes from an admin, authenticated by session or JWT; the response then
+  carries the profile id in X-Profile-Id, or
+- it is picked by CHATS_PROFILE_SAMPLE_RATE, the fraction of all
+  requests to profile (0, never, by default).
+
+For each profile it writes to CHATS_PROFILE_DIR:
+
+- <id>.prof: the cProfile stats, for pstats, snakeviz and the like
+- <id>.json: the request, its phases (db, serialize, render and view,
+  which is everything else), the SQL it ran with durations and the
+  functions with the most cumulative time
+
+and appends a summary of the request to index.jsonl there. Only the
+newest CHATS_PROFILE_MAX_PROFILES profiles (500 by default, None for no
+limit) are kept; older files and their index entries are deleted. The
+recorded path leaves out query parameters that carry credentials, such as
+the ?token= of the message stream.
+
+cProfile can double the time of the profiled request, so keep the
+sample rate low. Under ASGI the profile covers the event loop thread and
+the thread sync code runs in, so work of concurrent requests on those
+threads shows up too. Python lets each thread (each process, from 3.12)
+have one profiler at a time; a request that cannot get one is still
+recorded, without function stats.
+"""
+import cProfile
+import json
+import pstats
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import metrics
+from .auth import CustomJWTAuthentication
+from .permissions import is_admin
+
+DEFAULT_HEADER = 'X-Profile'
+DEFAULT_MAX_PROFILES = 500
+INDEX_FILE = 'index.jsonl'
+TOP_FUNCTIONS = 40
+# Query parameters never written to disk
+SECRET_PARAMS = ('token',)
+
+_index_lock = threading.Lock()
+
+
+def get_profile_dir():
+    return Path(getattr(settings, 'CHATS_PROFILE_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+
+def get_profile_header():
+    return getattr(settings, 'CHATS_PROFILE_HEADER', DEFAULT_HEADER)
+
+
+def get_max_profiles():
+    return getattr(settings, 'CHATS_PROFILE_MAX_PROFILES', DEFAULT_MAX_PROFILES)
+
+
+def is_sampled():
+    rate = getattr(settings, 'CHATS_PROFILE_SAMPLE_RATE', 0)
+    return bool(rate) and random.random() < rate
+
+
+def profiling_user(request):
+    """The admin asking for a profile of the request, or None"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        try:
+            result = CustomJWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        user = result[0] if result else None
+    return user if is_admin(user) else None
+
+
+def start_profiler():
+    """Start profiling the current thread; None if it already has a profiler"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def stop_profiler(profiler):
+    if profiler is not None:
+        profiler.disable()
+
+
+def profiled_path(request):
+    """The request path and query string without SECRET_PARAMS"""
+    params = request.GET.copy()
+    for name in SECRET_PARAMS:
+        params.pop(name, None)
+    query = params.urlencode()
+    return f'{request.path}?{query}' if query else request.path
+
+
+def prune_profiles(directory, keep):
+    """Delete all but the newest `keep` profiles, with their index entries"""
+    # Profile ids start with their timestamp, so they sort oldest first
+    ids = sorted(path.stem for path in directory.glob('*.json'))
+    if len(ids) <= keep:
+        return
+    stale = set(ids[:len(ids) - keep])
+    for profile_id in stale:
+        (directory / f'{profile_id}.json').unlink(missing_ok=True)
+        (directory / f'{profile_id}.prof').unlink(missing_ok=True)
+    index = directory / INDEX_FILE
+    lines = index.read_text().splitlines(keepends=True) if index.exists() else []
+    index.write_text(''.join(line for line in lines if json.loads(line)['id'] not in stale))
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            'function': f'{name} ({filename}:{line})',
+            'calls': calls,
+            'self': own_time,
+            'cumulative': cumulative,
+        }
+        for (filename, line, name), (_, calls, own_time, cumulative, _) in rows
+    ]
+
+
+class RequestProfile:
+    """A request being profiled, with what it costs from the start on"""
+
+    def __init__(self, request, trigger, user=None):
+        self.id = f'{timezone.now():%Y%m%dT%H%M%S.%f}-{uuid.uuid4().hex[:8]}'
+        self.request = request
+        self.trigger = trigger
+        self.user = user
+        self.profilers = []
+
+    def begin(self, collected):
+        # The RequestMetrics may already hold what outer middleware did
+        self.metrics = collected
+        self.queries = collected.queries
+        self.db_time = collected.db_time
+        self.phases = dict(collected.phases)
+        self.trace_start = len(collected.trace) if collected.trace is not None else 0
+        if collected.trace is None:
+            collected.trace = []
+        self.start = time.perf_counter()
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+
+    def summary(self, response):
+        route, action = metrics.request_labels(self.request)
+        return {
+            'id': self.id,
+            'at': timezone.now().isoformat(),
+            'method': self.request.method,
+            'path': profiled_path(self.request),
+            'route': route,
+            'action': action,
+            'status': response.status_code,
+            'trigger': self.trigger,
+            'user': str(self.user.pk) if self.user is not None else None,
+            'duration': self.duration,
+            'queries': self.metrics.queries - self.queries,
+        }
+
+    def write(self, response):
+        """Write the profile files and index the profile"""
+        directory = get_profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        summary = self.summary(response)
+
+        phases = {'db': self.metrics.db_time - self.db_time}
+        for name, value in self.metrics.phases.items():
+            phases[name] = value - self.phases[name]
+        phases['view'] = self.duration - sum(phases.values())
+
+        functions = []
+        profilers = [profiler for profiler in self.profilers if profiler is not None]
+        if profilers:
+            stats = pstats.Stats(*profilers)
+            stats.dump_stats(directory / f'{self.id}.prof')
+            functions = top_functions(stats)
+
+        detail = {
+            **summary,
+            'phases': phases,
+            'sql': [
+                {'sql': sql, 'many': many, 'duration': duration}
+                for sql, many, duration in self.metrics.trace[self.trace_start:]
+            ],
+            'functions': functions,
+        }
+        with open(directory / f'{self.id}.json', 'w') as handle:
+            json.dump(detail, handle, indent=2, default=str)
+        with _index_lock:
+            with open(directory / INDEX_FILE, 'a') as handle:
+                handle.write(json.dumps(summary, default=str) + '\n')
+            keep = get_max_profiles()
+            if keep is not None:
+                prune_profiles(directory, keep)
+
+
+class RequestProfilerMiddleware:
+    """
+    Profiles requests asked for by admins or picked by sampling. Place it
+    after AuthenticationMiddleware so session users are known.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        metrics.install()
+
+    def profile_for(self, request, sampled):
+        """The RequestProfile to record for a request, or None"""
+        if request.headers.get(get_profile_header()):
+            user = profiling_user(request)
+            if user is not None:
+                return RequestProfile(request, 'header', user)
+        return RequestProfile(request, 'sample') if sampled else None
+
+    def finish(self, profile, response):
+        profile.write(response)
+        if profile.trigger == 'header':
+            response['X-Profile-Id'] = profile.id
+        return response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile = self.profile_for(request, is_sampled())
+        if profile is None:
+            return self.get_response(request)
+        with metrics.collecting() as collected:
+            profile.begin(collected)
+            profile.profilers.append(start_profiler())
+            try:
+                response = self.get_response(request)
+            finally:
+                stop_profiler(profile.profilers[0])
+                profile.end()
+            return self.finish(profile, response)
+
+    async def __acall__(self, request):
+        sampled = is_sampled()
+        if request.headers.get(get_profile_header()):
+            # Authenticating may hit the database
+            profile = await sync_to_async(self.profile_for)(request, sampled)
+        else:
+            profile = RequestProfile(request, 'sample') if sampled else None
+        if profile is None:
+            return await self.get_response(request)
+        with metrics.collecting() as collected:
+            profile.begin(collected)
+            # One profiler on the event loop, one on the thread sync views
+            # and the async ORM run in
+            loop_profiler = start_profiler()
+            thread_profiler = await sync_to_async(start_profiler)()
+            profile.profilers += [loop_profiler, thread_profiler]
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stop_profiler)(thread_profiler)
+                stop_profiler(loop_profiler)
+                profile.end()
+            return await sync_to_async(self.finish, thread_sensitive=False)(profile, response)
+
+    def process_template_response(self, request, response):
+        return metrics.render_response(response)
@@ -0,0 +1,159 @@
+"""
+Push delivery of new messages to connected clients.
+
+Messages are published to one channel per participant. The broker is
+chosen with the CHATS_REALTIME_BROKER setting; the default
+InProcessBroker needs no external service but only reaches clients
+connected to the same process. For several processes or hosts, plug in a
+broker with the same interface backed by e.g. Redis pub/sub.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+from .models import Conversation
+from .serializers import MessageSerializer
+
+DEFAULT_BROKER = 'chats.realtime.InProcessBroker'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """Queue of payloads published to one channel for one client"""
+
+    def __init__(self, broker, channel, max_pending):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+    def put(self, payload):
+        # A client that cannot keep up loses messages and can resync later
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def get(self, timeout=None):
+        """Wait for the next payload, or return None after `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker.unsubscribe(self)
+
+
+class BaseBroker:
+    """
+    Interface for pub/sub backends.
+
+    publish() is called from synchronous request threads; subscribe() from
+    the event loop serving the stream.
+    """
+
+    def publish(self, channel, payload):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        """Return a Subscription, used as an async context manager"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def has_subscribers(self, channel):
+        """
+        Return False only if nothing published to `channel` can be
+        delivered, so the payload need not be built
+        """
+        return True
+
+
+class InProcessBroker(BaseBroker):
+    """Broker that fans out to subscribers living in this process"""
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, payload):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, payload)
+            except RuntimeError:
+                # The subscriber's event loop has been closed
+                self.unsubscribe(subscription)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_pending)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def has_subscribers(self, channel):
+        return channel in self._subscriptions
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'CHATS_REALTIME_BROKER', DEFAULT_BROKER))()
+    return _broker
+
+
+def publish_messages(messages):
+    """
+    Send newly created messages to every participant of their conversations.
+    Senders should already be loaded on the messages. A message is only
+    serialized if one of its participants has a subscriber.
+    """
+    if not messages:
+        return
+    broker = get_broker()
+    through = Conversation.participants.through
+    subscribed = defaultdict(list)
+    for conversation_id, user_id in through.objects.filter(
+        conversation_id__in={m.conversation_id for m in messages}
+    ).values_list('conversation_id', 'user_id'):
+        channel = user_channel(user_id)
+        if broker.has_subscribers(channel):
+            subscribed[conversation_id].append(channel)
+
+    for message in messages:
+        channels = subscribed.get(message.conversation_id)
+        if not channels:
+            continue
+        payload = json.dumps(
+            {'type': 'message.created', 'message': MessageSerializer(message).data},
+            cls=DjangoJSONEncoder
+        )
+        for channel in channels:
+            broker.publish(channel, payload)
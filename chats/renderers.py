@@ -0,0 +1,76 @@
+"""
+Fast and compact renderers.
+
+JSON rendering uses orjson when it is installed.
+
+FastJSONRenderer produces the same JSON as DRF's JSONRenderer, but
+encodes in C and handles UUIDs and datetimes natively. Output is
+byte-identical except that float exponents are spelled without padding
+(1e-5 rather than 1e-05). Anything orjson cannot encode the same way (custom
+indentation, integers wider than 64 bits, Decimal and other types only
+DRF's encoder knows) goes through the stdlib JSONRenderer instead, which
+is also used throughout when orjson is missing.
+
+MessagePackRenderer needs the optional msgpack package.
+"""
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+ORJSON_OPTIONS = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+# Fallback for types orjson does not know: lazy strings, Decimal, querysets...
+default_encoder = encoders.JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Drop-in JSONRenderer backed by orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if (
+            orjson is None
+            or self.get_indent(accepted_media_type, renderer_context)
+            or not self.compact
+            or self.ensure_ascii
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=default_encoder.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # orjson.JSONEncodeError, e.g. integers wider than 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escape the line separators that are invalid in JavaScript, as DRF does
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders responses as MessagePack for clients that send
+    Accept: application/msgpack. Values MessagePack has no type for
+    (UUIDs, datetimes, Decimal...) are encoded as DRF's JSON encoder would.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=default_encoder.default, use_bin_type=True, datetime=False)
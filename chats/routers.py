@@ -0,0 +1,129 @@
+"""
+Read/write splitting between the primary database and read replicas.
+
+Replicas are the DATABASES aliases listed in CHATS_DB_REPLICAS. Only
+requests that opt in read from one: viewsets list the actions that may
+(ReplicaReadsMixin.replica_actions), everything else, including code
+running outside a request, reads from the primary.
+
+A request sticks to the primary from its first write on, and reads
+inside a transaction on the primary stay there. Since replicas lag, a
+user who wrote is also kept on the primary for
+CHATS_DB_PRIMARY_PIN_SECONDS afterwards, so they read their own writes
+on the next requests too. The pin lives in the default cache, which
+must be shared between workers for it to reach all of them.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULT_PIN_SECONDS = 5
+
+_routing = ContextVar('chats_db_routing', default=None)
+
+
+def get_replicas():
+    return list(getattr(settings, 'CHATS_DB_REPLICAS', []))
+
+
+class RequestRouting:
+    """Where the reads of the current request go"""
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+        self.user_id = None
+
+    def read_alias(self):
+        if self.replica is None or self.wrote or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.replica
+
+    def use_replica(self):
+        replicas = get_replicas()
+        self.replica = random.choice(replicas) if replicas else None
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Route the reads of the block to a replica, if `enabled` and any are
+    configured, until the first write
+    """
+    state = RequestRouting()
+    if enabled:
+        state.use_replica()
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+def pin_key(user_id):
+    return f'chats:db:primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Keep the user's reads on the primary while replicas catch up with a write"""
+    timeout = getattr(settings, 'CHATS_DB_PRIMARY_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+    if get_replicas() and timeout:
+        cache.set(pin_key(user_id), True, timeout)
+
+
+def is_pinned_to_primary(user_id):
+    return bool(get_replicas()) and cache.get(pin_key(user_id), False)
+
+
+class PrimaryReplicaRouter:
+    """Database router sending the reads of opted-in requests to a replica"""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        return state.read_alias() if state is not None else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True
+
+
+class ReplicaReadsMixin:
+    """
+    Viewset mixin that serves safe requests for `replica_actions` from a
+    replica and pins users who wrote to the primary
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads(enabled=False) as self.db_routing:
+            response = super().dispatch(request, *args, **kwargs)
+            if self.db_routing.wrote and self.db_routing.user_id is not None:
+                pin_to_primary(self.db_routing.user_id)
+        return response
+
+    def perform_authentication(self, request):
+        # The action is known from here on, and permission checks after
+        # this already read from the replica. Membership checks do not:
+        # chats.membership caches its answers, so it reads the primary.
+        super().perform_authentication(request)
+        self.db_routing.user_id = request.user.pk
+        if (
+            request.method in SAFE_METHODS
+            and self.action in self.replica_actions
+            and not is_pinned_to_primary(request.user.pk)
+        ):
+            self.db_routing.use_replica()
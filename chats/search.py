@@ -0,0 +1,201 @@
+"""
+Full-text search over message bodies.
+
+SQLite queries go through the message_fts FTS5 table and PostgreSQL uses
+the to_tsvector GIN index, both created in migration 0006. Other backends,
+or SQLite builds without FTS5, fall back to icontains.
+
+Searches can also match messages by their sender's name. On SQLite the
+words match name prefixes through the user_fts table (migration 0011);
+other backends match names with icontains. Whether anyone matches is
+checked first, so the common case of a term that names nobody keeps the
+plain full-text query.
+"""
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.db.models import F, FloatField, Q, TextField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Substr
+from rest_framework import filters
+
+from .models import User
+
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+SNIPPET_TOKENS = 12
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_MATCH = (
+    'SELECT message_id FROM message WHERE rowid IN '
+    '(SELECT rowid FROM message_fts WHERE message_fts MATCH %s)'
+)
+SQLITE_RANK = '-bm25(message_fts)'
+SQLITE_SNIPPET = "snippet(message_fts, 0, %s, %s, '...', %s)"
+# The same for one message, when message_fts cannot be joined
+SQLITE_ROW = 'SELECT {} FROM message_fts WHERE message_fts MATCH %s AND message_fts.rowid = message.rowid'
+
+SQLITE_USER_MATCH = (
+    'SELECT user_id FROM "user" WHERE rowid IN '
+    '(SELECT rowid FROM user_fts WHERE user_fts MATCH %s)'
+)
+USER_FTS_FIELDS = ('first_name', 'last_name')
+
+POSTGRESQL_MATCH = (
+    "SELECT message_id FROM message WHERE "
+    "to_tsvector('english', message_body) @@ websearch_to_tsquery('english', %s)"
+)
+POSTGRESQL_RANK = (
+    "ts_rank(to_tsvector('english', message.message_body), websearch_to_tsquery('english', %s))"
+)
+POSTGRESQL_SNIPPET = (
+    "ts_headline('english', message.message_body, websearch_to_tsquery('english', %s), "
+    "'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=' || %s)"
+)
+
+
+_backends = {}
+
+
+def get_backend(using='default'):
+    """Return 'sqlite', 'postgresql' or None when no full-text index is available"""
+    connection = connections[using]
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _backends:
+        backend = None
+        if connection.vendor == 'postgresql':
+            backend = 'postgresql'
+        elif connection.vendor == 'sqlite':
+            if {'message_fts', 'user_fts'} <= set(connection.introspection.table_names()):
+                backend = 'sqlite'
+        _backends[key] = backend
+    return _backends[key]
+
+
+def to_fts5_query(text):
+    """
+    Turn free text into an FTS5 query that matches every word as a prefix,
+    so user input can never produce an FTS5 syntax error
+    """
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(text))
+
+
+def full_text_q(text, using='default'):
+    """Return a Q object matching messages whose body matches `text`"""
+    backend = get_backend(using)
+    if backend == 'sqlite':
+        query = to_fts5_query(text)
+        if not query:
+            return Q(pk__in=[])
+        return Q(message_id__in=RawSQL(SQLITE_MATCH, [query]))
+    if backend == 'postgresql':
+        return Q(message_id__in=RawSQL(POSTGRESQL_MATCH, [text]))
+    return Q(message_body__icontains=text)
+
+
+def matching_senders(text, fields, using='default'):
+    """
+    Return a queryset of the users with every word of `text` in one of
+    `fields`; through user_fts, as a prefix of a word of one of them
+    """
+    users = User.objects.using(using)
+    if get_backend(using) == 'sqlite' and set(fields) <= set(USER_FTS_FIELDS):
+        query = to_fts5_query(text)
+        if not query:
+            return users.none()
+        columns = ' '.join(fields)
+        return users.filter(pk__in=RawSQL(SQLITE_USER_MATCH, [f'{{{columns}}} : ({query})']))
+    for term in text.split():
+        users = users.filter(reduce(or_, (Q(**{f'{field}__icontains': term}) for field in fields)))
+    return users
+
+
+def search_messages(queryset, text, sender_fields=()):
+    """
+    Filter a message queryset to messages matching `text`, annotated with
+    `search_rank` (higher is better) and `search_snippet`, best matches first.
+
+    With `sender_fields`, names of User fields, messages whose sender has
+    every word of `text` in one of those fields match too. They rank below
+    every body match.
+    """
+    backend = get_backend(queryset.db)
+    senders = None
+    if sender_fields:
+        senders = matching_senders(text, sender_fields, queryset.db)
+        if not senders.exists():
+            senders = None
+
+    if backend == 'sqlite' and senders is not None:
+        # Messages matched by sender have no message_fts row to join, so
+        # rank and snippet are looked up per message instead
+        query = to_fts5_query(text)
+        rank = Value(0.0, output_field=FloatField())
+        snippet = Substr(F('message_body'), 1, 100)
+        if query:
+            rank = Coalesce(RawSQL(SQLITE_ROW.format(SQLITE_RANK), [query], output_field=FloatField()), rank)
+            snippet = Coalesce(RawSQL(
+                SQLITE_ROW.format(SQLITE_SNIPPET),
+                [SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS, query],
+                output_field=TextField()
+            ), snippet, output_field=TextField())
+        return queryset.filter(
+            full_text_q(text, queryset.db) | Q(sender_id__in=senders.values('pk'))
+        ).annotate(search_rank=rank, search_snippet=snippet).order_by('-search_rank', '-sent_at')
+
+    if backend == 'sqlite':
+        query = to_fts5_query(text)
+        if not query:
+            return queryset.none()
+        # Join message_fts directly: bm25() and snippet() are then evaluated
+        # once per match instead of re-running the MATCH for every row
+        return queryset.extra(
+            tables=['message_fts'],
+            where=['message_fts.rowid = message.rowid', 'message_fts MATCH %s'],
+            params=[query],
+            select={'search_rank': SQLITE_RANK, 'search_snippet': SQLITE_SNIPPET},
+            select_params=[SNIPPET_START, SNIPPET_END, SNIPPET_TOKENS],
+        ).order_by('-search_rank', '-sent_at')
+
+    match = full_text_q(text, queryset.db)
+    if senders is not None:
+        match |= Q(sender_id__in=senders.values('pk'))
+    queryset = queryset.filter(match)
+    if backend == 'postgresql':
+        rank = RawSQL(POSTGRESQL_RANK, [text], output_field=FloatField())
+        snippet = RawSQL(
+            POSTGRESQL_SNIPPET,
+            [text, SNIPPET_START, SNIPPET_END, str(SNIPPET_TOKENS)],
+            output_field=TextField()
+        )
+    else:
+        rank = Value(0.0, output_field=FloatField())
+        snippet = Substr(F('message_body'), 1, 100)
+
+    return queryset.annotate(
+        search_rank=rank, search_snippet=snippet
+    ).order_by('-search_rank', '-sent_at')
+
+
+class MessageSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter that runs the search term through the message body
+    full-text index, returning ranked results with snippets.
+
+    `message_body` in the view's search_fields selects the full-text search;
+    `sender__<field>` entries match the sender's name with icontains.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').strip()
+        if not text:
+            return queryset
+        sender_fields = [
+            field.removeprefix('sender__')
+            for field in self.get_search_fields(view, request) or ()
+            if field.startswith('sender__')
+        ]
+        return search_messages(queryset, text, sender_fields)
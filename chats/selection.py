@@ -0,0 +1,200 @@
+"""
+Sparse fieldsets and explicit expansion for read serializers.
+
+    ?fields=user_id,full_name,conversations.conversation_id
+    ?expand=conversations.participants
+
+Without either parameter serializers render exactly as before. When one
+is given, only the listed fields are rendered (all of them if `fields` is
+absent) and nested relations collapse to primary keys unless they are
+expanded. A dotted field such as `conversations.conversation_id` expands
+`conversations` and selects `conversation_id` inside it.
+
+The same selection drives the query: prepare_queryset() loads only the
+columns and relations the selected fields read, so unrequested data is
+never fetched.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def split_param(value):
+    return [path.strip() for path in (value or '').split(',') if path.strip()]
+
+
+class FieldSelection:
+    """
+    Fields to render at one level of a serializer tree: `fields` is a set
+    of names or None for every field, `expand` maps relation names to the
+    selection for the nested serializer
+    """
+
+    def __init__(self, fields=None):
+        self.fields = fields
+        self.expand = {}
+
+    @classmethod
+    def parse(cls, fields=None, expand=None):
+        root = cls(set() if split_param(fields) else None)
+        for path in split_param(fields):
+            *parents, name = path.split('.')
+            node = root
+            for parent in parents:
+                node = node.include_expanded(parent, fields=set())
+            node.include(name)
+        for path in split_param(expand):
+            node = root
+            for name in path.split('.'):
+                node = node.include_expanded(name)
+        return root
+
+    @classmethod
+    def from_request(cls, request):
+        """Return the selection asked for by a request, or None if there is none"""
+        params = getattr(request, 'query_params', None)
+        if not params or (FIELDS_PARAM not in params and EXPAND_PARAM not in params):
+            return None
+        return cls.parse(params.get(FIELDS_PARAM), params.get(EXPAND_PARAM))
+
+    def include(self, name):
+        if self.fields is not None:
+            self.fields.add(name)
+
+    def include_expanded(self, name, fields=None):
+        self.include(name)
+        if name not in self.expand:
+            self.expand[name] = FieldSelection(fields)
+        return self.expand[name]
+
+    def includes(self, name):
+        return self.fields is None or name in self.fields
+
+
+class SelectableFieldsMixin:
+    """
+    Serializer mixin that applies the FieldSelection of the current request.
+
+    computed_field_sources lists, for fields that are not plain model
+    fields, the columns they read, using dotted paths for related rows, so
+    the query can load them.
+    """
+    computed_field_sources = {}
+    _selection = None
+    _selection_resolved = False
+
+    @property
+    def selection(self):
+        if not self._selection_resolved:
+            parent = self.parent
+            if isinstance(parent, serializers.ListSerializer):
+                parent = parent.parent
+            # Only the top-level serializer reads the request; nested ones are given theirs
+            if parent is None:
+                self._selection = FieldSelection.from_request(self.context.get('request'))
+            self._selection_resolved = True
+        return self._selection
+
+    @selection.setter
+    def selection(self, value):
+        self._selection = value
+        self._selection_resolved = True
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.selection
+        if selection is None:
+            return fields
+
+        selected = {}
+        for name, field in fields.items():
+            if field.write_only:
+                selected[name] = field
+                continue
+            if not selection.includes(name):
+                continue
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if isinstance(nested, serializers.BaseSerializer):
+                if name in selection.expand and isinstance(nested, SelectableFieldsMixin):
+                    nested.selection = selection.expand[name]
+                else:
+                    kwargs = {'source': field.source} if field.source else {}
+                    field = serializers.PrimaryKeyRelatedField(read_only=True, many=many, **kwargs)
+            selected[name] = field
+        return selected
+
+
+class QueryPlan:
+    """Columns and related rows to load for one model"""
+
+    def __init__(self, model):
+        self.model = model
+        self.columns = {model._meta.pk.name}
+        self.relations = {}
+
+    def relation(self, name):
+        field = self.model._meta.get_field(name)
+        if name not in self.relations:
+            self.relations[name] = QueryPlan(field.related_model)
+            if field.one_to_many:
+                # Prefetched rows are matched to their parent through the foreign key
+                self.relations[name].columns.add(field.field.name)
+        if field.many_to_one:
+            self.columns.add(name)
+        return self.relations[name]
+
+    def add_path(self, path):
+        *relations, column = path.split('.')
+        plan = self
+        for name in relations:
+            plan = plan.relation(name)
+        plan.columns.add(column)
+
+    def add_serializer(self, serializer):
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in getattr(serializer, 'computed_field_sources', {}):
+                for path in serializer.computed_field_sources[name]:
+                    self.add_path(path)
+                continue
+
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            try:
+                model_field = self.model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                # Annotations and values computed in Python
+                continue
+
+            if isinstance(nested, serializers.BaseSerializer):
+                self.relation(field.source).add_serializer(nested)
+            elif model_field.many_to_many or model_field.one_to_many:
+                self.relation(field.source)
+            else:
+                self.columns.add(model_field.name)
+        return self
+
+    def apply(self, queryset):
+        lookups = [
+            Prefetch(name, queryset=plan.apply(plan.model._default_manager.all()))
+            for name, plan in self.relations.items()
+        ]
+        return queryset.only(*self.columns).prefetch_related(*lookups)
+
+
+def prepare_queryset(queryset, serializer_class, request, *default_lookups):
+    """
+    Load what `serializer_class` renders for this request: the selected
+    columns and relations if the request has a field selection, else the
+    `default_lookups` prefetches
+    """
+    selection = FieldSelection.from_request(request)
+    if selection is None:
+        return queryset.prefetch_related(*default_lookups)
+    serializer = serializer_class()
+    serializer.selection = selection
+    return QueryPlan(queryset.model).add_serializer(serializer).apply(queryset)
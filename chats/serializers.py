@@ -1,11 +1,26 @@
-from rest_framework import serializers
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import User, Conversation, Message
+from .membership import is_participant
+from .metrics import MeasuredSerializerMixin, phase
+from .selection import SelectableFieldsMixin
 
 
-class UserSerializer(serializers.ModelSerializer):
+def truncate_message(body, length=50):
+    """Shorten a message body for previews"""
+    if len(body) > length:
+        return body[:length - 3] + "..."
+    return body
+
+
+class UserSerializer(MeasuredSerializerMixin, SelectableFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for User model
     """
+    computed_field_sources = {'full_name': ['first_name', 'last_name']}
     # Add CharField for full_name using SerializerMethodField
     full_name = serializers.SerializerMethodField()
     
@@ -28,7 +43,7 @@ class UserSerializer(serializers.ModelSerializer):
         return f"{obj.first_name} {obj.last_name}"
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(MeasuredSerializerMixin, SelectableFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Message model
     """
@@ -54,9 +69,7 @@ class MessageSerializer(serializers.ModelSerializer):
     
     def get_message_preview(self, obj):
         """Custom method for message preview"""
-        if len(obj.message_body) > 50:
-            return obj.message_body[:47] + "..."
-        return obj.message_body
+        return truncate_message(obj.message_body)
     
     def validate_message_body(self, value):
         """Validation for message body"""
@@ -67,10 +80,111 @@ class MessageSerializer(serializers.ModelSerializer):
         return value
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+# Columns read by serialize_message_values, with the sender joined in SQL
+MESSAGE_VALUES_FIELDS = [
+    'message_id',
+    'sender_id',
+    'sender__first_name',
+    'sender__last_name',
+    'sender__email',
+    'sender__phone_number',
+    'sender__role',
+    'sender__created_at',
+    'conversation_id',
+    'message_body',
+    'sent_at',
+]
+
+
+def datetime_formatter():
+    """
+    Return a function that formats datetimes exactly like DRF's
+    DateTimeField, resolving the output timezone once instead of per value
+    """
+    field = serializers.DateTimeField()
+    if api_settings.DATETIME_FORMAT.lower() != ISO_8601 or not settings.USE_TZ:
+        return field.to_representation
+    output_timezone = timezone.get_current_timezone()
+
+    def format_datetime(value):
+        if value is None or timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(output_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return format_datetime
+
+
+def message_values(queryset):
+    """Turn a Message queryset into the values() rows serialize_message_values reads"""
+    return queryset.values(*MESSAGE_VALUES_FIELDS)
+
+
+def serialize_message_values(rows):
+    """
+    Read-only fast path for MessageSerializer(many=True): builds the same
+    representation, key for key, straight from values() rows without
+    going through DRF field machinery
+    """
+    format_datetime = datetime_formatter()
+    with phase('serialize'):
+        return [
+            {
+                'message_id': str(row['message_id']),
+                'sender': {
+                    'user_id': str(row['sender_id']),
+                    'first_name': row['sender__first_name'],
+                    'last_name': row['sender__last_name'],
+                    'full_name': f"{row['sender__first_name']} {row['sender__last_name']}",
+                    'email': row['sender__email'],
+                    'phone_number': row['sender__phone_number'],
+                    'role': row['sender__role'],
+                    'created_at': format_datetime(row['sender__created_at']),
+                },
+                'conversation': row['conversation_id'],
+                'message_body': row['message_body'],
+                'sent_at': format_datetime(row['sent_at']),
+            }
+            for row in rows
+        ]
+
+
+def normalize_senders(messages):
+    """
+    Move the nested sender of serialized messages to a side table keyed by
+    user_id, so each sender is sent once and messages refer to it by id.
+    Returns (messages, users).
+    """
+    users = {}
+    normalized = []
+    for message in messages:
+        sender = message.get('sender')
+        if isinstance(sender, dict) and 'user_id' in sender:
+            users.setdefault(str(sender['user_id']), sender)
+            message = dict(message, sender=sender['user_id'])
+        normalized.append(message)
+    return normalized, users
+
+
+class MessageSearchResultSerializer(MessageSerializer):
+    """
+    Message serializer for full-text search results with rank and snippet
+    """
+    search_rank = serializers.FloatField(read_only=True, allow_null=True)
+    search_snippet = serializers.CharField(read_only=True, allow_null=True)
+    
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ['search_rank', 'search_snippet']
+
+
+class ConversationSerializer(MeasuredSerializerMixin, SelectableFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Conversation model with nested messages
     """
+    computed_field_sources = {
+        'participant_names': ['participants.first_name', 'participants.last_name']
+    }
     participants = UserSerializer(many=True, read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
     # Add CharField for participant names
@@ -87,12 +201,71 @@ class ConversationSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['conversation_id', 'created_at', 'participant_names']
     
+    @staticmethod
+    def get_prefetch_lookups(prefix=''):
+        """
+        Lookups that load everything this serializer reads, so a page of
+        conversations costs the same number of queries as a single one
+        """
+        return [
+            f'{prefix}participants',
+            Prefetch(f'{prefix}messages', queryset=Message.objects.select_related('sender')),
+        ]
+    
     def get_participant_names(self, obj):
         """SerializerMethodField to get participant names as string"""
         return ", ".join([f"{user.first_name} {user.last_name}" for user in obj.participants.all()])
 
 
-class ConversationCreateSerializer(serializers.ModelSerializer):
+class LastMessageSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
+    """
+    Compact message representation used for inbox previews
+    """
+    sender_name = serializers.SerializerMethodField()
+    message_preview = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Message
+        fields = [
+            'message_id',
+            'sender',
+            'sender_name',
+            'message_preview',
+            'sent_at'
+        ]
+        read_only_fields = fields
+    
+    def get_sender_name(self, obj):
+        return f"{obj.sender.first_name} {obj.sender.last_name}"
+    
+    def get_message_preview(self, obj):
+        return truncate_message(obj.message_body)
+
+
+class ConversationInboxSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
+    """
+    Inbox entry for a conversation: participants, last message and counts
+    without the message history
+    """
+    participants = UserSerializer(many=True, read_only=True)
+    last_message = LastMessageSerializer(read_only=True, allow_null=True)
+    message_count = serializers.IntegerField(read_only=True)
+    last_activity_at = serializers.DateTimeField(read_only=True)
+    
+    class Meta:
+        model = Conversation
+        fields = [
+            'conversation_id',
+            'participants',
+            'last_message',
+            'message_count',
+            'last_activity_at',
+            'created_at'
+        ]
+        read_only_fields = fields
+
+
+class ConversationCreateSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for creating conversations with participant IDs
     """
@@ -150,7 +323,7 @@ class ConversationCreateSerializer(serializers.ModelSerializer):
         return conversation
 
 
-class MessageCreateSerializer(serializers.ModelSerializer):
+class MessageCreateSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for creating messages
     """
@@ -181,7 +354,7 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         sender = data.get('sender')
         
         if conversation and sender:
-            if not conversation.participants.filter(user_id=sender.user_id).exists():
+            if not is_participant(conversation.pk, sender.user_id):
                 raise serializers.ValidationError({
                     'sender': 'Sender must be a participant in the conversation'
                 })
@@ -189,7 +362,36 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         return data
 
 
-class UserDetailSerializer(serializers.ModelSerializer):
+class MessageBulkItemSerializer(MeasuredSerializerMixin, serializers.Serializer):
+    """
+    One message of a bulk create request. The conversation is taken as a
+    plain UUID so validating a batch does not query per item.
+    """
+    conversation = serializers.UUIDField()
+    message_body = serializers.CharField(trim_whitespace=False)
+    
+    def validate_message_body(self, value):
+        """Validation for message body"""
+        if not value.strip():
+            raise serializers.ValidationError("Message body cannot be empty")
+        return value
+
+
+class MessageBulkCreateSerializer(MeasuredSerializerMixin, serializers.Serializer):
+    """
+    Envelope for bulk message creation. Items are validated one by one so a
+    bad item does not reject the whole batch.
+    """
+    max_messages = 500
+    
+    messages = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=max_messages
+    )
+
+
+class UserDetailSerializer(MeasuredSerializerMixin, SelectableFieldsMixin, serializers.ModelSerializer):
     """
     Detailed User serializer with conversations
     """
@@ -214,6 +416,14 @@ class UserDetailSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['user_id', 'created_at', 'message_count']
     
+    @staticmethod
+    def get_prefetch_lookups():
+        """Lookups that load the nested conversations and sent messages up front"""
+        return ConversationSerializer.get_prefetch_lookups(prefix='conversations__') + [
+            Prefetch('sent_messages', queryset=Message.objects.select_related('sender')),
+        ]
+    
     def get_message_count(self, obj):
         """SerializerMethodField to get message count"""
-        return obj.sent_messages.count()
\ No newline at end of file
+        # Uses the prefetched rows when available instead of a COUNT query
+        return obj.sent_messages.count()
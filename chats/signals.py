@@ -0,0 +1,57 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import membership
+from .auth import invalidate_user
+from .models import Conversation, User
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_membership_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached membership when participants are added, removed or cleared"""
+    if action == 'pre_clear':
+        # pk_set is not provided for clear(), so collect the members now
+        if reverse:
+            pairs = [(pk, instance.pk) for pk in instance.conversations.values_list('pk', flat=True)]
+        else:
+            pairs = [(instance.pk, pk) for pk in instance.participants.values_list('pk', flat=True)]
+    elif action in ('post_add', 'post_remove') and pk_set:
+        if reverse:
+            pairs = [(pk, instance.pk) for pk in pk_set]
+        else:
+            pairs = [(instance.pk, pk) for pk in pk_set]
+    else:
+        return
+
+    membership.invalidate(pairs)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def touch_conversation_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """Move updated_at of conversations whose participants changed"""
+    if action == 'pre_clear':
+        if reverse:
+            conversation_ids = list(instance.conversations.values_list('pk', flat=True))
+        else:
+            conversation_ids = [instance.pk]
+    elif action in ('post_add', 'post_remove') and pk_set:
+        conversation_ids = pk_set if reverse else [instance.pk]
+    else:
+        return
+
+    Conversation.touch(conversation_ids)
+
+
+@receiver(pre_delete, sender=Conversation)
+def invalidate_membership_on_delete(sender, instance, **kwargs):
+    """Drop cached membership of a conversation that is being deleted"""
+    membership.invalidate(
+        (instance.pk, pk) for pk in instance.participants.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached authenticated user when the user changes or is deleted"""
+    invalidate_user(instance.pk)
@@ -0,0 +1,84 @@
+"""
+SQLite backend tuned for several concurrent workers.
+
+Use it as ENGINE 'chats.sqlite'. On top of Django's SQLite backend it:
+
+- applies PRAGMAs to every new connection, by default synchronous=NORMAL,
+  a larger page cache and memory-mapped I/O. Override them with the
+  `pragmas` entry of OPTIONS.
+- starts transactions with BEGIN IMMEDIATE (OPTIONS `transaction_mode`),
+  so a transaction takes the write lock up front and waits for it
+  through the busy timeout (OPTIONS `timeout`, in seconds). A deferred
+  transaction that reads and then writes fails at once with "database
+  is locked" when another writer got in between, whatever the timeout.
+- retries statements that still fail with "database is locked" outside
+  a transaction, including BEGIN, up to `lock_retries` more times with
+  exponential backoff. Statements inside a transaction are never
+  retried, since the transaction as a whole would have to be.
+
+WAL journaling (readers no longer block the writer) is not among the
+PRAGMAs: the journal mode is stored in the database file, and setting it
+on connect would rewrite any file a command merely opens, such as the
+db.sqlite3 checked into the repository. Switch a database to WAL once
+with `manage.py enable_wal`, or add journal_mode to `pragmas` for
+throwaway databases.
+
+Connections are reused across requests with CONN_MAX_AGE, except under
+ASGI (see messaging_app/asgi.py).
+"""
+import random
+import time
+
+from django.db import OperationalError
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    # Negative sizes are in KiB: 64 MiB of page cache per connection
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+DEFAULT_TRANSACTION_MODE = 'IMMEDIATE'
+DEFAULT_LOCK_RETRIES = 3
+LOCK_RETRY_DELAY = 0.05
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {**DEFAULT_PRAGMAS, **options.get('pragmas', {})}
+        self.transaction_mode = options.get('transaction_mode', DEFAULT_TRANSACTION_MODE)
+        self.lock_retries = options.get('lock_retries', DEFAULT_LOCK_RETRIES)
+        self.execute_wrappers.append(self.retry_locked)
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for option in ('pragmas', 'transaction_mode', 'lock_retries'):
+            params.pop(option, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')
+        else:
+            super()._start_transaction_under_autocommit()
+
+    def retry_locked(self, execute, sql, params, many, context):
+        attempt = 0
+        while True:
+            try:
+                return execute(sql, params, many, context)
+            except OperationalError as exc:
+                if 'database is locked' not in str(exc) or self.in_atomic_block or attempt >= self.lock_retries:
+                    raise
+            time.sleep(LOCK_RETRY_DELAY * 2 ** attempt * (1 + random.random()))
+            attempt += 1
@@ -1,3 +1,1769 @@
-from django.test import TestCase
+import asyncio
+import uuid
+import csv
+import json
+import pstats
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from urllib.parse import urlsplit
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import F
+from django.test import AsyncClient, LiveServerTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .benchmarks import seed_conversations, seed_messages, seed_users
+from .management.commands.bench_load import Client as LoadClient
+from .archive import archive_batch, archive_cutoff, archive_messages
+from . import metrics
+from .checks import check_membership_cache
+from .membership import is_participant
+from .models import ArchivedMessage, User, Conversation, Message, SyncCounter
+from .renderers import FastJSONRenderer, msgpack
+from .pagination import encode_cursor
+from .realtime import get_broker, publish_messages, user_channel
+from .routers import replica_reads
+from .sqlite.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from .views import UserViewSet
+from .serializers import MessageSerializer, message_values, serialize_message_values
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ChatsAPITestCase(APITestCase):
+    """
+    Base test case with two participants sharing a conversation
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(
+            email='alice@example.com', password='pass1234', first_name='Alice', last_name='Smith'
+        )
+        self.bob = User.objects.create_user(
+            email='bob@example.com', password='pass1234', first_name='Bob', last_name='Jones'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        self.client.force_authenticate(self.alice)
+
+    def create_messages(self, count, conversation=None, sender=None):
+        """Create `count` messages one second apart, oldest first"""
+        start = timezone.now() - timedelta(seconds=count)
+        return [
+            Message.objects.create(
+                conversation=conversation or self.conversation,
+                sender=sender or self.alice,
+                message_body=f'message {i}',
+                sent_at=start + timedelta(seconds=i),
+            )
+            for i in range(count)
+        ]
+
+    def refresh_activity(self):
+        """Sync the activity columns after creating messages directly"""
+        Conversation.objects.recompute_activity()
+
+
+class MessageCursorPaginationTests(ChatsAPITestCase):
+    """
+    Tests for keyset pagination of message feeds
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.messages = self.create_messages(25)
+
+    def collect_history(self, url, params):
+        """Follow `previous` links back to the start of the conversation"""
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pages = [response.data['results']]
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            pages.insert(0, response.data['results'])
+        return [item['message_id'] for page in pages for item in page]
+
+    def test_latest_page_is_returned_oldest_first(self):
+        response = self.client.get('/api/messages/', {'pagination': 'cursor', 'page_size': 10})
+        ids = [item['message_id'] for item in response.data['results']]
+        self.assertEqual(ids, [str(m.message_id) for m in self.messages[-10:]])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_scroll_back_visits_every_message_once(self):
+        ids = self.collect_history('/api/messages/', {'pagination': 'cursor', 'page_size': 10})
+        self.assertEqual(ids, [str(m.message_id) for m in self.messages])
+
+    def test_conversation_feed_scroll_back(self):
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        ids = self.collect_history(url, {'pagination': 'cursor', 'page_size': 7})
+        self.assertEqual(ids, [str(m.message_id) for m in self.messages])
+
+    def test_ties_on_sent_at_are_broken_by_message_id(self):
+        Message.objects.update(sent_at=self.messages[0].sent_at)
+        ids = self.collect_history('/api/messages/', {'pagination': 'cursor', 'page_size': 4})
+        self.assertEqual(ids, sorted(str(m.message_id) for m in self.messages))
+
+    def test_after_cursor_returns_newer_messages(self):
+        response = self.client.get('/api/messages/', {'pagination': 'cursor', 'page_size': 10})
+        older = self.client.get(response.data['previous'])
+        newer = self.client.get(older.data['next'])
+        self.assertEqual(newer.data['results'], response.data['results'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/messages/', {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_pagination_is_still_the_default(self):
+        response = self.client.get('/api/messages/')
+        self.assertEqual(response.data['count'], 25)
+        self.assertEqual(len(response.data['results']), 10)
+
+
+class QueryCountTests(ChatsAPITestCase):
+    """
+    The conversation and user detail endpoints must run a fixed number of
+    queries no matter how many rows they return
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.carol = User.objects.create_user(
+            email='carol@example.com', password='pass1234', first_name='Carol', last_name='White'
+        )
+        self.create_messages(2)
+
+    def add_conversations(self, count):
+        """Create more conversations, each with messages from every participant"""
+        for _ in range(count):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob, self.carol])
+            for sender in (self.alice, self.bob, self.carol):
+                self.create_messages(2, conversation=conversation, sender=sender)
+
+    def assertConstantQueries(self, url, expected):
+        with self.assertNumQueries(expected):
+            small = self.client.get(url)
+        self.add_conversations(5)
+        cache.clear()
+        with self.assertNumQueries(expected):
+            large = self.client.get(url)
+        self.assertEqual(small.status_code, status.HTTP_200_OK)
+        self.assertEqual(large.status_code, status.HTTP_200_OK)
+
+    def test_conversation_list(self):
+        # count, page, participants, messages with senders
+        self.assertConstantQueries('/api/conversations/', 4)
+
+    def test_conversation_retrieve(self):
+        # permission check, validators, conversation, participants, messages with senders
+        self.assertConstantQueries(f'/api/conversations/{self.conversation.pk}/', 5)
+
+    def test_user_conversations(self):
+        # user, conversations, participants, messages with senders
+        self.assertConstantQueries(f'/api/users/{self.alice.pk}/conversations/', 4)
+
+    def test_user_retrieve(self):
+        # user, conversations, participants, messages with senders, sent messages
+        self.assertConstantQueries(f'/api/users/{self.alice.pk}/', 5)
+
+    def test_me(self):
+        # validators, user, conversations, participants, messages with senders, sent messages
+        self.assertConstantQueries('/api/users/me/', 6)
+
+
+class ConversationInboxTests(ChatsAPITestCase):
+    """
+    Tests for the inbox representation of conversations
+    """
+
+    def test_inbox_entries(self):
+        messages = self.create_messages(3)
+        Message.objects.filter(pk=messages[-1].pk).update(message_body='x' * 80)
+        self.refresh_activity()
+        response = self.client.get('/api/conversations/inbox/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = response.data['results'][0]
+        self.assertNotIn('messages', entry)
+        self.assertEqual(entry['message_count'], 3)
+        self.assertEqual(entry['last_message']['message_id'], str(messages[-1].message_id))
+        self.assertEqual(entry['last_message']['message_preview'], 'x' * 47 + '...')
+        self.assertEqual(entry['last_message']['sender_name'], 'Alice Smith')
+        self.assertEqual(len(entry['participants']), 2)
+
+    def test_inbox_is_sorted_by_last_activity(self):
+        quiet = Conversation.objects.create()
+        quiet.participants.set([self.alice, self.bob])
+        self.create_messages(2, conversation=quiet)
+        self.create_messages(1)
+        empty = Conversation.objects.create()
+        empty.participants.set([self.alice, self.bob])
+        self.refresh_activity()
+
+        response = self.client.get('/api/conversations/inbox/')
+        ids = [entry['conversation_id'] for entry in response.data['results']]
+        self.assertEqual(ids, [str(empty.pk), str(self.conversation.pk), str(quiet.pk)])
+        self.assertIsNone(response.data['results'][0]['last_message'])
+        self.assertEqual(response.data['results'][0]['message_count'], 0)
+
+    def test_inbox_only_lists_own_conversations(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        other = Conversation.objects.create()
+        other.participants.set([self.bob, carol])
+        response = self.client.get('/api/conversations/inbox/')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_inbox_query_count_does_not_grow_with_history(self):
+        self.create_messages(20)
+        self.refresh_activity()
+        # count, page with last messages, participants
+        with self.assertNumQueries(3):
+            self.client.get('/api/conversations/inbox/')
+
+
+class ConversationActivityTests(ChatsAPITestCase):
+    """
+    Tests for the denormalized conversation activity columns
+    """
+
+    def send(self, body):
+        response = self.client.post(
+            '/api/messages/',
+            {'conversation': str(self.conversation.pk), 'message_body': body},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['message_id']
+
+    def test_create_updates_activity(self):
+        self.send('first')
+        second = self.send('second')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(str(self.conversation.last_message_id), second)
+        self.assertEqual(self.conversation.last_message_at, self.conversation.last_message.sent_at)
+
+    def test_delete_updates_activity(self):
+        first = self.send('first')
+        second = self.send('second')
+        self.client.delete(f'/api/messages/{second}/')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(str(self.conversation.last_message_id), first)
+
+        self.client.delete(f'/api/messages/{first}/')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 0)
+        self.assertIsNone(self.conversation.last_message)
+        self.assertIsNone(self.conversation.last_message_at)
+
+    def test_repair_command(self):
+        messages = self.create_messages(3)
+        self.assertEqual(Conversation.objects.get(pk=self.conversation.pk).message_count, 0)
+        call_command('repair_conversation_activity', stdout=StringIO())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+        self.assertEqual(self.conversation.last_message, messages[-1])
+
+
+class MessageSearchTests(ChatsAPITestCase):
+    """
+    Tests for full-text search over message bodies
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.lunch = Message.objects.create(
+            conversation=self.conversation, sender=self.alice,
+            message_body='Lunch tomorrow? The new ramen place near the office'
+        )
+        self.ramen = Message.objects.create(
+            conversation=self.conversation, sender=self.bob,
+            message_body='ramen ramen ramen'
+        )
+        Message.objects.create(
+            conversation=self.conversation, sender=self.bob,
+            message_body='Deploy is done'
+        )
+
+    def result_ids(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data
+        if isinstance(results, dict):
+            results = results['results']
+        return [item['message_id'] for item in results]
+
+    def test_list_search_is_ranked_with_snippets(self):
+        response = self.client.get('/api/messages/', {'search': 'ramen'})
+        self.assertEqual(
+            self.result_ids(response), [str(self.ramen.pk), str(self.lunch.pk)]
+        )
+        first = response.data['results'][0]
+        self.assertIn('<mark>ramen</mark>', first['search_snippet'])
+        self.assertGreater(first['search_rank'], response.data['results'][1]['search_rank'])
+
+    def test_words_match_as_prefixes(self):
+        response = self.client.get('/api/messages/my_messages/', {'message_body': 'tomor'})
+        self.assertEqual(self.result_ids(response), [str(self.lunch.pk)])
+
+    def test_conversation_search_paths(self):
+        response = self.client.get(
+            f'/api/conversations/{self.conversation.pk}/messages/', {'message_body': 'deploy'}
+        )
+        self.assertEqual(len(self.result_ids(response)), 1)
+        response = self.client.get(
+            '/api/messages/conversation_messages/',
+            {'conversation_id': str(self.conversation.pk), 'filter': 'deploy'}
+        )
+        self.assertEqual(len(self.result_ids(response)), 1)
+
+    def test_index_follows_updates_and_deletes(self):
+        Message.objects.filter(pk=self.lunch.pk).update(message_body='Dinner tonight')
+        self.ramen.delete()
+        response = self.client.get('/api/messages/', {'search': 'ramen'})
+        self.assertEqual(self.result_ids(response), [])
+        response = self.client.get('/api/messages/', {'search': 'dinner'})
+        self.assertEqual(self.result_ids(response), [str(self.lunch.pk)])
+
+    def test_query_syntax_is_not_interpreted(self):
+        response = self.client.get('/api/messages/', {'search': 'ramen" OR (NEAR'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_search_matches_sender_names(self):
+        mention = Message.objects.create(
+            conversation=self.conversation, sender=self.alice, message_body='Ask Jones about it'
+        )
+        bobs = list(
+            Message.objects.filter(sender=self.bob).order_by('-sent_at').values_list('pk', flat=True)
+        )
+        response = self.client.get('/api/messages/', {'search': 'jones'})
+        # Body matches rank above messages matched by their sender's name
+        self.assertEqual(
+            self.result_ids(response), [str(pk) for pk in [mention.pk] + bobs]
+        )
+        self.assertIn('<mark>Jones</mark>', response.data['results'][0]['search_snippet'])
+        self.assertEqual(response.data['results'][1]['search_rank'], 0.0)
+
+        response = self.client.get('/api/messages/', {'search': 'bob jon'})
+        self.assertEqual(self.result_ids(response), [str(pk) for pk in bobs])
+        # Names are indexed as they change
+        User.objects.filter(pk=self.bob.pk).update(last_name='Quinn')
+        response = self.client.get('/api/messages/', {'search': 'quin'})
+        self.assertEqual(self.result_ids(response), [str(pk) for pk in bobs])
+        # Only the list searches by sender
+        response = self.client.get('/api/messages/my_messages/', {'message_body': 'alice'})
+        self.assertEqual(self.result_ids(response), [])
+
+
+class MessageBulkCreateTests(ChatsAPITestCase):
+    """
+    Tests for bulk message ingestion
+    """
+
+    def test_bulk_create_across_conversations(self):
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.bob])
+        payload = {'messages': [
+            {'conversation': str(self.conversation.pk), 'message_body': f'msg {i}'}
+            for i in range(50)
+        ] + [{'conversation': str(other.pk), 'message_body': 'hello'}]}
+
+        # membership, savepoint, sync numbers, insert, two activity updates
+        # per conversation, release
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/messages/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 51)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 50)
+        self.assertEqual(self.conversation.last_message.message_body, 'msg 49')
+        bodies = list(self.conversation.messages.values_list('message_body', flat=True))
+        self.assertEqual(bodies, [f'msg {i}' for i in range(50)])
+
+    def test_bulk_create_reports_per_item_results(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        foreign = Conversation.objects.create()
+        foreign.participants.set([self.bob, carol])
+        payload = {'messages': [
+            {'conversation': str(self.conversation.pk), 'message_body': 'ok'},
+            {'conversation': str(self.conversation.pk), 'message_body': '   '},
+            {'conversation': str(foreign.pk), 'message_body': 'sneaky'},
+            {'conversation': '00000000-0000-0000-0000-000000000000', 'message_body': 'lost'},
+        ]}
+        response = self.client.post('/api/messages/bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        statuses = [item['status'] for item in response.data['results']]
+        self.assertEqual(statuses, [201, 400, 403, 404])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_bulk_create_limits_batch_size(self):
+        payload = {'messages': [
+            {'conversation': str(self.conversation.pk), 'message_body': 'x'}
+        ] * 501}
+        response = self.client.post('/api/messages/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MembershipCacheTests(ChatsAPITestCase):
+    """
+    Tests for the cached participant checks on the message write path
+    """
+
+    def send(self):
+        return self.client.post(
+            '/api/messages/',
+            {'conversation': str(self.conversation.pk), 'message_body': 'hi'},
+            format='json'
+        )
+
+    def test_send_reuses_cached_membership(self):
+        self.send()
+        # conversation, sender, savepoint, sync number, insert, two activity
+        # updates, release
+        with self.assertNumQueries(8):
+            response = self.send()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_remove_participant_invalidates(self):
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
+        self.client.force_authenticate(self.alice)
+        self.conversation.participants.add(
+            User.objects.create_user(email='carol@example.com', password='pass1234')
+        )
+        response = self.client.post(
+            f'/api/conversations/{self.conversation.pk}/remove_participant/',
+            {'user_id': str(self.bob.pk)}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.send().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_add_participant_invalidates(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.client.force_authenticate(carol)
+        self.assertEqual(self.send().status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.alice)
+        self.client.post(
+            f'/api/conversations/{self.conversation.pk}/add_participant/',
+            {'user_id': str(carol.pk)}, format='json'
+        )
+        self.client.force_authenticate(carol)
+        self.assertEqual(self.send().status_code, status.HTTP_201_CREATED)
+
+    def test_conversation_create_invalidates(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.client.force_authenticate(carol)
+        response = self.client.post(
+            '/api/conversations/', {'participant_ids': [str(self.bob.pk)]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        conversation_id = response.data['conversation_id']
+        self.assertTrue(is_participant(conversation_id, carol.pk))
+        Conversation.objects.get(pk=conversation_id).delete()
+        self.assertFalse(is_participant(conversation_id, carol.pk))
+
+
+    def test_negative_answers_are_not_cached(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.assertFalse(is_participant(self.conversation.pk, carol.pk))
+        # Added behind the signal handlers' back, as another worker would see it
+        Conversation.participants.through.objects.create(conversation=self.conversation, user=carol)
+        self.assertTrue(is_participant(self.conversation.pk, carol.pk))
+
+    def test_deploy_check_warns_about_process_local_caches(self):
+        self.assertEqual([error.id for error in check_membership_cache(None)], ['chats.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_membership_cache(None), [])
+
+
+class CachedJWTAuthenticationTests(ChatsAPITestCase):
+    """
+    Tests for user caching in CustomJWTAuthentication
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(None)
+        response = self.client.post(
+            '/api/auth/token/', {'email': 'alice@example.com', 'password': 'pass1234'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        caches['auth'].clear()
+
+    def user_queries(self, url='/api/conversations/inbox/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [q for q in queries if 'FROM "user" WHERE "user"."user_id" =' in q['sql']]
+
+    def test_user_is_cached_between_requests(self):
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(len(self.user_queries()), 0)
+
+    def test_deactivation_invalidates(self):
+        self.user_queries()
+        self.alice.is_active = False
+        self.alice.save()
+        response = self.client.get('/api/conversations/inbox/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_update_invalidates(self):
+        self.user_queries()
+        self.alice.role = 'admin'
+        self.alice.save()
+        self.assertEqual(len(self.user_queries()), 1)
+
+    @override_settings(CHATS_JWT_USER_FROM_CLAIMS=True)
+    def test_reads_build_user_from_claims(self):
+        self.assertEqual(self.user_queries(), [])
+        response = self.client.get('/api/messages/my_messages/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CHATS_JWT_USER_FROM_CLAIMS=True)
+    def test_refresh_picks_up_a_demotion(self):
+        self.alice.role = 'admin'
+        self.alice.is_staff = True
+        self.alice.save()
+        response = self.client.post(
+            '/api/auth/token/', {'email': 'alice@example.com', 'password': 'pass1234'}, format='json'
+        )
+        refresh = response.data['refresh']
+        self.alice.role = 'guest'
+        self.alice.is_staff = False
+        self.alice.save()
+
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = AccessToken(response.data['access'])
+        self.assertEqual((access['role'], access['is_staff']), ('guest', False))
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(CHATS_JWT_USER_FROM_CLAIMS=True)
+    def test_writes_still_load_the_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/messages/',
+                {'conversation': str(self.conversation.pk), 'message_body': 'hi'},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(any('FROM "user"' in q['sql'] for q in queries))
+
+
+class ConversationExportTests(ChatsAPITestCase):
+    """
+    Tests for streaming conversation exports
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.messages = self.create_messages(5)
+
+    def export(self, **params):
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/export/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual(
+            [row['message_id'] for row in rows], [str(m.message_id) for m in self.messages]
+        )
+        self.assertEqual(rows[0]['sender_email'], 'alice@example.com')
+
+    def test_csv_export(self):
+        rows = list(csv.DictReader(StringIO(self.export(export_format='csv'))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[-1]['message_body'], 'message 4')
+
+    async def async_export(self, **params):
+        token = AccessToken.for_user(self.alice)
+        response = await AsyncClient().get(
+            f'/api/conversations/{self.conversation.pk}/export/', params,
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        return response
+
+    async def test_asgi_export_matches_wsgi(self):
+        for export_format in ('ndjson', 'csv'):
+            with self.subTest(export_format=export_format):
+                response = await self.async_export(export_format=export_format)
+                content = b''.join([chunk async for chunk in response.streaming_content])
+                expected = await sync_to_async(self.export)(export_format=export_format)
+                self.assertEqual(content.decode(), expected)
+
+    async def test_asgi_export_streams_chunk_by_chunk(self):
+        pulled = []
+
+        def chunks(messages):
+            for number in range(3):
+                pulled.append(number)
+                yield f'{number}\n'
+
+        with mock.patch.dict('chats.views.STREAMS', {'ndjson': chunks}):
+            response = await self.async_export()
+            content = aiter(response.streaming_content)
+            self.assertEqual(await anext(content), b'0\n')
+            # The rest of the export has not been produced yet
+            self.assertEqual(pulled, [0])
+            self.assertEqual([chunk async for chunk in content], [b'1\n', b'2\n'])
+
+    def test_export_is_limited_to_participants(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.client.force_authenticate(carol)
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/export/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            f'/api/conversations/{self.conversation.pk}/export/', {'export_format': 'xml'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RealtimeDeliveryTests(ChatsAPITestCase):
+
+    async def test_publish_reaches_every_participant(self):
+        broker = get_broker()
+        async with broker.subscribe(user_channel(self.bob.user_id)) as subscription:
+            messages = await sync_to_async(self.create_messages)(2)
+            await sync_to_async(publish_messages)(messages)
+            for message in messages:
+                payload = json.loads(await subscription.get(timeout=1))
+                self.assertEqual(payload['type'], 'message.created')
+                self.assertEqual(payload['message']['message_id'], str(message.message_id))
+            self.assertIsNone(await subscription.get(timeout=0.01))
+
+    async def test_publish_serializes_only_for_subscribers(self):
+        messages = await sync_to_async(self.create_messages)(2)
+        with mock.patch('chats.realtime.MessageSerializer', wraps=MessageSerializer) as serializer:
+            await sync_to_async(publish_messages)(messages)
+            self.assertEqual(serializer.call_count, 0)
+            async with get_broker().subscribe(user_channel(self.alice.user_id)) as subscription:
+                await sync_to_async(publish_messages)(messages)
+                self.assertEqual(serializer.call_count, 2)
+                self.assertIsNotNone(await subscription.get(timeout=1))
+
+    def test_create_publishes_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/messages/', {
+                'conversation': str(self.conversation.pk), 'message_body': 'hello'
+            })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(callbacks)
+
+    async def test_stream_requires_authentication(self):
+        response = await AsyncClient().get('/api/stream/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_stream_delivers_events(self):
+        token = str(AccessToken.for_user(self.bob))
+        response = await AsyncClient().get('/api/stream/', {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        get_broker().publish(user_channel(self.bob.user_id), '{"type": "message.created"}')
+        event = await asyncio.wait_for(anext(chunks), 1)
+        self.assertEqual(event, b'event: message\ndata: {"type": "message.created"}\n\n')
+        await chunks.aclose()
+
+
+class MessageSyncTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.other = Conversation.objects.create()
+        self.other.participants.set([self.alice, self.carol])
+        self.hidden = Conversation.objects.create()
+        self.hidden.participants.set([self.bob, self.carol])
+
+    def sync(self, **params):
+        response = self.client.get('/api/messages/sync/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_counter_row_is_recreated(self):
+        SyncCounter.objects.all().delete()
+        self.assertEqual(SyncCounter.reserve(3), 1)
+        self.assertEqual(SyncCounter.reserve(), 4)
+
+    def test_sync_walks_every_conversation_in_batches(self):
+        messages = self.create_messages(3) + self.create_messages(3, conversation=self.other)
+        self.create_messages(2, conversation=self.hidden, sender=self.bob)
+        # In the order they were written
+        expected = messages
+
+        ids, since, has_more = [], None, True
+        while has_more:
+            params = {'limit': 4}
+            if since:
+                params['since'] = since
+            data = self.sync(**params)
+            ids += [item['message_id'] for item in data['results']]
+            since, has_more = data['since'], data['has_more']
+        self.assertEqual(ids, [str(m.message_id) for m in expected])
+
+        self.create_messages(1, conversation=self.other, sender=self.carol)
+        data = self.sync(since=since)
+        self.assertEqual(len(data['results']), 1)
+        self.assertNotEqual(data['since'], since)
+
+    def test_up_to_date_client_keeps_its_mark(self):
+        self.create_messages(2)
+        since = self.sync()['since']
+        data = self.sync(since=since)
+        self.assertEqual(data['results'], [])
+        self.assertEqual(data['since'], since)
+        self.assertFalse(data['has_more'])
+
+    def test_query_count_does_not_grow_with_conversations(self):
+        for _ in range(5):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob])
+            self.create_messages(2, conversation=conversation)
+        with self.assertNumQueries(3):
+            self.sync()
+
+    def test_edits_and_deletes_are_synced(self):
+        first, second = self.create_messages(2)
+        since = self.sync()['since']
+
+        response = self.client.patch(f'/api/messages/{first.pk}/', {'message_body': 'edited'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(f'/api/messages/{second.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        data = self.sync(since=since)
+        self.assertEqual([item['message_body'] for item in data['results']], ['edited'])
+        self.assertEqual(data['deleted'], [second.pk])
+        self.assertEqual(self.sync(since=data['since'])['results'], [])
+
+    def test_late_commits_are_not_skipped(self):
+        self.create_messages(1)
+        since = self.sync()['since']
+        # Sent before the synced message but committed after it, like a
+        # bulk send that waited for the write lock
+        late = Message.objects.create(
+            conversation=self.other, sender=self.carol, message_body='late',
+            sent_at=timezone.now() - timedelta(days=1),
+        )
+        data = self.sync(since=since)
+        self.assertEqual([item['message_id'] for item in data['results']], [str(late.pk)])
+
+    def test_invalid_mark(self):
+        response = self.client.get('/api/messages/sync/', {'since': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ConditionalRequestTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(2)
+
+    def assertNotModifiedUntil(self, url, change):
+        """Revalidating `url` gives 304 until `change` runs, then a fresh 200"""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def post_message(self):
+        self.client.post('/api/messages/', {
+            'conversation': str(self.conversation.pk), 'message_body': 'new'
+        })
+
+    def test_conversation_retrieve(self):
+        self.assertNotModifiedUntil(f'/api/conversations/{self.conversation.pk}/', self.post_message)
+
+    def test_conversation_messages_after_edit(self):
+        message = Message.objects.first()
+        self.assertNotModifiedUntil(
+            f'/api/conversations/{self.conversation.pk}/messages/',
+            lambda: self.client.patch(f'/api/messages/{message.pk}/', {'message_body': 'edited'})
+        )
+
+    def test_me_after_participant_change(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.assertNotModifiedUntil(
+            '/api/users/me/', lambda: self.conversation.participants.add(carol)
+        )
+
+    def test_message_list_after_profile_change(self):
+        def rename():
+            self.bob.first_name = 'Robert'
+            self.bob.save()
+        self.assertNotModifiedUntil('/api/messages/', rename)
+
+    def test_not_modified_skips_serialization(self):
+        url = f'/api/conversations/{self.conversation.pk}/'
+        etag = self.client.get(url)['ETag']
+        # permission check and validators only
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since(self):
+        response = self.client.get('/api/users/me/')
+        response = self.client.get(
+            '/api/users/me/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_non_participant_gets_404_not_304(self):
+        url = f'/api/conversations/{self.conversation.pk}/'
+        etag = self.client.get(url)['ETag']
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.client.force_authenticate(carol)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SparseFieldsetTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(2)
+
+    def test_default_output_is_unchanged(self):
+        data = self.client.get('/api/users/me/').data
+        self.assertIn('sent_messages', data)
+        self.assertIn('participants', data['conversations'][0])
+        self.assertEqual(data['conversations'][0]['participants'][0].keys(), {
+            'user_id', 'first_name', 'last_name', 'full_name', 'email', 'phone_number', 'role', 'created_at'
+        })
+
+    def test_fields_limits_output(self):
+        data = self.client.get('/api/users/me/', {'fields': 'user_id,email'}).data
+        self.assertEqual(data, {'user_id': str(self.alice.user_id), 'email': 'alice@example.com'})
+
+    def test_unexpanded_relations_collapse_to_ids(self):
+        data = self.client.get('/api/messages/', {'fields': 'message_id,sender'}).data
+        self.assertEqual(data['results'][0], {
+            'message_id': str(Message.objects.first().message_id), 'sender': self.alice.user_id
+        })
+
+    def test_dotted_fields_expand_relations(self):
+        data = self.client.get(
+            '/api/conversations/',
+            {'fields': 'conversation_id,participant_names,messages.message_body,messages.sender.full_name'}
+        ).data
+        conversation = data['results'][0]
+        self.assertCountEqual(conversation['participant_names'].split(', '), ['Alice Smith', 'Bob Jones'])
+        self.assertEqual(conversation['messages'][0], {
+            'message_body': 'message 0', 'sender': {'full_name': 'Alice Smith'}
+        })
+
+    def test_expand_renders_all_fields_of_a_relation(self):
+        data = self.client.get('/api/users/me/', {'expand': 'conversations'}).data
+        conversation = data['conversations'][0]
+        self.assertEqual(len(conversation['messages']), 2)
+        self.assertIsInstance(conversation['messages'][0], uuid.UUID)
+        self.assertCountEqual(conversation['participants'], [self.alice.user_id, self.bob.user_id])
+
+    def test_unrequested_data_is_not_queried(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/me/', {'fields': 'user_id,email'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # validators and the user row, nothing prefetched
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertNotIn('"password"', context.captured_queries[-1]['sql'])
+
+
+class FastMessageSerializationTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.bob.phone_number = '+33 6 12 34 56 78'
+        self.bob.first_name = 'Bób'
+        self.bob.save()
+        self.create_messages(3)
+        self.create_messages(2, sender=self.bob)
+
+    def test_output_is_byte_identical(self):
+        messages = Message.objects.order_by('sent_at', 'message_id')
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(serialize_message_values(message_values(messages))),
+            renderer.render(MessageSerializer(messages, many=True).data),
+        )
+
+    def test_conversation_messages_response_is_unchanged(self):
+        expected = MessageSerializer(Message.objects.order_by('sent_at'), many=True).data
+        with self.assertNumQueries(4):
+            # permission check, validators, conversation, messages joined with senders
+            response = self.client.get(
+                f'/api/conversations/{self.conversation.pk}/messages/', HTTP_ACCEPT='application/json'
+            )
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+
+class FastJSONTests(ChatsAPITestCase):
+
+    def test_renders_like_the_stdlib_renderer(self):
+        self.create_messages(3)
+        data = {
+            'results': serialize_message_values(message_values(Message.objects.all())),
+            'raw': [uuid.uuid4(), timezone.now(), timezone.now().date(), Decimal('1.5')],
+            'text': 'café \u2028 \U0001f600',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_indented_output_falls_back_to_stdlib(self):
+        data = {'a': [1, 2]}
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+
+    def test_oversized_integers_fall_back_to_stdlib(self):
+        self.assertEqual(FastJSONRenderer().render({'n': 2 ** 70}), b'{"n":1180591620717411303424}')
+
+    def test_parser(self):
+        response = self.client.post(
+            '/api/messages/',
+            json.dumps({'conversation': str(self.conversation.pk), 'message_body': 'héllo'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['message_body'], 'héllo')
+
+        response = self.client.post('/api/messages/', '{"conversation": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('JSON parse error', response.data['detail'])
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+class MessagePackTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(2)
+        self.create_messages(2, sender=self.bob)
+
+    def test_accept_selects_msgpack(self):
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        json_response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(json_response.content))
+
+    def test_msgpack_request_body(self):
+        response = self.client.post(
+            '/api/messages/',
+            msgpack.packb({'conversation': str(self.conversation.pk), 'message_body': 'packed'}),
+            content_type='application/msgpack'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post('/api/messages/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NormalizedShapeTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(2)
+        self.create_messages(2, sender=self.bob)
+
+    def test_senders_are_sent_once(self):
+        full = self.client.get('/api/messages/').data['results']
+        data = self.client.get('/api/messages/', {'shape': 'normalized'}).data
+        self.assertEqual(set(data['users']), {str(self.alice.user_id), str(self.bob.user_id)})
+        for message, original in zip(data['results'], full):
+            self.assertEqual(data['users'][message['sender']], original['sender'])
+            self.assertEqual(dict(message, sender=original['sender']), original)
+
+    def test_unpaginated_lists_get_an_envelope(self):
+        data = self.client.get(
+            f'/api/conversations/{self.conversation.pk}/messages/', {'shape': 'normalized'}
+        ).data
+        self.assertEqual(len(data['results']), 4)
+        self.assertEqual(len(data['users']), 2)
+
+    def test_sync(self):
+        data = self.client.get('/api/messages/sync/', {'shape': 'normalized'}).data
+        self.assertEqual(len(data['users']), 2)
+        self.assertFalse(data['has_more'])
+
+
+class AsyncReadViewTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(12)
+
+    async def async_get(self, url, params=None, user=None):
+        token = AccessToken.for_user(user or self.alice)
+        return await AsyncClient().get(url, params or {}, headers={'Authorization': f'Bearer {token}'})
+
+    async def assertSameAsSync(self, async_url, sync_url, params=None, status_code=status.HTTP_200_OK):
+        response = await self.async_get(async_url, params)
+        self.assertEqual(response.status_code, status_code, response.content)
+        expected = await sync_to_async(self.client.get)(sync_url, params or {}, HTTP_ACCEPT='application/json')
+        self.assertEqual(expected.status_code, status_code, expected.content)
+        # Pagination links only differ by the async/ prefix
+        content = response.content.replace(b'/api/async/', b'/api/')
+        self.assertEqual(json.loads(content), json.loads(expected.content))
+        return json.loads(content)
+
+    async def test_message_list(self):
+        data = await self.assertSameAsSync('/api/async/messages/', '/api/messages/', {'page': 2})
+        self.assertEqual(data['count'], 12)
+        await self.assertSameAsSync(
+            '/api/async/messages/', '/api/messages/', {'conversation': str(self.conversation.pk)}
+        )
+
+    async def test_message_list_parameters(self):
+        await sync_to_async(self.create_messages)(3, sender=self.bob)
+        await Message.objects.filter(message_body='message 1').aupdate(message_body='hello world')
+        for params in [
+            {'search': 'hello'},
+            {'search': 'message', 'page': 2},
+            {'ordering': '-sent_at'},
+            {'ordering': 'sent_at', 'page': 2},
+            {'sender': str(self.bob.pk)},
+            {'sender': str(self.bob.pk), 'ordering': '-sent_at'},
+        ]:
+            with self.subTest(params=params):
+                await self.assertSameAsSync('/api/async/messages/', '/api/messages/', params)
+        await self.assertSameAsSync(
+            '/api/async/messages/', '/api/messages/', {'conversation': 'not-a-uuid'},
+            status_code=status.HTTP_400_BAD_REQUEST
+        )
+
+    async def test_conversation_list_parameters(self):
+        await User.objects.filter(pk=self.bob.pk).aupdate(first_name='Bobby')
+        other = await sync_to_async(Conversation.objects.create)()
+        await sync_to_async(other.participants.set)([self.alice])
+        for params in [
+            {'search': 'Bobby'},
+            {'participants': str(self.bob.pk)},
+            {'ordering': '-created_at'},
+        ]:
+            with self.subTest(params=params):
+                await self.assertSameAsSync('/api/async/conversations/', '/api/conversations/', params)
+
+    async def test_viewset_only_parameters_are_refused(self):
+        pk = self.conversation.pk
+        for url, params in [
+            ('/api/async/messages/', {'fields': 'message_id'}),
+            ('/api/async/messages/', {'pagination': 'cursor'}),
+            ('/api/async/messages/', {'before': 'x'}),
+            ('/api/async/messages/', {'shape': 'normalized'}),
+            ('/api/async/conversations/', {'expand': 'messages'}),
+            (f'/api/async/conversations/{pk}/', {'fields': 'conversation_id'}),
+            ('/api/async/messages/my_messages/', {'fields': 'message_id'}),
+        ]:
+            with self.subTest(url=url, params=params):
+                response = await self.async_get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(next(iter(params)), json.loads(response.content)['detail'])
+
+    async def test_conditional_requests(self):
+        for url in ('/api/async/messages/', f'/api/async/conversations/{self.conversation.pk}/'):
+            with self.subTest(url=url):
+                response = await self.async_get(url)
+                etag = response['ETag']
+                token = AccessToken.for_user(self.alice)
+                response = await AsyncClient().get(
+                    url, headers={'Authorization': f'Bearer {token}', 'If-None-Match': etag}
+                )
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_conversation_retrieve(self):
+        await self.assertSameAsSync(
+            f'/api/async/conversations/{self.conversation.pk}/',
+            f'/api/conversations/{self.conversation.pk}/'
+        )
+
+    async def test_conversation_list(self):
+        data = json.loads((await self.async_get('/api/async/conversations/')).content)
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(len(data['results'][0]['messages']), 12)
+
+    async def test_my_messages_and_search(self):
+        await self.assertSameAsSync('/api/async/messages/my_messages/', '/api/messages/my_messages/')
+        await self.assertSameAsSync(
+            '/api/async/messages/my_messages/', '/api/messages/my_messages/', {'message_body': 'message'}
+        )
+
+    async def test_conversation_messages(self):
+        url = '/api/async/messages/conversation_messages/'
+        await self.assertSameAsSync(
+            url, '/api/messages/conversation_messages/', {'conversation_id': str(self.conversation.pk)}
+        )
+        response = await self.async_get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_access_control(self):
+        response = await AsyncClient().get('/api/async/messages/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        carol = await sync_to_async(User.objects.create_user)(email='carol@example.com', password='pass1234')
+        response = await self.async_get(f'/api/async/conversations/{self.conversation.pk}/', user=carol)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_get(
+            '/api/async/messages/conversation_messages/',
+            {'conversation_id': str(self.conversation.pk)},
+            user=carol
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = await self.async_get('/api/async/messages/', user=carol)
+        self.assertEqual(json.loads(response.content)['count'], 0)
+
+
+@override_settings(CHATS_DB_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    """
+    A second SQLite file stands in for the replica. Nothing replicates to
+    it, so each test copies the rows the replica should have and the
+    queries on each connection show where reads went.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Added after the test case restricts database access to the
+        # declared aliases, which the replica is not: the runner only
+        # creates test databases for aliases present at startup
+        super().setUpClass()
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': f'{cls.replica_dir.name}/replica.sqlite3',
+            },
+        })['replica']
+        call_command('migrate', database='replica', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def tearDown(self):
+        call_command('flush', database='replica', interactive=False, verbosity=0)
+        super().tearDown()
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(email='alice@example.com', password='pass1234')
+        self.bob = User.objects.create_user(email='bob@example.com', password='pass1234')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        self.replicate(self.alice, self.bob, self.conversation)
+        Conversation.participants.through.objects.using('replica').bulk_create(
+            Conversation.participants.through.objects.all()
+        )
+        self.client.force_authenticate(self.alice)
+
+    def replicate(self, *rows):
+        for row in rows:
+            row.save(using='replica', force_insert=True)
+
+    def create_message(self, body):
+        return Message.objects.create(conversation=self.conversation, sender=self.alice, message_body=body)
+
+    def capture(self):
+        return CaptureQueriesContext(connections['default']), CaptureQueriesContext(connections['replica'])
+
+    def test_safe_actions_read_from_replica(self):
+        self.replicate(self.create_message('replicated'))
+        self.create_message('not replicated yet')
+
+        primary, replica = self.capture()
+        with primary, replica:
+            response = self.client.get('/api/messages/')
+            self.assertEqual(response.data['count'], 1)
+            response = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/')
+            self.assertEqual([m['message_body'] for m in response.data], ['replicated'])
+            response = self.client.get('/api/messages/my_messages/')
+            self.assertEqual(len(response.data), 1)
+        # Only the (cached) membership check reads from the primary
+        self.assertEqual(
+            [query['sql'] for query in primary if 'conversation_participants' not in query['sql']], []
+        )
+        self.assertLessEqual(len(primary), 1)
+        self.assertGreater(len(replica), 0)
+
+    def test_other_actions_read_from_primary(self):
+        self.create_message('not replicated yet')
+        primary, replica = self.capture()
+        with primary, replica:
+            response = self.client.get('/api/messages/sync/')
+            self.assertEqual(len(response.data['results']), 1)
+            self.client.get('/api/conversations/inbox/')
+        self.assertEqual(len(replica), 0)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        with replica_reads():
+            self.assertEqual(Message.objects.count(), 0)
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.create_message('written')
+                self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(len(replica), 0)
+        self.assertFalse(Message.objects.using('replica').exists())
+
+    def test_user_who_wrote_reads_from_primary_until_pin_expires(self):
+        response = self.client.post('/api/messages/', {
+            'conversation': str(self.conversation.pk), 'message_body': 'hello'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.client.get('/api/messages/').data['count'], 1)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/messages/').data['count'], 0)
+
+        cache.clear()
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get('/api/messages/').data['count'], 0)
+
+    def test_membership_checks_ignore_a_lagging_replica(self):
+        carol = User.objects.create_user(email='carol@example.com', password='pass1234')
+        self.replicate(carol)
+        # The replica has not seen carol join yet
+        self.conversation.participants.add(carol)
+        self.client.force_authenticate(carol)
+        url = f'/api/conversations/{self.conversation.pk}/'
+
+        # The conversation itself is read from the replica, where carol
+        # cannot see it yet, but the membership check is not
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(is_participant(self.conversation.pk, carol.pk))
+
+        Conversation.participants.through.objects.using('replica').create(
+            conversation_id=self.conversation.pk, user_id=carol.pk
+        )
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        response = self.client.post('/api/messages/', {
+            'conversation': str(self.conversation.pk), 'message_body': 'hello'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_without_replicas_everything_uses_primary(self):
+        self.create_message('primary only')
+        with override_settings(CHATS_DB_REPLICAS=[]), CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get('/api/messages/').data['count'], 1)
+        self.assertEqual(len(replica), 0)
+
+    async def test_async_views_read_from_replica(self):
+        await sync_to_async(self.create_message)('not replicated yet')
+        token = AccessToken.for_user(self.alice)
+        response = await AsyncClient().get(
+            '/api/async/messages/', headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(json.loads(response.content)['count'], 0)
+
+
+class SQLiteBackendTests(ChatsAPITestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied_on_connect(self):
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+        self.assertEqual(self.pragma('foreign_keys'), 1)
+
+    def test_journal_mode_is_left_to_the_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        name = f'{directory.name}/plain.sqlite3'
+        sqlite3.connect(name).close()
+        wrapper = SQLiteDatabaseWrapper(connections.configure_settings({
+            'default': {'ENGINE': 'chats.sqlite', 'NAME': name},
+        })['default'])
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'delete')
+        self.assertEqual(sorted(path.name for path in Path(directory.name).iterdir()), ['plain.sqlite3'])
+
+    def locked_database(self, release_after, **options):
+        """
+        Return a connection to a fresh database file whose write lock is
+        held by another connection for `release_after` seconds
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        name = f'{directory.name}/locked.sqlite3'
+        wrapper = SQLiteDatabaseWrapper(connections.configure_settings({
+            'default': {'ENGINE': 'chats.sqlite', 'NAME': name, 'OPTIONS': {'timeout': 0.01, **options}},
+        })['default'])
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+
+        holder = sqlite3.connect(name, check_same_thread=False)
+        holder.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(release_after, holder.rollback)
+        timer.start()
+        self.addCleanup(holder.close)
+        self.addCleanup(timer.join)
+        return wrapper
+
+    def test_lock_contention_is_retried(self):
+        wrapper = self.locked_database(0.1, lock_retries=6)
+        with wrapper.cursor() as cursor:
+            cursor.execute('INSERT INTO item DEFAULT VALUES')
+            cursor.execute('SELECT COUNT(*) FROM item')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_lock_retries_are_bounded(self):
+        wrapper = self.locked_database(1, lock_retries=0)
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO item DEFAULT VALUES')
+
+
+class MessageArchiveTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        old = self.create_messages(30)
+        Message.objects.filter(pk__in=[m.pk for m in old]).update(
+            sent_at=F('sent_at') - timedelta(days=400)
+        )
+        self.create_messages(5)
+        self.refresh_activity()
+        self.history = list(Message.objects.order_by('sent_at').values_list('message_id', flat=True))
+
+    def messages_url(self):
+        return f'/api/conversations/{self.conversation.pk}/messages/'
+
+    def test_archive_moves_old_messages_in_batches(self):
+        self.assertEqual(archive_batch(archive_cutoff(), batch_size=7), 7)
+        self.assertEqual(archive_messages(batch_size=7), 23)
+        self.assertEqual(Message.objects.count(), 5)
+        self.assertEqual(
+            list(ArchivedMessage.objects.values_list('message_id', flat=True)), self.history[:30]
+        )
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 35)
+        self.refresh_activity()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 35)
+        self.assertEqual(self.conversation.last_message_id, self.history[-1])
+
+    def test_latest_message_stays_hot(self):
+        Message.objects.filter(pk__in=self.history[30:]).delete()
+        self.refresh_activity()
+        self.assertEqual(archive_messages(), 29)
+        self.assertEqual(list(Message.objects.values_list('pk', flat=True)), [self.history[29]])
+
+    def test_messages_read_through_to_archive(self):
+        archive_messages()
+        response = self.client.get(self.messages_url())
+        self.assertEqual([uuid.UUID(m['message_id']) for m in response.data], self.history)
+
+    def test_cursor_pages_cross_into_archive(self):
+        archive_messages()
+        seen = []
+        url, params = self.messages_url(), {'pagination': 'cursor', 'page_size': 8}
+        while url:
+            response = self.client.get(url, params)
+            seen = [uuid.UUID(m['message_id']) for m in response.data['results']] + seen
+            url, params = response.data['previous'], None
+        self.assertEqual(seen, self.history)
+
+        response = self.client.get(self.messages_url(), {'pagination': 'cursor', 'page_size': 8})
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+        url = response.data['next']
+        seen = [uuid.UUID(m['message_id']) for m in response.data['results']]
+        while url:
+            response = self.client.get(url)
+            seen += [uuid.UUID(m['message_id']) for m in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, self.history)
+
+    def test_hot_pages_do_not_read_archive(self):
+        archive_messages()
+        oldest_hot = Message.objects.order_by('sent_at').first()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.messages_url(), {'pagination': 'cursor', 'page_size': 4})
+            self.assertEqual(len(response.data['results']), 4)
+            response = self.client.get(self.messages_url(), {
+                'after': encode_cursor(oldest_hot.sent_at, oldest_hot.message_id)
+            })
+            self.assertEqual(len(response.data['results']), 4)
+        self.assertFalse(any('message_archive' in query['sql'] for query in queries))
+
+    def test_export_includes_archive(self):
+        call_command('archive_messages', stdout=StringIO())
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/export/')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([uuid.UUID(row['message_id']) for row in rows], self.history)
+
+
+# Temp B-trees that are inherent to an endpoint, by the table the query reads
+MERGED = ('message', 'sort')  # messages of several conversations merged by sent_at
+RANKED = ('message', 'sort')  # full-text matches ordered by rank
+
+
+class QueryPlanTests(ChatsAPITestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query the read endpoints issue for
+    a participant, on a seeded and ANALYZEd dataset. A query fails when
+    it scans a table instead of searching an index, builds an automatic
+    index or sorts in a temp B-tree, unless its endpoint allows that for
+    the table it reads.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Many users, each in a few conversations, most of which have
+        # history. The test user is in more than a page of conversations
+        # and sees a small share of all messages, as any one user does.
+        rng = random.Random(0)
+        users = seed_users(2000)
+        conversations = seed_conversations(users, 1000, 3, rng)
+        cls.user = users[0]
+        for conversation in conversations[:15]:
+            conversation.participants.add(cls.user)
+        for conversation in conversations[:600]:
+            seed_messages(conversation, list(conversation.participants.all()), 40, rng)
+        cls.busy_conversation = conversations[0]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        # The async views only take JWTs
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def endpoints(self):
+        """(url, params, allowed) for every read endpoint"""
+        pk = self.busy_conversation.pk
+        latest = Message.objects.filter(conversation_id=pk).order_by('-sent_at').first()
+        cursor = encode_cursor(latest.sent_at, latest.message_id)
+        # The nested conversations/<pk>/messages/ route of MessageViewSet is
+        # shadowed by ConversationViewSet.messages, which reads ?message_body=
+        return [
+            ('/api/messages/', {}, {MERGED}),
+            ('/api/messages/', {'conversation': pk}, set()),
+            ('/api/messages/', {'pagination': 'cursor'}, {MERGED}),
+            ('/api/messages/', {'before': cursor}, {MERGED}),
+            # Sender names are matched through user_fts
+            ('/api/messages/', {'search': 'hello'}, {RANKED}),
+            ('/api/messages/', {'search': 'First1'}, {RANKED}),
+            (f'/api/messages/{latest.pk}/', {}, set()),
+            ('/api/messages/my_messages/', {}, set()),
+            ('/api/messages/my_messages/', {'message_body': 'hello'}, {RANKED}),
+            # Changes of several conversations merged by sync_seq
+            ('/api/messages/sync/', {}, {MERGED, ('deleted_message', 'sort')}),
+            ('/api/messages/conversation_messages/', {'conversation_id': pk}, set()),
+            ('/api/messages/conversation_messages/', {'conversation_id': pk, 'filter': 'hello'}, {RANKED}),
+            (f'/api/conversations/{pk}/messages/', {}, set()),
+            (f'/api/conversations/{pk}/messages/', {'before': cursor}, set()),
+            (f'/api/conversations/{pk}/messages/', {'message_body': 'hello'}, {RANKED}),
+            (f'/api/conversations/{pk}/export/', {}, set()),
+            ('/api/conversations/', {}, {MERGED}),
+            ('/api/conversations/', {'search': 'First1'}, {MERGED}),
+            (f'/api/conversations/{pk}/', {}, set()),
+            # Ordered on an expression over the activity columns
+            ('/api/conversations/inbox/', {}, {('conversation', 'sort')}),
+            ('/api/users/me/', {}, {MERGED}),
+            (f'/api/users/{self.user.pk}/', {}, {MERGED}),
+            (f'/api/users/{self.user.pk}/conversations/', {}, {MERGED}),
+            ('/api/async/messages/', {}, {MERGED}),
+            ('/api/async/messages/my_messages/', {}, set()),
+            ('/api/async/messages/my_messages/', {'message_body': 'hello'}, {RANKED}),
+            ('/api/async/messages/conversation_messages/', {'conversation_id': pk}, set()),
+            ('/api/async/messages/conversation_messages/', {'conversation_id': pk, 'filter': 'hello'}, {RANKED}),
+            # The user's own conversations, a handful, sorted by creation
+            ('/api/async/conversations/', {}, {MERGED, ('conversation', 'sort')}),
+            (f'/api/async/conversations/{pk}/', {}, set()),
+        ]
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[3] for row in cursor.fetchall()]
+
+    def problems(self, plan):
+        for step in plan:
+            if step.startswith('SCAN ') and 'VIRTUAL TABLE' not in step:
+                yield 'scan', step
+            elif 'AUTOMATIC' in step:
+                yield 'scan', step
+            # Counting the user's distinct conversations in the validators is cheap
+            elif step.startswith('USE TEMP B-TREE') and 'count(DISTINCT)' not in step:
+                yield 'sort', step
+
+    def test_read_endpoints_use_indexes(self):
+        for url, params, allowed in self.endpoints():
+            with self.subTest(url=url, params=params):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, params)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                if 'messages' in url and params.keys() & {'search', 'message_body', 'filter'}:
+                    # The search parameter is the one the view reads
+                    self.assertTrue(any('message_fts' in query['sql'] for query in queries))
+
+                for query in queries:
+                    if 'sqlite_master' in query['sql']:
+                        continue
+                    table = re.search(r'\bFROM "(\w+)"', query['sql']).group(1)
+                    plan = self.plan(query['sql'])
+                    for kind, step in self.problems(plan):
+                        self.assertIn(
+                            (table, kind), allowed,
+                            f'{step} in\n{query["sql"]}\n' + '\n'.join(plan)
+                        )
+
+
+class RequestMetricsTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(5)
+        self.admin = User.objects.create_user(
+            email='admin@example.com', password='pass1234', first_name='Ada', last_name='Admin',
+            role='admin'
+        )
+
+    def observed(self, histogram, labels):
+        """(count, sum) recorded so far for one series"""
+        series = histogram.series.get(labels)
+        return (sum(series[:-1]), series[-1]) if series else (0, 0)
+
+    def test_records_phases_per_route_and_action(self):
+        labels = ('api:message-list', 'list')
+        before = {metric: self.observed(metric, labels) for metric in metrics.REGISTRY[:-1]}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/messages/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        after = {metric: self.observed(metric, labels) for metric in metrics.REGISTRY[:-1]}
+        for metric in before:
+            self.assertEqual(after[metric][0], before[metric][0] + 1, metric.name)
+        self.assertEqual(after[metrics.DB_QUERIES][1] - before[metrics.DB_QUERIES][1], len(queries))
+        for metric in (metrics.DB_DURATION, metrics.SERIALIZE_DURATION, metrics.RENDER_DURATION):
+            self.assertGreater(after[metric][1], before[metric][1], metric.name)
+        self.assertGreater(
+            after[metrics.REQUEST_DURATION][1] - before[metrics.REQUEST_DURATION][1],
+            sum(after[metric][1] - before[metric][1]
+                for metric in (metrics.DB_DURATION, metrics.SERIALIZE_DURATION, metrics.RENDER_DURATION))
+        )
+        self.assertGreaterEqual(metrics.RESPONSES.series[labels + ('200',)], 1)
+
+    def test_actions_are_told_apart(self):
+        self.client.get('/api/messages/my_messages/')
+        self.client.get(f'/api/conversations/{self.conversation.pk}/')
+        self.assertIn(('api:message-my-messages', 'my_messages'), metrics.REQUEST_DURATION.series)
+        self.assertIn(('api:conversation-detail', 'retrieve'), metrics.REQUEST_DURATION.series)
+
+    async def test_records_async_views(self):
+        labels = ('api:async-message-list', 'get')
+        count, _ = self.observed(metrics.DB_QUERIES, labels)
+        token = AccessToken.for_user(self.alice)
+        response = await AsyncClient().get(
+            '/api/async/messages/', headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.observed(metrics.DB_QUERIES, labels)[0], count + 1)
+        # The queries run in a worker thread still count for the request
+        self.assertGreater(metrics.DB_QUERIES.series[labels][-1], 0)
+
+    def test_endpoint_is_admin_only(self):
+        self.assertEqual(self.client.get('/api/_metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+
+    def test_exposition_format(self):
+        self.client.get('/api/messages/')
+        self.client.force_authenticate(self.admin)
+        text = self.client.get('/api/_metrics').content.decode()
+        self.assertIn('# TYPE chats_request_duration_seconds histogram', text)
+        self.assertIn('# TYPE chats_responses_total counter', text)
+
+        prefix = 'chats_db_queries_bucket{route="api:message-list",action="list",'
+        buckets = [line for line in text.splitlines() if line.startswith(prefix)]
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        self.assertEqual(len(buckets), len(metrics.QUERY_COUNT_BUCKETS) + 1)
+        self.assertEqual(counts, sorted(counts))
+        self.assertIn('le="+Inf"', buckets[-1])
+        self.assertIn(
+            f'chats_db_queries_count{{route="api:message-list",action="list"}} {counts[-1]}', text
+        )
+
+    def test_label_values_are_escaped(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', (1,))
+        histogram.observe(('a"b\\c\nd', 'get'), 0.5)
+        self.assertIn(
+            'test_seconds_bucket{route="a\\"b\\\\c\\nd",action="get",le="1"} 1',
+            list(histogram.collect())
+        )
+
+
+class RequestProfilerTests(ChatsAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_messages(5)
+        self.admin = User.objects.create_user(
+            email='admin@example.com', password='pass1234', first_name='Ada', last_name='Admin',
+            role='admin'
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profile_dir = Path(directory.name)
+        settings = override_settings(CHATS_PROFILE_DIR=self.profile_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get_profiled(self, url, user, **headers):
+        self.client.force_authenticate(None)
+        token = AccessToken.for_user(user)
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}', **headers)
+
+    def index(self):
+        index = self.profile_dir / 'index.jsonl'
+        return [json.loads(line) for line in index.read_text().splitlines()] if index.exists() else []
+
+    def test_admin_gets_a_profile_with_the_header(self):
+        url = f'/api/users/{self.alice.pk}/conversations/'
+        response = self.get_profiled(url, self.admin, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        profile_id = response['X-Profile-Id']
+        [entry] = self.index()
+        self.assertEqual(entry['id'], profile_id)
+        self.assertEqual((entry['route'], entry['action']), ('api:user-conversations', 'conversations'))
+        self.assertEqual((entry['trigger'], entry['user']), ('header', str(self.admin.pk)))
+
+        detail = json.loads((self.profile_dir / f'{profile_id}.json').read_text())
+        self.assertEqual(len(detail['sql']), entry['queries'])
+        self.assertTrue(any('FROM "conversation"' in query['sql'] for query in detail['sql']))
+        self.assertEqual(set(detail['phases']), {'db', 'serialize', 'render', 'view'})
+        self.assertAlmostEqual(sum(detail['phases'].values()), detail['duration'])
+        self.assertGreater(detail['phases']['serialize'], 0)
+        code = UserViewSet.conversations.__code__
+        view = f'conversations ({code.co_filename}:{code.co_firstlineno})'
+        self.assertIn(view, [row['function'] for row in detail['functions']])
+        stats = pstats.Stats(str(self.profile_dir / f'{profile_id}.prof'))
+        self.assertTrue(stats.total_calls)
+
+    def test_header_is_ignored_for_other_users(self):
+        response = self.get_profiled('/api/messages/', self.alice, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.index(), [])
+
+    def test_no_profile_by_default(self):
+        self.client.get('/api/messages/')
+        self.assertFalse(self.profile_dir.joinpath('index.jsonl').exists())
+
+    @override_settings(CHATS_PROFILE_SAMPLE_RATE=1)
+    def test_sampled_requests(self):
+        response = self.client.get('/api/messages/')
+        self.assertNotIn('X-Profile-Id', response)
+        [entry] = self.index()
+        self.assertEqual((entry['trigger'], entry['user'], entry['status']), ('sample', None, 200))
+        self.assertTrue(self.profile_dir.joinpath(f'{entry["id"]}.prof').exists())
+
+    @override_settings(CHATS_PROFILE_SAMPLE_RATE=1)
+    def test_credentials_are_left_out_of_the_path(self):
+        self.client.get('/api/messages/', {'token': 'secret', 'page': 2})
+        [entry] = self.index()
+        self.assertEqual(entry['path'], '/api/messages/?page=2')
+        detail = (self.profile_dir / f'{entry["id"]}.json').read_text()
+        self.assertNotIn('secret', detail)
+
+    @override_settings(CHATS_PROFILE_MAX_PROFILES=2)
+    def test_only_the_newest_profiles_are_kept(self):
+        ids = [
+            self.get_profiled('/api/messages/', self.admin, HTTP_X_PROFILE='1')['X-Profile-Id']
+            for _ in range(4)
+        ]
+        kept = sorted(path.stem for path in self.profile_dir.glob('*.json'))
+        self.assertEqual(kept, ids[-2:])
+        self.assertEqual(sorted(path.stem for path in self.profile_dir.glob('*.prof')), kept)
+        self.assertEqual(sorted(entry['id'] for entry in self.index()), kept)
+
+    async def test_async_views(self):
+        token = AccessToken.for_user(self.admin)
+        response = await AsyncClient().get(
+            '/api/async/messages/', headers={'Authorization': f'Bearer {token}', 'X-Profile': '1'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        detail = json.loads((self.profile_dir / f'{response["X-Profile-Id"]}.json').read_text())
+        self.assertEqual(detail['route'], 'api:async-message-list')
+        # The queries the async ORM ran in a worker thread are traced too
+        self.assertTrue(detail['sql'])
+        self.assertGreater(detail['phases']['render'], 0)
+
+
+class LoadHarnessTests(LiveServerTestCase):
+    """The bench_load client against a live server"""
+    # The client connects to 127.0.0.1, which must be an allowed host
+    host = '127.0.0.1'
+
+    def test_search_narrows_the_message_list(self):
+        alice = User.objects.create_user(email='alice@example.com', password='pass1234')
+        conversation = Conversation.objects.create()
+        conversation.participants.set([alice])
+        for body in ('hello there', 'lunch tomorrow?', 'deploy is done'):
+            Message.objects.create(conversation=conversation, sender=alice, message_body=body)
+
+        client = LoadClient(
+            urlsplit(self.live_server_url).port, str(AccessToken.for_user(alice)),
+            [str(conversation.pk)], random.Random(0),
+        )
+        status_code, everything = client.request('GET', '/api/messages/')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(everything['count'], 3)
+        status_code, found = client.search('lunch')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual([m['message_body'] for m in found['results']], ['lunch tomorrow?'])
@@ -6,7 +6,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView,
 )
-from . import views
+from . import async_views, views
 
 app_name = 'api'  # Add namespace for your API
 
@@ -20,20 +20,35 @@ router.register(r'messages', views.MessageViewSet, basename='message')
 conversations_router = nested_routers.NestedDefaultRouter(router, r'conversations', lookup='conversation')
 conversations_router.register(r'messages', views.MessageViewSet, basename='conversation-messages')
 
-# API URL patterns
-api_urlpatterns = [
+# API URL patterns (mounted under api/ by messaging_app.urls)
+urlpatterns = [
     # JWT Authentication endpoints
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     
+    # Server-Sent Events push channel (served through messaging_app/asgi.py)
+    path('stream/', views.message_stream, name='message_stream'),
+    
+    # Prometheus metrics of this process, admins only (see chats/metrics.py)
+    path('_metrics', views.metrics_view, name='metrics'),
+    
+    # Async read endpoints (served through messaging_app/asgi.py)
+    path('async/messages/', async_views.message_list, name='async-message-list'),
+    path('async/messages/my_messages/', async_views.my_messages, name='async-my-messages'),
+    path(
+        'async/messages/conversation_messages/',
+        async_views.conversation_messages,
+        name='async-conversation-messages'
+    ),
+    path('async/conversations/', async_views.conversation_list, name='async-conversation-list'),
+    path(
+        'async/conversations/<uuid:pk>/',
+        async_views.conversation_detail,
+        name='async-conversation-detail'
+    ),
+    
     # API endpoints
     path('', include(router.urls)),
     path('', include(conversations_router.urls)),
-]
-
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/', include(api_urlpatterns)),
-    path('api/', include('chats.urls')),
 ]
\ No newline at end of file
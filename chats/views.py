@@ -1,22 +1,70 @@
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status, filters
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from .models import User, Conversation, Message
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import User, Conversation, Message, SyncCounter
 from .serializers import (
     UserSerializer,
     ConversationSerializer,
     ConversationCreateSerializer,
+    ConversationInboxSerializer,
     MessageSerializer,
     MessageCreateSerializer,
-    UserDetailSerializer
+    MessageSearchResultSerializer,
+    MessageBulkCreateSerializer,
+    MessageBulkItemSerializer,
+    UserDetailSerializer,
+    message_values,
+    normalize_senders,
+    serialize_message_values
 )
-from .permissions import IsOwnerOrReadOnly, IsMessageOwner, IsConversationParticipant
+from .permissions import IsAdmin, IsOwnerOrReadOnly, IsMessageOwner, IsConversationParticipant, is_admin
+from .pagination import MessageCursorPagination
+from .membership import is_participant
+from .conditional import conversation_validators, user_validators
+from .search import MessageSearchFilter, search_messages
+from .selection import FieldSelection, prepare_queryset
+from .archive import conversation_history
+from .exports import CONTENT_TYPES, STREAMS, iterate_async
+from .sync import get_batch_size, sync_messages
+from .auth import CustomJWTAuthentication
+from .realtime import get_broker, publish_messages, user_channel
+from .routers import ReplicaReadsMixin
+from . import metrics
 
 
-class UserViewSet(viewsets.ModelViewSet):
+SHAPE_PARAM = 'shape'
+
+
+def message_list_response(request, messages, respond=Response):
+    """
+    Build the response for a list of serialized messages with `respond`.
+    With ?shape=normalized senders go to a `users` side table and each
+    message refers to its sender by id.
+    """
+    if request.query_params.get(SHAPE_PARAM) != 'normalized':
+        return respond(messages)
+    messages, users = normalize_senders(messages)
+    response = respond(messages)
+    if isinstance(response.data, dict):
+        response.data['users'] = users
+    else:
+        response.data = {'results': response.data, 'users': users}
+    return response
+
+
+class UserViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing User instances
     """
@@ -53,8 +101,16 @@ class UserViewSet(viewsets.ModelViewSet):
         Admin users can see all users
         """
         if self.request.user.is_staff or self.request.user.role == 'admin':
-            return User.objects.all()
-        return User.objects.filter(user_id=self.request.user.user_id)
+            queryset = User.objects.all()
+        else:
+            queryset = User.objects.filter(user_id=self.request.user.user_id)
+        
+        if self.action == 'retrieve':
+            queryset = prepare_queryset(
+                queryset, UserDetailSerializer, self.request,
+                *UserDetailSerializer.get_prefetch_lookups()
+            )
+        return queryset
     
     def retrieve(self, request, *args, **kwargs):
         """
@@ -66,7 +122,8 @@ class UserViewSet(viewsets.ModelViewSet):
                 {'error': 'You can only view your own profile'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().retrieve(request, *args, **kwargs)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def conversations(self, request, pk=None):
@@ -80,22 +137,35 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
             
-        conversations = user.conversations.all()
-        serializer = ConversationSerializer(conversations, many=True)
+        conversations = prepare_queryset(
+            user.conversations.all(), ConversationSerializer, request,
+            *ConversationSerializer.get_prefetch_lookups()
+        )
+        serializer = ConversationSerializer(conversations, many=True, context={'request': request})
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def me(self, request):
         """Get current user's profile"""
-        serializer = UserDetailSerializer(request.user)
-        return Response(serializer.data)
+        validators = user_validators(request.user)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        
+        user = prepare_queryset(
+            User.objects.all(), UserDetailSerializer, request,
+            *UserDetailSerializer.get_prefetch_lookups()
+        ).get(user_id=request.user.user_id)
+        serializer = UserDetailSerializer(user, context={'request': request})
+        return validators.apply(request, Response(serializer.data))
 
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Conversation instances
     """
     queryset = Conversation.objects.all()
+    replica_actions = ('list', 'retrieve', 'messages')
     permission_classes = [IsAuthenticated, IsConversationParticipant]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend]
     search_fields = ['participants__first_name', 'participants__last_name']
@@ -105,13 +175,28 @@ class ConversationViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return ConversationCreateSerializer
+        if self.action == 'inbox':
+            return ConversationInboxSerializer
         return ConversationSerializer
     
     def get_queryset(self):
         """Return conversations where the current user is a participant"""
         if self.request.user.is_staff or self.request.user.role == 'admin':
-            return Conversation.objects.all()
-        return Conversation.objects.filter(participants=self.request.user)
+            queryset = Conversation.objects.all()
+        else:
+            queryset = Conversation.objects.filter(participants=self.request.user)
+        
+        if self.action in ['list', 'retrieve']:
+            queryset = prepare_queryset(
+                queryset, ConversationSerializer, self.request,
+                *ConversationSerializer.get_prefetch_lookups()
+            )
+        elif self.action == 'inbox':
+            # Served from the denormalized activity columns
+            queryset = queryset.select_related('last_message__sender').prefetch_related(
+                'participants'
+            ).annotate(last_activity_at=Coalesce('last_message_at', 'created_at'))
+        return queryset
     
     def get_permissions(self):
         """
@@ -123,6 +208,22 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated()]
         return [IsAuthenticated(), IsConversationParticipant()]
     
+    def get_validators(self, pk):
+        """Conditional request validators for a conversation the user may see, or None"""
+        if not (is_admin(self.request.user) or is_participant(pk, self.request.user.user_id)):
+            return None
+        return conversation_validators(pk)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a conversation, answering 304 if the client's copy is current"""
+        validators = self.get_validators(kwargs['pk'])
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        return validators.apply(request, super().retrieve(request, *args, **kwargs))
+    
     def list(self, request, *args, **kwargs):
         """List conversations with filtering"""
         queryset = self.filter_queryset(self.get_queryset())
@@ -135,6 +236,21 @@ class ConversationViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """List conversations by last activity with a preview of the last message"""
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            '-last_activity_at', '-conversation_id'
+        )
+        
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+    
     def create(self, request, *args, **kwargs):
         """Create a new conversation"""
         # Add current user to participant_ids if not already included
@@ -159,16 +275,79 @@ class ConversationViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         """Get all messages for a specific conversation"""
+        validators = self.get_validators(pk)
+        if validators is not None:
+            not_modified = validators.not_modified(request)
+            if not_modified is not None:
+                return not_modified
+        
         conversation = self.get_object()
-        messages = conversation.messages.all()
+        # Filter directly: the conversation.messages back-reference would reload deferred columns
+        archived, messages = conversation_history(conversation)
         
         # Apply filtering to messages if query parameters are provided
+        serializer_class = MessageSerializer
         message_body_filter = request.query_params.get('message_body', None)
         if message_body_filter:
-            messages = messages.filter(message_body__icontains=message_body_filter)
+            # Search covers hot messages only
+            messages = search_messages(messages, message_body_filter)
+            archived = None
+            serializer_class = MessageSearchResultSerializer
         
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        # Plain listings skip the serializer and render straight from values() rows
+        fast = not message_body_filter and FieldSelection.from_request(request) is None
+        if fast:
+            prepare = message_values
+        else:
+            def prepare(queryset):
+                return prepare_queryset(queryset, serializer_class, request)
+        messages = prepare(messages)
+        archived = prepare(archived) if archived is not None else None
+        
+        def serialize(rows):
+            if fast:
+                return serialize_message_values(rows)
+            return serializer_class(rows, many=True, context={'request': request}).data
+        
+        # Page through long histories with keyset cursors when requested,
+        # reading through to archived messages past the hot ones
+        if MessageCursorPagination.is_requested(request):
+            paginator = MessageCursorPagination()
+            page = paginator.paginate_queryset(messages, request, view=self, archive=archived)
+            response = message_list_response(
+                request, serialize(page), paginator.get_paginated_response
+            )
+        else:
+            # message_count includes archived messages, so the archive is only read when it has some
+            if archived is not None and conversation.message_count > len(messages):
+                messages = [*archived, *messages]
+            response = message_list_response(request, serialize(messages))
+        if validators is not None:
+            validators.apply(request, response)
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        Stream the conversation's full history as NDJSON (default) or CSV,
+        selected with ?export_format=ndjson|csv
+        """
+        conversation = self.get_object()
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in STREAMS:
+            return Response(
+                {'error': f"export_format must be one of: {', '.join(STREAMS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        chunks = STREAMS[export_format](conversation_history(conversation))
+        if isinstance(request._request, ASGIRequest):
+            chunks = iterate_async(chunks)
+        response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = (
+            f'attachment; filename="conversation-{conversation.pk}.{export_format}"'
+        )
+        return response
     
     @action(detail=True, methods=['post'])
     def add_participant(self, request, pk=None):
@@ -229,13 +408,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Message instances
     """
     queryset = Message.objects.all()
+    replica_actions = ('list', 'retrieve', 'my_messages')
     permission_classes = [IsAuthenticated, IsMessageOwner]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter, DjangoFilterBackend]
+    filter_backends = [MessageSearchFilter, filters.OrderingFilter, DjangoFilterBackend]
     search_fields = ['message_body', 'sender__first_name', 'sender__last_name']
     ordering_fields = ['sent_at']
     filterset_fields = ['sender', 'conversation']
@@ -243,15 +423,58 @@ class MessageViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return MessageCreateSerializer
+        if self.is_search():
+            return MessageSearchResultSerializer
         return MessageSerializer
     
+    def use_fast_serializer(self):
+        """Return True if the list can be rendered with serialize_message_values"""
+        return (
+            self.action == 'list'
+            and not self.is_search()
+            and FieldSelection.from_request(self.request) is None
+        )
+    
+    def is_search(self):
+        """Return True if the request runs a message search"""
+        if self.request is None:
+            return False
+        params = self.request.query_params
+        if self.action == 'list':
+            return bool(params.get(MessageSearchFilter.search_param, '').strip())
+        if self.action == 'my_messages':
+            return bool(params.get('message_body'))
+        if self.action == 'conversation_messages':
+            return bool(params.get('filter'))
+        return False
+    
     def get_queryset(self):
         """Return messages from conversations where the current user is a participant"""
         if self.request.user.is_staff or self.request.user.role == 'admin':
-            return Message.objects.all()
-            
-        user_conversations = Conversation.objects.filter(participants=self.request.user)
-        return Message.objects.filter(conversation__in=user_conversations)
+            queryset = Message.objects.all()
+        else:
+            # A join rather than conversation__in=<subquery>: with table
+            # statistics SQLite can plan the subquery form as a scan of user
+            queryset = Message.objects.filter(conversation__participants=self.request.user)
+        
+        # Scope to the parent conversation on conversations/<id>/messages/
+        conversation_pk = self.kwargs.get('conversation_pk')
+        if conversation_pk:
+            queryset = queryset.filter(conversation_id=conversation_pk)
+        
+        if self.action == 'list':
+            queryset = prepare_queryset(queryset, self.get_serializer_class(), self.request)
+        return queryset
+    
+    @property
+    def paginator(self):
+        """Use keyset pagination when the client asks for it"""
+        if not hasattr(self, '_paginator'):
+            if self.action == 'list' and MessageCursorPagination.is_requested(self.request):
+                self._paginator = MessageCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
     
     def get_permissions(self):
         """
@@ -266,6 +489,13 @@ class MessageViewSet(viewsets.ModelViewSet):
     
     def list(self, request, *args, **kwargs):
         """List messages with filtering"""
+        validators = None
+        if not is_admin(request.user):
+            validators = user_validators(request.user)
+            not_modified = validators.not_modified(request)
+            if not_modified is not None:
+                return not_modified
+        
         queryset = self.filter_queryset(self.get_queryset())
         
         # Filter by conversation if provided
@@ -273,13 +503,23 @@ class MessageViewSet(viewsets.ModelViewSet):
         if conversation_id:
             queryset = queryset.filter(conversation__conversation_id=conversation_id)
         
+        fast = self.use_fast_serializer()
+        if fast:
+            queryset = message_values(queryset)
+        
+        def serialize(rows):
+            if fast:
+                return serialize_message_values(rows)
+            return self.get_serializer(rows, many=True).data
+        
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+            response = message_list_response(request, serialize(page), self.get_paginated_response)
+        else:
+            response = message_list_response(request, serialize(queryset))
+        if validators is not None:
+            validators.apply(request, response)
+        return response
     
     def create(self, request, *args, **kwargs):
         """Create a new message"""
@@ -289,14 +529,13 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         # Check if user is a participant in the conversation
         conversation_id = mutable_data.get('conversation')
-        if conversation_id:
+        if conversation_id and not is_participant(conversation_id, request.user.user_id):
             try:
-                conversation = Conversation.objects.get(conversation_id=conversation_id)
-                if not conversation.participants.filter(user_id=request.user.user_id).exists():
-                    return Response(
-                        {'error': 'You are not a participant in this conversation'},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+                Conversation.objects.get(conversation_id=conversation_id)
+                return Response(
+                    {'error': 'You are not a participant in this conversation'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
             except Conversation.DoesNotExist:
                 return Response(
                     {'error': 'Conversation not found'},
@@ -305,12 +544,131 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(data=mutable_data)
         serializer.is_valid(raise_exception=True)
-        message = serializer.save()
+        with transaction.atomic():
+            message = serializer.save()
+            Conversation.record_message(message)
+            transaction.on_commit(lambda: publish_messages([message]))
         
         # Return the created message with full details
         response_serializer = MessageSerializer(message)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many messages, possibly across conversations, in one request.
+        Membership is checked with a single query and all valid messages are
+        inserted in one transaction. Returns a result per submitted item.
+        """
+        envelope = MessageBulkCreateSerializer(data=request.data)
+        envelope.is_valid(raise_exception=True)
+        items = envelope.validated_data['messages']
+        
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = MessageBulkItemSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': serializer.errors
+                }
+        
+        # Existence and membership of every referenced conversation in one query
+        through = Conversation.participants.through
+        membership = dict(
+            Conversation.objects.filter(
+                conversation_id__in={data['conversation'] for _, data in valid}
+            ).annotate(
+                is_participant=Exists(through.objects.filter(
+                    conversation_id=OuterRef('pk'), user_id=request.user.user_id
+                ))
+            ).values_list('conversation_id', 'is_participant')
+        )
+        
+        # Spread sent_at by a microsecond so the batch keeps its order
+        now = timezone.now()
+        messages = []
+        for offset, (index, data) in enumerate(valid):
+            is_participant = membership.get(data['conversation'])
+            if is_participant is None:
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_404_NOT_FOUND,
+                    'errors': {'conversation': ['Conversation not found']}
+                }
+            elif not is_participant:
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_403_FORBIDDEN,
+                    'errors': {'conversation': ['You are not a participant in this conversation']}
+                }
+            else:
+                message = Message(
+                    sender_id=request.user.user_id,
+                    conversation_id=data['conversation'],
+                    message_body=data['message_body'],
+                    sent_at=now + timedelta(microseconds=offset)
+                )
+                messages.append(message)
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_201_CREATED,
+                    'message_id': str(message.message_id),
+                    'sent_at': message.sent_at
+                }
+        
+        if messages:
+            with transaction.atomic():
+                # bulk_create skips Message.save(), which numbers changes for delta sync
+                first = SyncCounter.reserve(len(messages))
+                for offset, message in enumerate(messages):
+                    message.sync_seq = first + offset
+                Message.objects.bulk_create(messages)
+                Conversation.record_messages(messages)
+                for message in messages:
+                    message.sender = request.user
+                transaction.on_commit(lambda: publish_messages(messages))
+        
+        response_status = status.HTTP_201_CREATED
+        if len(messages) != len(items):
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response({'created': len(messages), 'results': results}, status=response_status)
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            message = serializer.save()
+            Conversation.touch([message.conversation_id])
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Conversation.forget_message(instance)
+    
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Messages created or edited after the `since` mark across all of the
+        user's conversations, in the order of the changes, and the ids of
+        the messages deleted since in `deleted`. Call again with the
+        returned `since` while `has_more` is true.
+        """
+        messages, deleted, since, has_more = sync_messages(
+            request.user,
+            since=request.query_params.get('since'),
+            batch_size=get_batch_size(request.query_params.get('limit'))
+        )
+        return message_list_response(
+            request,
+            MessageSerializer(messages, many=True).data,
+            lambda results: Response({
+                'since': since, 'has_more': has_more, 'results': results, 'deleted': deleted
+            })
+        )
+    
     @action(detail=False, methods=['get'])
     def my_messages(self, request):
         """Get all messages sent by the current user"""
@@ -319,7 +677,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         # Apply filtering
         message_body_filter = request.query_params.get('message_body', None)
         if message_body_filter:
-            messages = messages.filter(message_body__icontains=message_body_filter)
+            messages = search_messages(messages, message_body_filter)
         
         serializer = self.get_serializer(messages, many=True)
         return Response(serializer.data)
@@ -338,7 +696,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         try:
             conversation = Conversation.objects.get(conversation_id=conversation_id)
             # Check if user is a participant
-            if not conversation.participants.filter(user_id=request.user.user_id).exists():
+            if not is_participant(conversation.pk, request.user.user_id):
                 return Response(
                     {'error': 'You are not a participant in this conversation'}, 
                     status=status.HTTP_403_FORBIDDEN
@@ -349,7 +707,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             # Apply filtering
             message_body_filter = request.query_params.get('filter', None)
             if message_body_filter:
-                messages = messages.filter(message_body__icontains=message_body_filter)
+                messages = search_messages(messages, message_body_filter)
             
             serializer = self.get_serializer(messages, many=True)
             return Response(serializer.data)
@@ -357,4 +715,60 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Response(
                 {'error': 'Conversation not found'}, 
                 status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+
+
+STREAM_HEARTBEAT_SECONDS = 15
+
+
+def authenticate_stream(request):
+    """
+    Resolve the user of a stream request from the Authorization header or,
+    since EventSource cannot set headers, a ?token= query parameter
+    """
+    auth = CustomJWTAuthentication()
+    raw_token = request.GET.get('token')
+    if raw_token:
+        validated_token = auth.get_validated_token(raw_token.encode())
+        return auth.get_user(validated_token)
+    result = auth.authenticate(request)
+    return result[0] if result else None
+
+
+async def message_stream(request):
+    """
+    Server-Sent Events stream of messages created in the user's
+    conversations. Needs an ASGI server (see messaging_app/asgi.py).
+    """
+    try:
+        user = await sync_to_async(authenticate_stream)(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({'detail': str(exc.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    async def events():
+        async with get_broker().subscribe(user_channel(user.user_id)) as subscription:
+            # Tell the client the stream is live and how long to wait before reconnecting
+            yield 'retry: 3000\n\n'
+            while True:
+                payload = await subscription.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                if payload is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield f'event: message\ndata: {payload}\n\n'
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdmin])
+def metrics_view(request):
+    """Request metrics of this process in the Prometheus text format, for admins"""
+    return HttpResponse(metrics.render_metrics(), content_type=metrics.CONTENT_TYPE)
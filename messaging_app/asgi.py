@@ -3,6 +3,13 @@ ASGI config for messaging_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The push channel at api/stream/ streams Server-Sent Events from an async
+view, and the read endpoints under api/async/ run on the event loop with
+the async ORM (see chats.async_views). Both need this ASGI entry point,
+e.g.:
+
+    uvicorn messaging_app.asgi:application
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +19,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
+# Django advises against persistent connections under ASGI: a connection
+# opened in one of the threads sync code runs in is not closed at the end
+# of the request, so each thread would keep its own open
+os.environ.setdefault('CHATS_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
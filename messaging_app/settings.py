@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
+from importlib.util import find_spec
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its latency covers the other middleware; see chats/metrics.py
+    'chats.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +56,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Profiles requests on demand; see chats/profiling.py
+    'chats.profiling.RequestProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'messaging_app.urls'
@@ -80,11 +86,87 @@ WSGI_APPLICATION = 'messaging_app.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # Django's SQLite backend with tuned PRAGMAs, BEGIN IMMEDIATE and
+        # bounded lock retries; see chats/sqlite/base.py. Switch a database
+        # to WAL once with `manage.py enable_wal`: the mode is stored in the
+        # file, so setting it on connect would rewrite the checked-in one.
+        'ENGINE': 'chats.sqlite',
+        # CHATS_DB_PATH points a process at another file, e.g. the
+        # server bench_load starts on its seeded database
+        'NAME': os.environ.get('CHATS_DB_PATH', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # Busy timeout: seconds to wait for another writer's lock
+            'timeout': 5,
+        },
+        # Keep connections open across requests, checked before reuse.
+        # messaging_app/asgi.py sets CHATS_CONN_MAX_AGE=0, as Django advises
+        # against persistent connections under ASGI.
+        'CONN_MAX_AGE': int(os.environ.get('CHATS_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas are extra DATABASES entries listed in CHATS_DB_REPLICAS, e.g.
+#   DATABASES['replica'] = {'ENGINE': ..., 'NAME': ..., 'TEST': {'MIRROR': 'default'}}
+#   CHATS_DB_REPLICAS = ['replica']
+# Safe list/retrieve-style actions read from them; see chats/routers.py.
+DATABASE_ROUTERS = ['chats.routers.PrimaryReplicaRouter']
+CHATS_DB_REPLICAS = []
+
+# Seconds a user who wrote keeps reading from the primary while replicas catch up
+CHATS_DB_PRIMARY_PIN_SECONDS = 5
+
+# Messages older than this many days are moved to the archive table by
+# `manage.py archive_messages`; see chats/archive.py. Lowering it is safe,
+# raising it hides archived messages newer than the new cutoff from
+# forward cursor pages.
+CHATS_ARCHIVE_AFTER_DAYS = 365
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# LocMemCache is per process; point this at a shared backend (Redis,
+# Memcached) when running several workers so invalidations reach all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Users resolved from JWTs, bounded and expiring
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth',
+        'TIMEOUT': 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Seconds a cached "is this user a participant" answer stays valid. With a
+# per-process cache this is how long a removed participant keeps access in
+# the other workers; see chats/membership.py.
+CHATS_MEMBERSHIP_CACHE_TIMEOUT = 60
+
+# Cache alias for users resolved by chats.auth.CustomJWTAuthentication
+CHATS_USER_CACHE = 'auth'
+
+# Build the user for safe requests from token claims instead of the database.
+# Such requests only see deactivation or profile changes once the token expires.
+CHATS_JWT_USER_FROM_CLAIMS = False
+
+# Pub/sub backend for pushing new messages to connected clients. The
+# in-process broker only reaches clients of the same process.
+CHATS_REALTIME_BROKER = 'chats.realtime.InProcessBroker'
+
+
+# Request profiles (chats.profiling): admins get one by sending the header,
+# and this fraction of all requests is profiled too. cProfile slows the
+# profiled requests down, so keep the rate low. Only the newest
+# CHATS_PROFILE_MAX_PROFILES profiles are kept.
+CHATS_PROFILE_DIR = BASE_DIR / 'profiles'
+CHATS_PROFILE_HEADER = 'X-Profile'
+CHATS_PROFILE_SAMPLE_RATE = 0
+CHATS_PROFILE_MAX_PROFILES = 500
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -130,7 +212,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',  # JWT Authentication
+        'chats.auth.CustomJWTAuthentication',  # JWT Authentication with cached users
         'rest_framework.authentication.SessionAuthentication',  # Session Authentication for admin   
          'rest_framework.authentication.BasicAuthentication',  # ← ADD THIS LINE
     ],
@@ -142,6 +224,17 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    # orjson-backed JSON, falling back to the stdlib encoder when orjson is missing,
+    # plus MessagePack (Accept: application/msgpack) when msgpack is installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'chats.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['chats.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+    'DEFAULT_PARSER_CLASSES': [
+        'chats.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ] + (['chats.parsers.MessagePackParser'] if find_spec('msgpack') else []),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
@@ -165,6 +258,9 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',  # CHANGED: Use 'user_id' as claim name
     
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
+    'TOKEN_OBTAIN_SERIALIZER': 'chats.auth_serializers.CustomTokenObtainPairSerializer',
+    # Refreshed access tokens carry the user's current claims
+    'TOKEN_REFRESH_SERIALIZER': 'chats.auth_serializers.CustomTokenRefreshSerializer',
     'TOKEN_TYPE_CLAIM': 'token_type',
     
     'JTI_CLAIM': 'jti',